@@ -0,0 +1,71 @@
+"""JWT authentication that does not load the user row on every request.
+
+Access tokens carry the user's ``token_version`` (claim ``ver``). The
+authenticated user is cached for ``AUTH_USER_CACHE_TTL`` seconds under
+their ID and that version, so most requests cost one cache read instead of
+a primary-key query. Saving a user drops their entry (see
+``accounts.signals``); ``User.revoke_tokens`` bumps the version, which
+rejects every token issued before it.
+
+With ``AUTH_TRUST_TOKEN_CLAIMS`` on, GET/HEAD requests to views that set
+``trust_token_claims = True`` skip even the cache and get an unsaved
+``User`` holding only the ID from the token. Those views must use nothing
+of ``request.user`` but its ID. Revoked tokens and deactivated users are
+not detected on that path until the token expires.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+User = get_user_model()
+
+VERSION_CLAIM = 'ver'
+
+
+def cache_key(user_id, version):
+    return f'auth_user:{user_id}:{version}'
+
+
+def invalidate(user):
+    cache.delete(cache_key(user.pk, user.token_version))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    request = None
+
+    def authenticate(self, request):
+        # DRF creates authenticators per request, so keeping it here is safe
+        self.request = request
+        return super().authenticate(request)
+
+    def trusts_claims(self):
+        if not settings.AUTH_TRUST_TOKEN_CLAIMS or self.request is None:
+            return False
+        view = self.request.parser_context.get('view')
+        return (
+            self.request.method in SAFE_METHODS and
+            getattr(view, 'trust_token_claims', False)
+        )
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+        version = validated_token.get(VERSION_CLAIM, 0)
+
+        if self.trusts_claims():
+            return User(id=user_id, token_version=version)
+
+        key = cache_key(user_id, version)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(validated_token)
+            if user.token_version != version:
+                raise AuthenticationFailed('Token has been revoked.', code='token_revoked')
+            cache.set(key, user, settings.AUTH_USER_CACHE_TTL)
+        return user
@@ -0,0 +1,140 @@
+"""Cached friend adjacency sets.
+
+Each user's accepted friend IDs and pending incoming/outgoing request IDs
+are kept in the cache as one entry, so friend listings and timeline fan-out
+are set lookups. Friendship status for a page of users only needs the
+viewer's entry, or the rows between the viewer and those users when it is
+not cached; nobody else's sets are loaded for it.
+
+Entries are keyed by a per-user version token. The views that change a
+friendship call ``invalidate`` for both users after the write, which
+replaces the token: a reader that loaded the old rows concurrently stores
+them under the old token, where nobody looks any more.
+"""
+import uuid
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from .models import Friendship
+
+FriendSets = namedtuple('FriendSets', ('friends', 'pending_in', 'pending_out'))
+
+
+def _version_key(user_id):
+    return f'friend-sets-version:{user_id}'
+
+
+def _key(user_id, version):
+    return f'friend-sets:{user_id}:{version}'
+
+
+def _versions(user_ids):
+    """Return ``{user_id: version token}``, creating missing tokens."""
+    keys = {_version_key(user_id): user_id for user_id in user_ids}
+    versions = {keys[key]: version for key, version in cache.get_many(keys).items()}
+    for user_id in set(user_ids) - versions.keys():
+        # Whoever adds the token first wins; everyone then uses that one
+        cache.add(_version_key(user_id), uuid.uuid4().hex, None)
+        versions[user_id] = cache.get(_version_key(user_id))
+    return versions
+
+
+def _build_sets(user_id, rows):
+    friends, pending_in, pending_out = set(), set(), set()
+    for from_id, to_id, status in rows:
+        if status == 'accepted':
+            friends.add(to_id if from_id == user_id else from_id)
+        # Rejected requests stay "pending" to both sides, as they always
+        # have, so a rejected sender cannot re-send the same request.
+        elif from_id == user_id:
+            pending_out.add(to_id)
+        else:
+            pending_in.add(from_id)
+    return FriendSets(frozenset(friends), frozenset(pending_in), frozenset(pending_out))
+
+
+def get_many_friend_sets(user_ids):
+    """Return ``{user_id: FriendSets}``, loading every cold entry in one query."""
+    user_ids = set(user_ids)
+    versions = _versions(user_ids)
+    keys = {_key(user_id, versions[user_id]): user_id for user_id in user_ids}
+    found = {keys[key]: sets for key, sets in cache.get_many(keys).items()}
+
+    missing = user_ids - found.keys()
+    if missing:
+        rows = list(Friendship.objects.filter(
+            Q(from_user_id__in=missing) | Q(to_user_id__in=missing)
+        ).values_list('from_user_id', 'to_user_id', 'status'))
+        loaded = {
+            user_id: _build_sets(
+                user_id,
+                [row for row in rows if user_id in (row[0], row[1])]
+            )
+            for user_id in missing
+        }
+        cache.set_many(
+            {_key(user_id, versions[user_id]): sets for user_id, sets in loaded.items()},
+            settings.FRIEND_CACHE_TTL
+        )
+        found.update(loaded)
+    return found
+
+
+def get_friend_sets(user_id):
+    return get_many_friend_sets([user_id])[user_id]
+
+
+def invalidate(*user_ids):
+    cache.set_many(
+        {_version_key(user_id): uuid.uuid4().hex for user_id in user_ids},
+        None
+    )
+
+
+def friend_ids(user_id):
+    return get_friend_sets(user_id).friends
+
+
+def fingerprint(user_id):
+    """Value that changes whenever the user's friend sets change."""
+    return _versions([user_id])[user_id]
+
+
+def _status(sets, viewer_id, user_id):
+    if viewer_id == user_id:
+        return 'self'
+    if user_id in sets.friends:
+        return 'friends'
+    if user_id in sets.pending_out:
+        return 'pending_sent'
+    if user_id in sets.pending_in:
+        return 'pending_received'
+    return 'none'
+
+
+def friendship_status(viewer_id, user_id):
+    return friendship_statuses(viewer_id, [user_id])[user_id]
+
+
+def friendship_statuses(viewer_id, user_ids):
+    """Resolve the viewer's relationship to many users at once.
+
+    Uses the viewer's cached sets when there are any; otherwise reads only
+    the friendships between the viewer and ``user_ids`` (one query).
+    """
+    user_ids = set(user_ids)
+    others = user_ids - {viewer_id}
+    sets = FriendSets(frozenset(), frozenset(), frozenset())
+    if others:
+        version = _versions([viewer_id])[viewer_id]
+        sets = cache.get(_key(viewer_id, version))
+    if sets is None:
+        rows = Friendship.objects.filter(
+            Q(from_user_id=viewer_id, to_user_id__in=others) |
+            Q(to_user_id=viewer_id, from_user_id__in=others)
+        ).values_list('from_user_id', 'to_user_id', 'status')
+        sets = _build_sets(viewer_id, rows)
+    return {user_id: _status(sets, viewer_id, user_id) for user_id in user_ids}
@@ -0,0 +1,33 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from accounts.search import index_user
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Build or repair the user search token index.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_pk = 0
+        total = 0
+
+        while True:
+            users = list(
+                User.objects.filter(pk__gt=last_pk)
+                .order_by('pk')
+                .only('pk', 'email', 'first_name', 'last_name')[:chunk_size]
+            )
+            if not users:
+                break
+            last_pk = users[-1].pk
+            for user in users:
+                index_user(user)
+            total += len(users)
+
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} user(s)'))
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.26 on 2026-10-18 10:02
+
+from django.db import migrations, models
+from django.db.models import Count
+
+CHUNK_SIZE = 1000
+
+
+def fill_posts_count(apps, schema_editor):
+    User = apps.get_model('accounts', 'User')
+    Post = apps.get_model('posts', 'Post')
+    # Deleted posts wait for their purge job and no longer count
+    counts = (
+        Post.objects.filter(is_deleted=False)
+        .order_by().values_list('author').annotate(n=Count('pk'))
+    )
+    User.objects.bulk_update(
+        [User(pk=user_id, posts_count=n) for user_id, n in counts],
+        ['posts_count'],
+        batch_size=CHUNK_SIZE
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_token_version'),
+        ('posts', '0006_soft_delete'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='posts_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_posts_count, migrations.RunPython.noop),
+    ]
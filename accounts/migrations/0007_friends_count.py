@@ -0,0 +1,42 @@
+# Generated by Django 4.2.26 on 2026-10-18 10:36
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count
+
+CHUNK_SIZE = 1000
+
+
+def fill_friends_count(apps, schema_editor):
+    User = apps.get_model('accounts', 'User')
+    Friendship = apps.get_model('accounts', 'Friendship')
+    counts = Counter()
+    for side in ('from_user', 'to_user'):
+        rows = (
+            Friendship.objects.filter(status='accepted')
+            .order_by().values_list(side).annotate(n=Count('pk'))
+        )
+        for user_id, n in rows:
+            counts[user_id] += n
+    User.objects.bulk_update(
+        [User(pk=user_id, friends_count=n) for user_id, n in counts.items()],
+        ['friends_count'],
+        batch_size=CHUNK_SIZE
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_posts_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='friends_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_friends_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.26 on 2026-10-18 11:50
+
+from django.db import migrations
+
+from accounts.search import user_tokens
+
+CHUNK_SIZE = 1000
+
+
+def fill_search_tokens(apps, schema_editor):
+    User = apps.get_model('accounts', 'User')
+    UserSearchToken = apps.get_model('accounts', 'UserSearchToken')
+    # Users saved since 0003 were indexed by the post_save signal; index the rest
+    users = User.objects.filter(search_tokens__isnull=True).order_by('pk')
+    last_pk = 0
+    while True:
+        chunk = list(
+            users.filter(pk__gt=last_pk).only('pk', 'email', 'first_name', 'last_name')[:CHUNK_SIZE]
+        )
+        if not chunk:
+            break
+        last_pk = chunk[-1].pk
+        UserSearchToken.objects.bulk_create([
+            UserSearchToken(user_id=user.pk, token=token, weight=weight)
+            for user in chunk
+            for token, weight in user_tokens(user).items()
+        ], batch_size=CHUNK_SIZE, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_user_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_search_tokens, migrations.RunPython.noop),
+    ]
@@ -46,6 +46,8 @@ class User(AbstractBaseUser, PermissionsMixin):
         null=True,
         blank=True
     )
+    profile_picture_variants = models.JSONField(null=True, blank=True)
+    cover_photo_variants = models.JSONField(null=True, blank=True)
     location = models.CharField(max_length=100, blank=True, default='')  # NEW
     website = models.URLField(max_length=200, blank=True, default='')  # NEW
     is_online = models.BooleanField(default=False)  # NEW
@@ -53,6 +55,13 @@ class User(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
     date_joined = models.DateTimeField(default=timezone.now)
+    # Changes with every save; ETags of responses that embed the user use it
+    updated_at = models.DateTimeField(auto_now=True)
+    # Part of every access token; bumping it revokes all issued tokens
+    token_version = models.PositiveIntegerField(default=0)
+    # Kept in step by posts.counters; recount_engagement repairs drift
+    posts_count = models.PositiveIntegerField(default=0)
+    friends_count = models.PositiveIntegerField(default=0)
 
     objects = UserManager()
 
@@ -73,14 +82,12 @@ class User(AbstractBaseUser, PermissionsMixin):
     def get_full_name(self):
         return f"{self.first_name} {self.last_name}"
 
-    @property
-    def posts_count(self):  # NEW
-        return self.posts.count()
-
-    @property
-    def friends_count(self):  # NEW
-        return self.friends_initiated.filter(status='accepted').count() + \
-               self.friends_received.filter(status='accepted').count()
+    def revoke_tokens(self):
+        """Reject every token issued to this user so far."""
+        from .authentication import invalidate
+        invalidate(self)
+        self.token_version += 1
+        self.save(update_fields=['token_version'])
 
 
 class Friendship(models.Model):
@@ -118,4 +125,24 @@ class Friendship(models.Model):
         ]
 
     def __str__(self):
-        return f"{self.from_user.email} -> {self.to_user.email} ({self.status})"
\ No newline at end of file
+        return f"{self.from_user.email} -> {self.to_user.email} ({self.status})"
+
+class UserSearchToken(models.Model):
+    """One word of a user's name or email, for indexed prefix search."""
+    WEIGHT_EMAIL = 1
+    WEIGHT_NAME = 2
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='search_tokens'
+    )
+    token = models.CharField(max_length=50)
+    weight = models.PositiveSmallIntegerField(default=WEIGHT_NAME)
+
+    class Meta:
+        db_table = 'user_search_tokens'
+        unique_together = ('token', 'user')
+
+    def __str__(self):
+        return f"{self.token} -> {self.user_id}"
@@ -0,0 +1,127 @@
+"""Live presence from client heartbeats.
+
+A heartbeat (``POST /api/auth/presence/``) only touches memory: the time is
+stored in the cache, where ``UserSerializer`` reads it, and in a
+per-process buffer. A background thread (unless ``PRESENCE_FLUSH_THREAD``
+is off) writes the buffer to ``users.last_seen`` every
+``PRESENCE_FLUSH_INTERVAL`` seconds in batched UPDATEs and clears
+``is_online`` for users silent for longer than ``PRESENCE_TIMEOUT``; a
+failed write keeps the buffer for the next flush. Reads take the newer of the cached heartbeat and the
+``last_seen``/``is_online`` columns, so presence recorded by another process
+(with a per-process cache) is still seen after its next flush.
+"""
+import atexit
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+FLUSH_BATCH_SIZE = 500
+
+_pending = {}
+_lock = threading.Lock()
+_flusher = None
+
+
+def _key(user_id):
+    return f'presence:{user_id}'
+
+
+def heartbeat(user_id):
+    now = timezone.now()
+    cache.set(_key(user_id), now, settings.PRESENCE_TIMEOUT)
+    with _lock:
+        _pending[user_id] = now
+        _start_flusher()
+
+
+def leave(user_id):
+    """Mark a user offline right away (on logout)."""
+    cache.delete(_key(user_id))
+    with _lock:
+        _pending.pop(user_id, None)
+    User.objects.filter(id=user_id).update(is_online=False, last_seen=timezone.now())
+
+
+def _fresh(seen):
+    return seen >= timezone.now() - timedelta(seconds=settings.PRESENCE_TIMEOUT)
+
+
+def _state(live, last_seen, is_online):
+    if live is not None and (last_seen is None or live >= last_seen):
+        return live, _fresh(live)
+    return last_seen, bool(is_online and last_seen and _fresh(last_seen))
+
+
+def current(user_id, last_seen=None, is_online=False):
+    """Return ``(last_seen, is_online)``; the arguments are the stored columns."""
+    return _state(cache.get(_key(user_id)), last_seen, is_online)
+
+
+def current_many(users):
+    """Return ``{user_id: (last_seen, is_online)}`` with one cache read."""
+    live = cache.get_many([_key(user.id) for user in users])
+    return {
+        user.id: _state(live.get(_key(user.id)), user.last_seen, user.is_online)
+        for user in users
+    }
+
+
+def flush():
+    """Write buffered heartbeats to the users table."""
+    global _pending
+    with _lock:
+        pending, _pending = _pending, {}
+    if not pending:
+        return
+    try:
+        User.objects.bulk_update(
+            [User(id=user_id, last_seen=seen, is_online=True) for user_id, seen in pending.items()],
+            ['last_seen', 'is_online'],
+            batch_size=FLUSH_BATCH_SIZE
+        )
+    except Exception:
+        # Back into the buffer; heartbeats that arrived meanwhile are newer
+        with _lock:
+            _pending = {**pending, **_pending}
+        raise
+
+
+def sweep():
+    """Clear ``is_online`` for users whose last heartbeat is too old."""
+    cutoff = timezone.now() - timedelta(seconds=settings.PRESENCE_TIMEOUT)
+    return User.objects.filter(
+        Q(last_seen__lt=cutoff) | Q(last_seen__isnull=True),
+        is_online=True
+    ).update(is_online=False)
+
+
+def _run():
+    while True:
+        time.sleep(settings.PRESENCE_FLUSH_INTERVAL)
+        try:
+            close_old_connections()
+            flush()
+            sweep()
+        except Exception:
+            logger.exception('Presence flush failed')
+
+
+def _start_flusher():
+    # Called with _lock held
+    global _flusher
+    if _flusher is None and settings.PRESENCE_FLUSH_THREAD:
+        _flusher = threading.Thread(target=_run, name='presence-flusher', daemon=True)
+        _flusher.start()
+        atexit.register(flush)
@@ -0,0 +1,131 @@
+"""Indexed user search.
+
+Every user's name and email words are stored in ``UserSearchToken``. A query
+is split into terms and each term becomes a prefix range read on the token
+index, so typeahead search never scans the ``users`` table. The database
+groups the matching tokens by user, keeps users matching every term and
+scores them; the searcher's friends and pending requests are matched in a
+separate query and ranked higher. Other users are only looked for among the
+first ``SEARCH_CANDIDATES`` tokens of each term's range, in token order
+(exact words first), so a one-letter prefix costs no more than a long one;
+typing more letters narrows the range.
+"""
+from functools import reduce
+from operator import add, or_
+
+from django.contrib.auth import get_user_model
+from django.db.models import Case, Exists, F, Max, OuterRef, Q, When
+
+from buddyscript_backend.search import tokenize, prefix_range, TOKEN_MAX_LENGTH
+from .models import Friendship, UserSearchToken
+
+User = get_user_model()
+
+MAX_TERMS = 5
+# Token rows read per term to find users outside the viewer's friends and
+# requests
+SEARCH_CANDIDATES = 1000
+
+EXACT_SCORE = 3
+PREFIX_SCORE = 2
+FRIEND_SCORE = 4
+PENDING_SCORE = 2
+
+
+def user_tokens(user):
+    """Return ``{token: weight}`` for the words a user can be found by."""
+    # Only the local part of the email is indexed: domain words such as
+    # "gmail" or "com" are shared by most users and would flood every range.
+    tokens = {}
+    local_part = user.email.partition('@')[0].lower()
+    email_tokens = tokenize(local_part)
+    if local_part:
+        email_tokens.append(local_part[:TOKEN_MAX_LENGTH])
+    for token in email_tokens:
+        tokens[token] = UserSearchToken.WEIGHT_EMAIL
+    for token in tokenize(f'{user.first_name} {user.last_name}'):
+        tokens[token] = UserSearchToken.WEIGHT_NAME
+    return tokens
+
+
+def index_user(user):
+    """Bring a user's search tokens in line with their current name and email."""
+    wanted = user_tokens(user)
+    existing = dict(
+        UserSearchToken.objects.filter(user=user).values_list('token', 'weight')
+    )
+    if wanted == existing:
+        return
+
+    stale = [token for token in existing if wanted.get(token) != existing[token]]
+    if stale:
+        UserSearchToken.objects.filter(user=user, token__in=stale).delete()
+    UserSearchToken.objects.bulk_create([
+        UserSearchToken(user=user, token=token, weight=weight)
+        for token, weight in wanted.items()
+        if existing.get(token) != weight
+    ])
+
+
+def _matches(terms, queryset):
+    """Aggregate token rows into one row per user matching every term, with
+    their text score (the best token score for each term, summed)."""
+    ranges = [Q(**prefix_range('token', term)) for term in terms]
+    per_term = {
+        f'term{index}': Max(Case(
+            When(token=term, then=F('weight') * EXACT_SCORE),
+            When(match, then=F('weight') * PREFIX_SCORE),
+            default=0
+        ))
+        for index, (term, match) in enumerate(zip(terms, ranges))
+    }
+    return (
+        queryset.filter(reduce(or_, ranges))
+        .values('user_id')
+        .annotate(**per_term)
+        # HAVING: every term has to match the user somewhere
+        .filter(**{f'{name}__gt': 0 for name in per_term})
+        .annotate(score=reduce(add, (F(name) for name in per_term)))
+    )
+
+
+def search_users(viewer, query, limit=20):
+    if '@' in query:
+        query = query.partition('@')[0]
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_TERMS]
+    if not terms:
+        return []
+    tokens = UserSearchToken.objects.exclude(user_id=viewer.id)
+
+    # Friends and pending requests are matched on their own, so a boost can
+    # never be lost to the text-score cut-off below
+    related = Q(user_id__in=Friendship.objects.filter(from_user_id=viewer.id).values('to_user_id')) | Q(
+        user_id__in=Friendship.objects.filter(to_user_id=viewer.id).values('from_user_id')
+    )
+    accepted = Friendship.objects.filter(
+        Q(from_user_id=viewer.id, to_user_id=OuterRef('user_id')) |
+        Q(to_user_id=viewer.id, from_user_id=OuterRef('user_id')),
+        status='accepted'
+    )
+    scores = {
+        row['user_id']: row['score'] + (FRIEND_SCORE if row['friend'] else PENDING_SCORE)
+        for row in _matches(terms, tokens.filter(related)).annotate(friend=Exists(accepted))
+    }
+
+    # Anyone else can only be in the results if their text score alone is
+    # among the best ``limit`` of the candidates
+    candidates = set()
+    for term in terms:
+        candidates.update(
+            tokens.filter(**prefix_range('token', term))
+            .order_by('token', 'user_id')
+            .values_list('user_id', flat=True)[:SEARCH_CANDIDATES]
+        )
+    if candidates:
+        matches = _matches(terms, tokens.filter(user_id__in=candidates))
+        for row in matches.order_by('-score', 'user_id')[:limit]:
+            scores.setdefault(row['user_id'], row['score'])
+
+    ranked = sorted(scores, key=lambda user_id: (-scores[user_id], user_id))[:limit]
+    users = User.objects.filter(id__in=ranked).in_bulk()
+    return [users[user_id] for user_id in ranked if user_id in users]
@@ -2,11 +2,73 @@ from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 from .models import Friendship
+from . import friend_cache, presence
+from buddyscript_backend.images import variant_urls
+from buddyscript_backend.serializers import DynamicFieldsMixin, TimedDataMixin
 from django.db import models
 
 User = get_user_model()
 
 
+def prime_friendship_statuses(context, users):
+    """Resolve ``friendship_status`` for every user about to be rendered.
+
+    The result is stored in the serializer context, where
+    ``UserSerializer.get_friendship_status`` looks it up, so a list of users
+    costs at most one friendship query instead of one per user.
+    """
+    request = context.get('request')
+    if not request or not request.user.is_authenticated:
+        return
+    statuses = context.setdefault('friendship_statuses', {})
+    user_ids = {user.id for user in users if user is not None} - statuses.keys()
+    if user_ids:
+        statuses.update(friend_cache.friendship_statuses(request.user.id, user_ids))
+
+
+def prime_presence(context, users):
+    """Read live presence for every user about to be rendered in one cache call."""
+    states = context.setdefault('presence', {})
+    missing = [user for user in users if user is not None and user.id not in states]
+    if missing:
+        states.update(presence.current_many(missing))
+
+
+# What an embedded UserSerializer renders from, besides the viewer's friend
+# sets: the row version, the stored counters (updated without save()) and
+# the stored presence
+VERSION_FIELDS = ('id', 'updated_at', 'posts_count', 'friends_count', 'last_seen', 'is_online')
+
+
+def user_versions(users):
+    """Version data of ``users`` for an ETag, live presence included.
+
+    ``users`` need only ``VERSION_FIELDS`` loaded; costs one cache read.
+    """
+    users = {user.id: user for user in users if user is not None}
+    live = presence.current_many(users.values())
+    return [
+        (user_id, users[user_id].updated_at, users[user_id].posts_count,
+         users[user_id].friends_count, *live[user_id])
+        for user_id in sorted(users)
+    ]
+
+
+def prefetched(obj, name):
+    """Return a prefetched relation as a list, or [] if it was not prefetched."""
+    cache = getattr(obj, '_prefetched_objects_cache', {})
+    return list(cache[name]) if name in cache else []
+
+
+class UserListSerializer(TimedDataMixin, serializers.ListSerializer):
+    def to_representation(self, data):
+        users = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        prime_friendship_statuses(self.context, users)
+        prime_presence(self.context, users)
+        return super().to_representation(users)
+
+
+
 class UserRegistrationSerializer(serializers.ModelSerializer):
     password = serializers.CharField(
         write_only=True,
@@ -56,24 +118,29 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Last name cannot be empty.")
         return value
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     full_name = serializers.SerializerMethodField()
     profile_picture_url = serializers.SerializerMethodField()
+    profile_picture_variants = serializers.SerializerMethodField()
     cover_photo_url = serializers.SerializerMethodField()
+    cover_photo_variants = serializers.SerializerMethodField()
     posts_count = serializers.IntegerField(read_only=True)
     friends_count = serializers.IntegerField(read_only=True)
     friendship_status = serializers.SerializerMethodField()  # NEW
+    is_online = serializers.SerializerMethodField()
+    last_seen = serializers.SerializerMethodField()
 
     class Meta:
         model = User
         fields = (
             'id', 'email', 'first_name', 'last_name', 'full_name',
-            'bio', 'profile_picture', 'profile_picture_url',
-            'cover_photo', 'cover_photo_url', 'location', 'website',
+            'bio', 'profile_picture', 'profile_picture_url', 'profile_picture_variants',
+            'cover_photo', 'cover_photo_url', 'cover_photo_variants', 'location', 'website',
             'is_online', 'last_seen', 'date_joined',
             'posts_count', 'friends_count', 'friendship_status'
         )
         read_only_fields = ('id', 'date_joined', 'is_online', 'last_seen')
+        list_serializer_class = UserListSerializer
 
     def get_full_name(self, obj):
         return obj.get_full_name()
@@ -84,6 +151,11 @@ class UserSerializer(serializers.ModelSerializer):
             return request.build_absolute_uri(obj.profile_picture.url) if request else obj.profile_picture.url
         return None
 
+    def get_profile_picture_variants(self, obj):
+        if obj.profile_picture:
+            return variant_urls(obj.profile_picture_variants, self.context.get('request'))
+        return None
+
     def get_cover_photo_url(self, obj):
         if obj.cover_photo:
             request = self.context.get('request')
@@ -91,29 +163,33 @@ class UserSerializer(serializers.ModelSerializer):
                 return request.build_absolute_uri(obj.cover_photo.url)
         return None
 
+    def get_cover_photo_variants(self, obj):
+        if obj.cover_photo:
+            return variant_urls(obj.cover_photo_variants, self.context.get('request'))
+        return None
+
+    def _presence(self, obj):
+        states = self.context.get('presence', {})
+        if obj.id in states:
+            return states[obj.id]
+        return presence.current(obj.id, obj.last_seen, obj.is_online)
+
+    def get_is_online(self, obj):
+        return self._presence(obj)[1]
+
+    def get_last_seen(self, obj):
+        seen = self._presence(obj)[0]
+        return serializers.DateTimeField().to_representation(seen) if seen else None
+
     def get_friendship_status(self, obj):
         request = self.context.get('request')
         if not request or not request.user.is_authenticated:
             return None
 
-        if obj.id == request.user.id:
-            return 'self'
-
-        # Check if friendship exists
-        friendship = Friendship.objects.filter(
-            models.Q(from_user=request.user, to_user=obj) |
-            models.Q(from_user=obj, to_user=request.user)
-        ).first()
-
-        if not friendship:
-            return 'none'
-
-        if friendship.status == 'accepted':
-            return 'friends'
-        elif friendship.from_user == request.user:
-            return 'pending_sent'
-        else:
-            return 'pending_received'
+        statuses = self.context.get('friendship_statuses', {})
+        if obj.id in statuses:
+            return statuses[obj.id]
+        return friend_cache.friendship_status(request.user.id, obj.id)
 
 
 class UserUpdateSerializer(serializers.ModelSerializer):
@@ -131,6 +207,15 @@ class UserUpdateSerializer(serializers.ModelSerializer):
         return value
 
 
+class FriendshipListSerializer(TimedDataMixin, serializers.ListSerializer):
+    def to_representation(self, data):
+        friendships = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        users = [f.from_user for f in friendships] + [f.to_user for f in friendships]
+        prime_friendship_statuses(self.context, users)
+        prime_presence(self.context, users)
+        return super().to_representation(friendships)
+
+
 class FriendshipSerializer(serializers.ModelSerializer):
     from_user = UserSerializer(read_only=True)
     to_user = UserSerializer(read_only=True)
@@ -138,4 +223,5 @@ class FriendshipSerializer(serializers.ModelSerializer):
     class Meta:
         model = Friendship
         fields = ('id', 'from_user', 'to_user', 'status', 'created_at', 'updated_at')
-        read_only_fields = ('id', 'created_at', 'updated_at')
\ No newline at end of file
+        read_only_fields = ('id', 'created_at', 'updated_at')
+        list_serializer_class = FriendshipListSerializer
\ No newline at end of file
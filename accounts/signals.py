@@ -0,0 +1,23 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from . import authentication
+from .search import index_user
+
+User = get_user_model()
+
+SEARCHABLE_FIELDS = {'email', 'first_name', 'last_name'}
+
+
+@receiver(post_save, sender=User)
+def update_search_tokens(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not SEARCHABLE_FIELDS & set(update_fields):
+        return
+    index_user(instance)
+
+
+@receiver(post_save, sender=User)
+def drop_cached_user(sender, instance, **kwargs):
+    # Profile edits and deactivation must not be served from the auth cache
+    authentication.invalidate(instance)
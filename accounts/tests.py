@@ -1,3 +1,571 @@
-from django.test import TestCase
+from datetime import timedelta
+from importlib import import_module
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.core.cache import cache
+from django.core.management import call_command
+from django.conf import settings
+from django.db import OperationalError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from jobs import queue
+from posts.models import Post, PostLike
+from posts.tests import QueryBudgetTestCase
+
+from . import friend_cache, presence
+from .views import CustomTokenObtainPairSerializer
+from .models import User, Friendship, UserSearchToken
+from .search import search_users, user_tokens
+
+
+class AccountEndpointBudgets(QueryBudgetTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.friend = cls.people[1]
+        cls.stranger = User.objects.create_user(
+            email='stranger@example.com',
+            first_name='Stranger',
+            last_name='Person',
+            password='password-123'
+        )
+        cls.request_received = Friendship.objects.filter(
+            to_user=cls.viewer, status='pending'
+        ).first()
+
+    def test_register(self):
+        self.client.force_authenticate(None)
+        self.assertBudget(
+            'post', '/api/auth/register/', 6, status=201,
+            data={
+                'email': 'newcomer@example.com',
+                'first_name': 'New',
+                'last_name': 'Comer',
+                'password': 'a-long-password-123',
+                'password2': 'a-long-password-123',
+            },
+            format='json'
+        )
+
+    def test_login(self):
+        self.client.force_authenticate(None)
+        self.assertBudget(
+            'post', '/api/auth/login/', 1,
+            data={'email': self.viewer.email, 'password': 'password-123'},
+            format='json'
+        )
+
+    def test_profile(self):
+        self.assertBudget('get', '/api/auth/profile/', 1)
+
+    def test_update_profile(self):
+        self.assertBudget(
+            'patch', '/api/auth/profile/', 2,
+            data={'bio': 'Hello there'}, format='json'
+        )
+
+    def test_presence(self):
+        self.assertBudget('post', '/api/auth/presence/', 0, status=204)
+        self.assertBudget('delete', '/api/auth/presence/', 1, status=204)
+
+    def test_user_detail(self):
+        self.assertBudget('get', f'/api/auth/users/{self.friend.id}/', 4)
+
+    def test_user_search(self):
+        response = self.assertBudget('get', '/api/auth/users/search/?q=first', 5)
+        self.assertTrue(response.data['results'])
+
+    def test_friends(self):
+        response = self.assertBudget('get', '/api/auth/friends/', 4)
+        self.assertTrue(response.data['results'])
+
+    def test_friend_requests(self):
+        response = self.assertBudget('get', '/api/auth/friend-requests/', 3)
+        self.assertTrue(response.data['results'])
+
+    def test_send_friend_request(self):
+        self.assertBudget(
+            'post', f'/api/auth/friend-requests/send/{self.stranger.id}/', 5, status=201
+        )
+
+    def test_accept_friend_request(self):
+        self.assertBudget(
+            'post', f'/api/auth/friend-requests/{self.request_received.id}/respond/', 9,
+            data={'action': 'accept'}, format='json'
+        )
+
+    def test_unfriend(self):
+        self.assertBudget('delete', f'/api/auth/unfriend/{self.friend.id}/', 6)
+
+
+class AccountEndpointBudgetsLargeGraph(AccountEndpointBudgets):
+    """The same budgets with three times the users, friends and requests."""
+    scale = {'users': 24, 'likes': 8, 'comments': 6, 'replies': 4}
+
+
+class FriendCacheTests(APITestCase):
+    """Cached friend sets and stored friend counts follow friendship changes."""
+
+    def setUp(self):
+        cache.clear()
+        self.alice, self.bob = [
+            User.objects.create_user(
+                email=f'{name}@example.com', first_name=name.title(), last_name='Test',
+                password='password-123'
+            )
+            for name in ('alice', 'bob')
+        ]
+
+    def profile(self, viewer, user):
+        self.client.force_authenticate(viewer)
+        return self.client.get(f'/api/auth/users/{user.id}/').data
+
+    def befriend(self):
+        self.client.force_authenticate(self.alice)
+        self.client.post(f'/api/auth/friend-requests/send/{self.bob.id}/')
+        request = Friendship.objects.get(from_user=self.alice, to_user=self.bob)
+        self.client.force_authenticate(self.bob)
+        self.client.post(
+            f'/api/auth/friend-requests/{request.id}/respond/', {'action': 'accept'}, format='json'
+        )
+
+    def test_request_accept_and_unfriend(self):
+        # Warm both users' cached sets before every change
+        self.assertEqual(self.profile(self.alice, self.bob)['friendship_status'], 'none')
+        self.assertEqual(friend_cache.friend_ids(self.bob.id), frozenset())
+
+        self.client.force_authenticate(self.alice)
+        self.client.post(f'/api/auth/friend-requests/send/{self.bob.id}/')
+        self.assertEqual(self.profile(self.alice, self.bob)['friendship_status'], 'pending_sent')
+        self.assertEqual(self.profile(self.bob, self.alice)['friendship_status'], 'pending_received')
+
+        request = Friendship.objects.get(from_user=self.alice, to_user=self.bob)
+        self.client.force_authenticate(self.bob)
+        self.client.post(
+            f'/api/auth/friend-requests/{request.id}/respond/', {'action': 'accept'}, format='json'
+        )
+        profile = self.profile(self.alice, self.bob)
+        self.assertEqual((profile['friendship_status'], profile['friends_count']), ('friends', 1))
+        self.assertEqual(friend_cache.friend_ids(self.bob.id), {self.alice.id})
+
+        self.client.force_authenticate(self.alice)
+        self.client.delete(f'/api/auth/unfriend/{self.bob.id}/')
+        profile = self.profile(self.bob, self.alice)
+        self.assertEqual((profile['friendship_status'], profile['friends_count']), ('none', 0))
+        self.assertEqual(friend_cache.friend_ids(self.alice.id), frozenset())
+
+    @override_settings(JOBS_RUN_INLINE=False)
+    def test_accepting_fills_both_timelines(self):
+        posts = {}
+        for user in (self.alice, self.bob):
+            self.client.force_authenticate(user)
+            self.client.post('/api/posts/', {'content': 'before', 'visibility': 'public'}, format='json')
+            posts[user] = Post.objects.get(author=user).id
+        self.befriend()
+        while (job := queue.claim()) is not None:
+            self.assertTrue(queue.run(job))
+
+        for user in (self.alice, self.bob):
+            self.client.force_authenticate(user)
+            results = self.client.get('/api/posts/timeline/').data['results']
+            self.assertEqual({post['id'] for post in results}, set(posts.values()))
+
+    def test_accepting_twice_counts_once(self):
+        self.befriend()
+        request = Friendship.objects.get(from_user=self.alice, to_user=self.bob)
+        self.client.post(
+            f'/api/auth/friend-requests/{request.id}/respond/', {'action': 'accept'}, format='json'
+        )
+        self.bob.refresh_from_db()
+        self.assertEqual(self.bob.friends_count, 1)
+
+    def test_stale_reload_is_not_served(self):
+        stale = friend_cache.get_friend_sets(self.alice.id)
+        version = friend_cache.fingerprint(self.alice.id)
+        self.befriend()
+        # A reload that read the rows before the change stores them late
+        cache.set(friend_cache._key(self.alice.id, version), stale)
+        self.assertEqual(friend_cache.friend_ids(self.alice.id), {self.bob.id})
+        self.assertNotEqual(friend_cache.fingerprint(self.alice.id), version)
+
+    def test_statuses_do_not_load_other_users_sets(self):
+        self.befriend()
+        cache.clear()
+        statuses = friend_cache.friendship_statuses(self.alice.id, [self.alice.id, self.bob.id])
+        self.assertEqual(statuses, {self.alice.id: 'self', self.bob.id: 'friends'})
+        self.assertIsNone(cache.get(friend_cache._key(self.bob.id, friend_cache.fingerprint(self.bob.id))))
+
+class FriendshipStatusListTests(APITestCase):
+    """A list of users gets every ``friendship_status`` from one lookup."""
+
+    def setUp(self):
+        cache.clear()
+        self.viewer, self.friend, self.sent, self.received, self.stranger = [
+            User.objects.create_user(
+                email=f'{name}@example.com', first_name=name.title(), last_name='Test',
+                password='password-123'
+            )
+            for name in ('viewer', 'friend', 'sent', 'received', 'stranger')
+        ]
+        Friendship.objects.create(from_user=self.friend, to_user=self.viewer, status='accepted')
+        Friendship.objects.create(from_user=self.viewer, to_user=self.sent, status='pending')
+        Friendship.objects.create(from_user=self.received, to_user=self.viewer, status='pending')
+        self.post = Post.objects.create(author=self.viewer, content='liked by everyone')
+        for user in (self.viewer, self.friend, self.sent, self.received, self.stranger):
+            PostLike.objects.create(user=user, post=self.post)
+        self.client.force_authenticate(self.viewer)
+
+    def test_likers_list_shows_each_relationship(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f'/api/posts/posts/{self.post.id}/likes/')
+        statuses = {like['user']['id']: like['user']['friendship_status'] for like in response.data['results']}
+        self.assertEqual(statuses, {
+            self.viewer.id: 'self',
+            self.friend.id: 'friends',
+            self.sent.id: 'pending_sent',
+            self.received.id: 'pending_received',
+            self.stranger.id: 'none',
+        })
+        reads = [
+            query for query in context.captured_queries
+            if f'FROM {connection.ops.quote_name(Friendship._meta.db_table)}' in query['sql']
+        ]
+        self.assertEqual(len(reads), 1)
+
+    def test_cached_sets_need_no_query(self):
+        friend_cache.get_friend_sets(self.viewer.id)
+        with CaptureQueriesContext(connection) as context:
+            statuses = friend_cache.friendship_statuses(
+                self.viewer.id, [self.friend.id, self.sent.id, self.received.id, self.stranger.id]
+            )
+        self.assertEqual(len(context.captured_queries), 0)
+        self.assertEqual(
+            [statuses[user.id] for user in (self.friend, self.sent, self.received, self.stranger)],
+            ['friends', 'pending_sent', 'pending_received', 'none']
+        )
+
+
+
+class UserSearchRankingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = cls.person('Viewer', 'Person')
+
+    @classmethod
+    def person(cls, first_name, last_name):
+        return User.objects.create_user(
+            email=f'{first_name}.{last_name}@example.com'.lower(),
+            first_name=first_name, last_name=last_name, password='password-123'
+        )
+
+    def crowd(self, count, first_name, last_name):
+        """Many users indexed without a password hash each."""
+        users = User.objects.bulk_create([
+            User(
+                email=f'crowd{index}.{last_name}@example.com'.lower(),
+                first_name=first_name, last_name=f'{last_name}{index:04}'
+            )
+            for index in range(count)
+        ])
+        UserSearchToken.objects.bulk_create([
+            UserSearchToken(user=user, token=token, weight=weight)
+            for user in users
+            for token, weight in user_tokens(user).items()
+        ])
+
+    def befriend(self, user, status='accepted'):
+        Friendship.objects.create(from_user=self.viewer, to_user=user, status=status)
+
+    def search(self, query):
+        return [user.get_full_name() for user in search_users(self.viewer, query, limit=5)]
+
+    def test_exact_word_ranks_above_prefix(self):
+        self.person('Joseph', 'Brown')
+        self.person('Jo', 'Brown')
+        self.assertEqual(self.search('jo'), ['Jo Brown', 'Joseph Brown'])
+
+    def test_every_term_must_match(self):
+        self.person('John', 'Smith')
+        self.person('John', 'Jones')
+        self.assertEqual(self.search('john smi'), ['John Smith'])
+
+    def test_friend_ranks_above_pending_and_strangers(self):
+        self.person('Sam', 'Stranger')
+        self.befriend(self.person('Sam', 'Pending'), status='pending')
+        self.befriend(self.person('Sam', 'Friend'))
+        self.assertEqual(self.search('sam'), ['Sam Friend', 'Sam Pending', 'Sam Stranger'])
+
+    def test_friend_is_found_behind_many_earlier_matches(self):
+        # Hundreds of "john..." tokens sort before the friend's "johnz"
+        self.crowd(600, 'Johnathan', 'Crowd')
+        self.befriend(self.person('Johnz', 'Friend'))
+        self.assertEqual(self.search('john')[0], 'Johnz Friend')
+
+    def test_terms_intersect_outside_each_terms_first_matches(self):
+        self.crowd(600, 'Anna', 'Aaron')
+        self.crowd(600, 'Zed', 'Walker')
+        self.person('Zedd', 'Aaronz')
+        self.assertEqual(self.search('zed aaron'), ['Zedd Aaronz'])
+
+    def test_short_prefixes_read_a_bounded_range(self):
+        self.crowd(30, 'Mark', 'Crowd')
+        self.person('Mz', 'Stranger')
+        with mock.patch('accounts.search.SEARCH_CANDIDATES', 20):
+            # Behind the crowd's tokens in the "m" range, found once narrowed
+            self.assertNotIn('Mz Stranger', self.search('m'))
+            self.assertEqual(self.search('mz'), ['Mz Stranger'])
+            # Exact words come first in the range
+            self.assertEqual(len(self.search('mark')), 5)
+
+    def test_migration_indexes_existing_users(self):
+        user = self.person('Old', 'Timer')
+        UserSearchToken.objects.filter(user=user).delete()
+        self.assertEqual(self.search('timer'), [])
+        import_module('accounts.migrations.0009_user_search_backfill').fill_search_tokens(apps, None)
+        self.assertEqual(self.search('timer'), ['Old Timer'])
+
+    def test_viewer_is_not_a_result(self):
+        self.assertEqual(self.search('viewer'), [])
+
+
+class PostsCountTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(
+            email='author@example.com', first_name='A', last_name='Author', password='password-123'
+        )
+        self.client.force_authenticate(self.author)
+        self.url = f'/api/auth/users/{self.author.id}/'
+
+    def create_post(self):
+        self.client.post('/api/posts/', {'content': 'hello', 'visibility': 'public'}, format='json')
+        return Post.objects.filter(author=self.author).latest('id')
+
+    def test_profile_follows_creates_and_deletes(self):
+        first = self.create_post()
+        self.create_post()
+        self.assertEqual(self.client.get(self.url).data['posts_count'], 2)
+        self.client.delete(f'/api/posts/{first.id}/')
+        self.assertEqual(self.client.get(self.url).data['posts_count'], 1)
+
+    def test_private_posts_count(self):
+        self.client.post('/api/posts/', {'content': 'mine', 'visibility': 'private'}, format='json')
+        self.assertEqual(self.client.get(self.url).data['posts_count'], 1)
+
+    def test_migration_backfill_skips_deleted_posts(self):
+        self.create_post()
+        self.create_post()
+        Post.objects.filter(pk=self.create_post().pk).update(is_deleted=True)
+        User.objects.update(posts_count=0)
+
+        import_module('accounts.migrations.0006_posts_count').fill_posts_count(apps, None)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.posts_count, 2)
+
+    def test_recount_repairs_drift(self):
+        self.create_post()
+        User.objects.filter(pk=self.author.pk).update(posts_count=5)
+        out = StringIO()
+        call_command('recount_engagement', stdout=out)
+        self.assertIn('0 comment(s) and 1 user(s)', out.getvalue())
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.posts_count, 1)
+
+
+class UserDetailConditionalGetTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.viewer, self.user = [
+            User.objects.create_user(
+                email=f'{name}@example.com', first_name=name.title(), last_name='Test',
+                password='password-123'
+            )
+            for name in ('viewer', 'user')
+        ]
+        self.client.force_authenticate(self.viewer)
+        self.url = f'/api/auth/users/{self.user.id}/'
+
+    def revalidate(self, etag):
+        return self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_profile_is_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.revalidate(etag).status_code, 304)
+
+    def test_profile_changes_change_the_tag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.user.first_name = 'Renamed'
+        self.user.save()
+        response = self.revalidate(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['first_name'], 'Renamed')
+
+    def test_rendered_variants_change_the_tag(self):
+        # What build_variants stores once the background job has run
+        User.objects.filter(pk=self.user.pk).update(
+            profile_picture='profile_pictures/user.jpg',
+            profile_picture_variants={'width': 10, 'height': 10, 'sizes': {}}
+        )
+        etag = self.client.get(self.url)['ETag']
+        User.objects.filter(pk=self.user.pk).update(profile_picture_variants={
+            'width': 20, 'height': 20, 'sizes': {}
+        })
+        response = self.revalidate(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['profile_picture_variants']['width'], 20)
+
+    def test_friendship_changes_change_the_tag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.client.post(f'/api/auth/friend-requests/send/{self.user.id}/')
+        response = self.revalidate(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['friendship_status'], 'pending_sent')
+
+
+class CachedJWTAuthenticationTests(APITestCase):
+    """Requests authenticated with real tokens, not force_authenticate."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(
+            email='user@example.com', first_name='User', last_name='Test', password='password-123'
+        )
+        self.authenticate()
+
+    def authenticate(self):
+        token = CustomTokenObtainPairSerializer.get_token(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def user_queries(self, method, url, **kwargs):
+        """Return the response and how many queries read the users table."""
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, **kwargs)
+        table = connection.ops.quote_name(User._meta.db_table)
+        selects = [
+            query['sql'] for query in context.captured_queries
+            if query['sql'].startswith('SELECT') and f'FROM {table}' in query['sql']
+        ]
+        return response, len(selects)
+
+    def test_second_request_is_served_from_the_cache(self):
+        response, queries = self.user_queries('get', '/api/auth/profile/')
+        self.assertEqual((response.status_code, queries), (200, 1))
+        response, queries = self.user_queries('get', '/api/auth/profile/')
+        self.assertEqual((response.status_code, queries), (200, 0))
+
+    def test_saving_the_user_drops_the_cached_copy(self):
+        self.client.get('/api/auth/profile/')
+        self.user.first_name = 'Renamed'
+        self.user.save()
+        self.assertEqual(self.client.get('/api/auth/profile/').data['first_name'], 'Renamed')
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/auth/profile/').status_code, 401)
+
+    def test_revoked_tokens_are_rejected(self):
+        self.client.get('/api/auth/profile/')
+        self.user.revoke_tokens()
+        self.assertEqual(self.client.get('/api/auth/profile/').status_code, 401)
+
+        self.authenticate()
+        self.assertEqual(self.client.get('/api/auth/profile/').status_code, 200)
+
+    def test_token_from_an_older_version_is_rejected(self):
+        User.objects.filter(pk=self.user.pk).update(token_version=3)
+        response = self.client.get('/api/auth/profile/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['code'], 'token_revoked')
+
+    @override_settings(AUTH_TRUST_TOKEN_CLAIMS=True)
+    def test_claims_are_trusted_only_for_safe_requests_to_marked_views(self):
+        self.user.revoke_tokens()
+
+        # FriendsListView is marked: reads trust the token without a lookup
+        response, queries = self.user_queries('get', '/api/auth/friends/')
+        self.assertEqual((response.status_code, queries), (200, 0))
+        # The profile view is not marked
+        self.assertEqual(self.client.get('/api/auth/profile/').status_code, 401)
+        # Writes to a marked view always check the user
+        response = self.client.post('/api/posts/', {'content': 'hi'}, format='json')
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(Post.objects.exists())
+
+    def test_claims_are_not_trusted_by_default(self):
+        self.user.revoke_tokens()
+        self.assertEqual(self.client.get('/api/auth/friends/').status_code, 401)
+
+
+class PresenceTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        presence._pending.clear()
+        self.addCleanup(presence._pending.clear)
+        self.user = User.objects.create_user(
+            email='user@example.com', first_name='User', last_name='Test', password='password-123'
+        )
+        self.client.force_authenticate(self.user)
+
+    def profile(self):
+        data = self.client.get(f'/api/auth/users/{self.user.id}/').data
+        return data['is_online'], data['last_seen']
+
+    def test_heartbeat_is_written_by_the_next_flush(self):
+        self.client.post('/api/auth/presence/')
+        self.assertIsNone(presence._flusher)
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.is_online, self.user.last_seen), (False, None))
+        self.assertTrue(self.profile()[0])
+
+        presence.flush()
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_online)
+        self.assertIsNotNone(self.user.last_seen)
+        # Seen by processes that do not share this cache
+        cache.clear()
+        self.assertTrue(self.profile()[0])
+
+    def test_failed_flush_keeps_the_heartbeats(self):
+        presence.heartbeat(self.user.id)
+        with mock.patch.object(User.objects, 'bulk_update', side_effect=OperationalError):
+            with self.assertRaises(OperationalError):
+                presence.flush()
+        self.assertIn(self.user.id, presence._pending)
+
+        presence.flush()
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_online)
+        self.assertEqual(presence._pending, {})
+
+    def test_sweep_clears_silent_users(self):
+        stale = timezone.now() - timedelta(seconds=settings.PRESENCE_TIMEOUT + 1)
+        User.objects.filter(pk=self.user.pk).update(is_online=True, last_seen=stale)
+        other = User.objects.create_user(
+            email='other@example.com', first_name='Other', last_name='Test', password='password-123'
+        )
+        presence.heartbeat(other.id)
+        presence.flush()
+
+        self.assertEqual(presence.sweep(), 1)
+        self.assertEqual(
+            dict(User.objects.values_list('email', 'is_online')),
+            {'user@example.com': False, 'other@example.com': True}
+        )
+
+    def test_logout_goes_offline_at_once(self):
+        self.client.post('/api/auth/presence/')
+        self.client.delete('/api/auth/presence/')
+        self.assertFalse(self.profile()[0])
+        self.assertEqual(presence._pending, {})
@@ -4,6 +4,7 @@ from .views import (
     CustomTokenObtainPairView,
     UserRegistrationView,
     UserProfileView,
+    PresenceView,
     UserDetailView,
     UserSearchView,
     SendFriendRequestView,
@@ -21,6 +22,7 @@ urlpatterns = [
 
     # Profile
     path('profile/', UserProfileView.as_view(), name='profile'),
+    path('presence/', PresenceView.as_view(), name='presence'),
     path('users/<int:id>/', UserDetailView.as_view(), name='user-detail'),
     path('users/search/', UserSearchView.as_view(), name='user-search'),
 
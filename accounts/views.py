@@ -5,9 +5,18 @@ from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from django.contrib.auth import get_user_model
 from rest_framework.views import APIView
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
-from django.db.models import Q, Count
 from .models import Friendship
+from . import authentication, friend_cache, presence
+from .search import search_users
+from buddyscript_backend.http_cache import ConditionalGetMixin, make_etag
+from buddyscript_backend.images import discard_variants, schedule_variants
+from events.broker import notify, user_summary
+from jobs.queue import enqueue
+from posts import tasks
+from posts.counters import adjust_counters
 from .serializers import (
     UserRegistrationSerializer,
     UserSerializer,
@@ -19,13 +28,17 @@ User = get_user_model()
 
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token[authentication.VERSION_CLAIM] = user.token_version
+        return token
+
     def validate(self, attrs):
         data = super().validate(attrs)
 
-        # Update user online status
-        self.user.is_online = True
-        self.user.last_seen = timezone.now()
-        self.user.save()
+        # Logging in counts as a heartbeat; no write to the users row
+        presence.heartbeat(self.user.id)
 
         # Add custom claims
         data['user'] = {
@@ -72,30 +85,71 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
             return UserUpdateSerializer
         return UserSerializer
 
+    def perform_update(self, serializer):
+        # Variants of a replaced image are cleared until the new ones are built
+        uploads = [
+            field for field in ('profile_picture', 'cover_photo')
+            if field in serializer.validated_data
+        ]
+        if not uploads:
+            serializer.save()
+            return
+        with transaction.atomic():
+            for field in uploads:
+                discard_variants(getattr(serializer.instance, f'{field}_variants'))
+            user = serializer.save(**{f'{field}_variants': None for field in uploads})
+            for field in uploads:
+                if getattr(user, field):
+                    schedule_variants(user, field, f'{field}_variants')
+
+
+class PresenceView(APIView):
+    """Heartbeat sent periodically by open clients; DELETE on logout"""
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def post(self, request):
+        presence.heartbeat(request.user.id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def delete(self, request):
+        presence.leave(request.user.id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
-class UserDetailView(generics.RetrieveAPIView):
+class UserDetailView(ConditionalGetMixin, generics.RetrieveAPIView):
     """View any user's profile"""
     serializer_class = UserSerializer
     permission_classes = (permissions.IsAuthenticated,)
-    queryset = User.objects.annotate(
-        posts_count=Count('posts'),
-    )
+    trust_token_claims = True
+    queryset = User.objects.all()
     lookup_field = 'id'
 
+    def get_etag(self, request, id):
+        row = User.objects.filter(id=id).values_list(
+            'email', 'first_name', 'last_name', 'bio', 'profile_picture',
+            'cover_photo', 'profile_picture_variants', 'cover_photo_variants',
+            'location', 'website', 'last_seen', 'is_online', 'posts_count', 'friends_count'
+        ).first()
+        if row is None:
+            return None
+        last_seen, is_online = row[-4:-2]
+        return make_etag(
+            'user', id, *row, *presence.current(id, last_seen, is_online),
+            request.user.id,
+            friend_cache.fingerprint(request.user.id)
+        )
+
 
 class UserSearchView(generics.ListAPIView):
     """Search for users"""
     serializer_class = UserSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    trust_token_claims = True
 
     def get_queryset(self):
         query = self.request.query_params.get('q', '')
         if query:
-            return User.objects.filter(
-                Q(first_name__icontains=query) |
-                Q(last_name__icontains=query) |
-                Q(email__icontains=query)
-            ).exclude(id=self.request.user.id)[:20]
+            return search_users(self.request.user, query, limit=20)
         return User.objects.none().order_by('first_name')
 
 
@@ -141,6 +195,11 @@ class SendFriendRequestView(APIView):
             to_user=to_user,
             status='pending'
         )
+        friend_cache.invalidate(request.user.id, to_user.id)
+        notify(to_user.id, 'friend_request', {
+            'friendship_id': friendship.id,
+            'from_user': user_summary(request.user),
+        })
 
         return Response(
             FriendshipSerializer(friendship, context={'request': request}).data,
@@ -167,8 +226,23 @@ class RespondFriendRequestView(APIView):
         action = request.data.get('action')
 
         if action == 'accept':
+            with transaction.atomic():
+                # Only the request that flips the row counts the friendship
+                accepted = Friendship.objects.filter(pk=friendship.pk, status='pending').update(
+                    status='accepted', updated_at=timezone.now()
+                )
+                if accepted:
+                    adjust_counters(
+                        User, [friendship.from_user_id, friendship.to_user_id], 'friends_count', 1
+                    )
+                    # The update skips post_save, which fills new friends'
+                    # timelines for saved friendships
+                    enqueue(tasks.backfill_friends, friendship.from_user_id, friendship.to_user_id)
             friendship.status = 'accepted'
-            friendship.save()
+            notify(friendship.from_user_id, 'friend_request_accepted', {
+                'friendship_id': friendship.id,
+                'user': user_summary(request.user),
+            })
             message = 'Friend request accepted'
         elif action == 'reject':
             friendship.status = 'rejected'
@@ -180,6 +254,8 @@ class RespondFriendRequestView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        friend_cache.invalidate(friendship.from_user_id, friendship.to_user_id)
+
         return Response({
             'message': message,
             'friendship': FriendshipSerializer(friendship, context={'request': request}).data
@@ -190,39 +266,23 @@ class FriendRequestListView(generics.ListAPIView):
     """List pending friend requests received"""
     serializer_class = FriendshipSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    trust_token_claims = True
 
     def get_queryset(self):
         return Friendship.objects.filter(
             to_user=self.request.user,
             status='pending'
-        ).select_related('from_user').order_by('-created_at')
+        ).select_related('from_user', 'to_user').order_by('-created_at')
 
 
 class FriendsListView(generics.ListAPIView):
     """List all friends"""
     serializer_class = UserSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    trust_token_claims = True
 
     def get_queryset(self):
-        user = self.request.user
-
-        # Get accepted friendships
-        friend_ids = set()
-
-        # Friendships where user sent request
-        sent = Friendship.objects.filter(
-            from_user=user,
-            status='accepted'
-        ).values_list('to_user_id', flat=True)
-        friend_ids.update(sent)
-
-        # Friendships where user received request
-        received = Friendship.objects.filter(
-            to_user=user,
-            status='accepted'
-        ).values_list('from_user_id', flat=True)
-        friend_ids.update(received)
-
+        friend_ids = friend_cache.friend_ids(self.request.user.id)
         return User.objects.filter(id__in=friend_ids)
 
 
@@ -243,7 +303,13 @@ class UnfriendView(APIView):
                     status=status.HTTP_404_NOT_FOUND
                 )
 
-            friendship.delete()
+            with transaction.atomic():
+                deleted, _ = friendship.delete()
+                if deleted:
+                    adjust_counters(
+                        User, [friendship.from_user_id, friendship.to_user_id], 'friends_count', -1
+                    )
+            friend_cache.invalidate(request.user.id, user_id)
 
             return Response({
                 'message': 'Unfriended successfully'
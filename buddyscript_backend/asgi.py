@@ -2,6 +2,8 @@
 ASGI config for buddyscript_backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Requests for the server push stream are answered by ``events.sse``; all
+others go to Django.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
@@ -13,4 +15,13 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'buddyscript_backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up
+from events.sse import EVENTS_PATH, stream  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == EVENTS_PATH:
+        return await stream(scope, receive, send)
+    return await django_application(scope, receive, send)
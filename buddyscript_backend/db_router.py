@@ -0,0 +1,145 @@
+"""Primary/replica database routing.
+
+Writes always go to ``default``, the primary. Reads go to a replica only
+while ``ReplicaRoutingMiddleware`` allows it for the request running on
+this thread: a safe-method request from a user who has not written in the
+last ``REPLICA_STICKY_SECONDS``. Everything else (background threads, jobs,
+management commands) reads from the primary.
+
+Within a request the first write sends the remaining reads to the primary,
+and so does an open transaction on it, so a request always sees its own
+writes. After a request that wrote, the client gets a short-lived cookie
+and its user, if any, is marked in the cache, so their next requests read
+from the primary too, whatever the replication lag. With a per-process
+cache (LocMemCache) the user mark only holds for the worker that took the
+write; point CACHE_BACKEND at a shared cache when running several workers.
+
+A replica that cannot be reached, or fails during a request, is skipped for
+``REPLICA_RETRY_INTERVAL`` seconds. A statement it fails is run again on the
+primary (``retry_on_primary``) and the rest of the request reads from the
+primary; only that read is repeated, never the view.
+
+Migrations only run on the primary. To try this locally with SQLite, migrate
+the primary's file and copy it to the replica's path: the copy acts as a
+replica that stopped replicating at that point.
+"""
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, InterfaceError, OperationalError, connections
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_down_until = {}  # alias -> time.monotonic() when it may be tried again
+
+
+def _sticky_key(user_id):
+    return f'db_sticky:{user_id}'
+
+
+def is_sticky(user_id):
+    """True while ``user_id``'s reads must stay on the primary."""
+    return user_id is not None and cache.get(_sticky_key(user_id)) is not None
+
+
+def stick(user_id):
+    cache.set(_sticky_key(user_id), True, settings.REPLICA_STICKY_SECONDS)
+
+
+def mark_down(alias):
+    logger.warning(
+        'Replica %s is unavailable; reading from the primary for %ss',
+        alias, settings.REPLICA_RETRY_INTERVAL
+    )
+    _down_until[alias] = time.monotonic() + settings.REPLICA_RETRY_INTERVAL
+
+
+def _usable(alias):
+    if _down_until.get(alias, 0) > time.monotonic():
+        return False
+    connection = connections[alias]
+    try:
+        # Drops a persistent connection the server closed (CONN_HEALTH_CHECKS)
+        connection.close_if_health_check_failed()
+        connection.ensure_connection()
+    except DatabaseError:
+        mark_down(alias)
+        return False
+    return True
+
+
+def choose_replica():
+    """Return a random reachable replica alias, or None for the primary."""
+    aliases = list(settings.DATABASE_REPLICAS)
+    random.shuffle(aliases)
+    for alias in aliases:
+        if _usable(alias):
+            return alias
+    return None
+
+
+def begin(replica):
+    """Route this thread's reads to ``replica`` (None: the primary)."""
+    _local.replica = replica
+    _local.wrote = False
+
+
+def end():
+    """Route this thread's reads back to the primary; return whether
+    anything was written since ``begin``."""
+    wrote = getattr(_local, 'wrote', False)
+    _local.replica = None
+    _local.wrote = False
+    return wrote
+
+
+def current_replica():
+    return getattr(_local, 'replica', None)
+
+
+def retry_on_primary(execute, sql, params, many, context):
+    """Execute wrapper for a replica connection: a statement the replica
+    fails runs on the primary instead, and the caller's cursor reads the
+    primary's rows."""
+    try:
+        return execute(sql, params, many, context)
+    except (OperationalError, InterfaceError):
+        mark_down(context['connection'].alias)
+        _local.replica = None
+        primary = connections[DEFAULT_DB_ALIAS]
+        with primary.wrap_database_errors:
+            primary.ensure_connection()
+            cursor = primary.create_cursor()
+            context['cursor'].cursor = cursor
+            if many:
+                return cursor.executemany(sql, params)
+            if params is None:
+                return cursor.execute(sql)
+            return cursor.execute(sql, params)
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        replica = current_replica()
+        if replica is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return replica
+
+    def db_for_write(self, model, **hints):
+        # The rest of the request reads what it wrote
+        _local.replica = None
+        _local.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every alias holds the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,45 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, quote_etag
+
+# Responses may be kept by the browser but must be revalidated with the
+# ETag on every use. Views without a policy keep the "no-store" default
+# set by SecurityHeadersMiddleware.
+REVALIDATE = 'private, no-cache'
+
+
+def make_etag(*parts):
+    """Build a strong ETag from the values a response is derived from."""
+    raw = '|'.join(str(part) for part in parts).encode('utf-8')
+    return quote_etag(hashlib.sha1(raw).hexdigest())
+
+
+class ConditionalGetMixin:
+    """Conditional GET for read views.
+
+    ``get_etag`` must compute a validator from cheap version data (row
+    timestamps, stored counters) without serializing anything. A matching
+    ``If-None-Match`` is answered with 304 before the view does any work;
+    otherwise the full response carries the ETag.
+    """
+    cache_control = REVALIDATE
+
+    def get_etag(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        etag = self.get_etag(request, *args, **kwargs)
+        if etag is None:
+            return super().get(request, *args, **kwargs)
+
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            not_modified['Cache-Control'] = self.cache_control
+            return not_modified
+
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            response['ETag'] = etag
+            response['Cache-Control'] = self.cache_control
+        return response
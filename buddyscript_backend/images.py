@@ -0,0 +1,128 @@
+"""Resized WebP/JPEG derivatives for uploaded images.
+
+After an upload commits, ``schedule_variants`` renders every size in
+``IMAGE_VARIANTS`` next to the original in storage and records the result,
+with dimensions, in a JSON field on the row. Rendering runs as a background
+job so the request returns as soon as the upload is saved.
+``discard_variants`` removes the files of a replaced image's variants.
+``variant_urls`` turns the stored data into URLs and ``srcset`` strings for
+the API.
+"""
+import io
+import os
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from jobs.queue import enqueue
+
+FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpeg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+
+
+def _resize(image, name, size):
+    if name == 'avatar':
+        # Avatars are shown as squares: crop to fill rather than letterbox
+        side = min(size, image.width, image.height)
+        return ImageOps.fit(image, (side, side), Image.LANCZOS)
+    resized = image.copy()
+    resized.thumbnail((size, size), Image.LANCZOS)  # never upscales
+    return resized
+
+
+def render_variants(file_name):
+    """Write every variant of a stored image and return their metadata."""
+    with default_storage.open(file_name) as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+    base, _ = os.path.splitext(file_name)
+    variants = {'width': image.width, 'height': image.height, 'sizes': {}}
+    for name, size in settings.IMAGE_VARIANTS.items():
+        resized = _resize(image, name, size)
+        entry = {'width': resized.width, 'height': resized.height}
+        for extension, pil_format, options in FORMATS:
+            frame = resized.convert('RGB') if pil_format == 'JPEG' else resized
+            buffer = io.BytesIO()
+            frame.save(buffer, pil_format, **options)
+            entry[extension] = default_storage.save(
+                f'{base}_{name}.{extension}',
+                ContentFile(buffer.getvalue())
+            )
+        variants['sizes'][name] = entry
+    return variants
+
+
+def build_variants(model_label, pk, field, variants_field):
+    """Render variants for ``model.field`` and store them on the row.
+
+    The update is guarded by the file name so a newer upload that landed
+    while this one was rendering is never overwritten. ``update()`` skips
+    ``auto_now``, so those fields (``updated_at``) are set here: the row
+    changed, and anything keyed on them must see it.
+    """
+    model = apps.get_model(model_label)
+    row = model._base_manager.filter(pk=pk).values_list(field, flat=True).first()
+    if not row:
+        return
+    changes = {variants_field: render_variants(row)}
+    now = timezone.now()
+    for model_field in model._meta.concrete_fields:
+        if getattr(model_field, 'auto_now', False):
+            changes[model_field.attname] = now
+    if not model._base_manager.filter(pk=pk, **{field: row}).update(**changes):
+        # The image was replaced meanwhile; nothing refers to these files
+        delete_variants(changes[variants_field])
+
+
+def schedule_variants(instance, field, variants_field):
+    """Queue variant rendering; the job is stored with the upload's transaction."""
+    enqueue(build_variants, instance._meta.label, instance.pk, field, variants_field)
+
+
+def delete_variants(variants):
+    """Remove the stored files of ``variants``."""
+    for entry in variants['sizes'].values():
+        for extension, _, _ in FORMATS:
+            default_storage.delete(entry[extension])
+
+
+def discard_variants(variants):
+    """Queue the removal of a replaced image's variants, if it had any."""
+    if variants:
+        enqueue(delete_variants, variants)
+
+
+def variant_urls(variants, request=None):
+    """API representation of stored variants: per-size URLs and srcsets."""
+    if not variants:
+        return None
+
+    def url(name):
+        path = default_storage.url(name)
+        return request.build_absolute_uri(path) if request else path
+
+    sizes = {}
+    srcset = {extension: [] for extension, _, _ in FORMATS}
+    for name, entry in variants['sizes'].items():
+        sizes[name] = {'width': entry['width'], 'height': entry['height']}
+        for extension in srcset:
+            sizes[name][extension] = url(entry[extension])
+            # The avatar is a square crop, not a smaller copy of the image
+            if name != 'avatar':
+                srcset[extension].append(f"{sizes[name][extension]} {entry['width']}w")
+
+    return {
+        'width': variants['width'],
+        'height': variants['height'],
+        'sizes': sizes,
+        'srcset': {extension: ', '.join(items) for extension, items in srcset.items()},
+    }
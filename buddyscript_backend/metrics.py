@@ -0,0 +1,245 @@
+"""Per-route request metrics and the Prometheus ``/metrics`` endpoint.
+
+``RequestLoggerMiddleware`` times every request and observes four
+histograms labelled by URL route: latency, SQL query count, SQL time and
+serialization time. Samples are kept in memory per process and written to
+``METRICS_DIR/worker-<pid>.json`` every ``METRICS_FLUSH_INTERVAL`` seconds;
+``/metrics`` adds up the files of all workers so any gunicorn worker can
+answer the scrape; files left by workers that have exited are deleted then.
+The endpoint is only served with ``METRICS_TOKEN`` set, or with ``DEBUG``.
+"""
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+HISTOGRAMS = {
+    'http_request_duration_seconds': (
+        'Request latency.', TIME_BUCKETS, ('route', 'method', 'status')
+    ),
+    'http_request_db_queries': (
+        'SQL queries run by a request.', QUERY_BUCKETS, ('route', 'method')
+    ),
+    'http_request_db_seconds': (
+        'Time spent in SQL queries by a request.', TIME_BUCKETS, ('route', 'method')
+    ),
+    'http_request_serialize_seconds': (
+        'Time spent serializing response data.', TIME_BUCKETS, ('route', 'method')
+    ),
+}
+
+_samples = {name: {} for name in HISTOGRAMS}
+_lock = threading.Lock()
+_last_flush = 0.0
+_local = threading.local()
+
+
+class RequestMetrics:
+    """Measurements of the request running on this thread."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.timings = {}
+        self._depth = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+    @contextmanager
+    def timer(self, name):
+        # Nested timers of the same name are counted once, by the outermost
+        depth = self._depth.get(name, 0)
+        self._depth[name] = depth + 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._depth[name] = depth
+            if depth == 0:
+                self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+
+@contextmanager
+def track_request():
+    """Collect SQL and timer measurements for the enclosed request."""
+    metrics = RequestMetrics()
+    _local.current = metrics
+    try:
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(metrics))
+            yield metrics
+    finally:
+        _local.current = None
+
+
+@contextmanager
+def timer(name):
+    """Time a section of the current request, e.g. ``timer('serialize')``."""
+    metrics = getattr(_local, 'current', None)
+    if metrics is None:
+        yield
+        return
+    with metrics.timer(name):
+        yield
+
+
+def observe(name, labels, value):
+    buckets = HISTOGRAMS[name][1]
+    with _lock:
+        row = _samples[name].get(labels)
+        if row is None:
+            # One count per bucket, then +Inf count and sum
+            row = _samples[name][labels] = [0] * (len(buckets) + 1) + [0.0]
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                row[index] += 1
+                break
+        row[-2] += 1
+        row[-1] += value
+
+
+def record(route, method, status, duration, metrics):
+    observe('http_request_duration_seconds', (route, method, str(status)), duration)
+    observe('http_request_db_queries', (route, method), metrics.queries)
+    observe('http_request_db_seconds', (route, method), metrics.db_time)
+    observe('http_request_serialize_seconds', (route, method), metrics.timings.get('serialize', 0.0))
+    if time.monotonic() - _last_flush >= settings.METRICS_FLUSH_INTERVAL:
+        flush()
+
+
+def server_timing(duration, metrics):
+    parts = [
+        f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.queries} queries"',
+        f'total;dur={duration * 1000:.1f}',
+    ]
+    for name, elapsed in metrics.timings.items():
+        parts.insert(-1, f'{name};dur={elapsed * 1000:.1f}')
+    return ', '.join(parts)
+
+
+def _path(pid=None):
+    return os.path.join(settings.METRICS_DIR, f'worker-{pid or os.getpid()}.json')
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, but belongs to another user
+        return True
+    return True
+
+
+def prune():
+    """Delete the sample files of workers that are no longer running."""
+    for path in glob.glob(_path('*')):
+        name = os.path.basename(path)
+        try:
+            pid = int(name[len('worker-'):-len('.json')])
+        except ValueError:
+            continue
+        if not _alive(pid):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def flush():
+    """Write this process's samples where ``/metrics`` can read them."""
+    global _last_flush
+    with _lock:
+        _last_flush = time.monotonic()
+        snapshot = {
+            name: {json.dumps(labels): row for labels, row in rows.items()}
+            for name, rows in _samples.items()
+        }
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=settings.METRICS_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'w') as temp:
+        json.dump(snapshot, temp)
+    os.replace(temp_path, _path())
+
+
+def collect():
+    """Sum the samples written by every worker."""
+    totals = {name: {} for name in HISTOGRAMS}
+    prune()
+    for path in glob.glob(_path('*')):
+        try:
+            with open(path) as source:
+                snapshot = json.load(source)
+        except (OSError, ValueError):
+            continue
+        for name, rows in snapshot.items():
+            if name not in totals:
+                continue
+            for labels, row in rows.items():
+                total = totals[name].get(labels)
+                if total is None or len(total) != len(row):
+                    totals[name][labels] = list(row)
+                else:
+                    totals[name][labels] = [a + b for a, b in zip(total, row)]
+    return totals
+
+
+def _label_text(names, values, **extra):
+    pairs = list(zip(names, values)) + list(extra.items())
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in pairs
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def render(totals):
+    lines = []
+    for name, (help_text, buckets, label_names) in HISTOGRAMS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for labels, row in sorted(totals[name].items()):
+            values = json.loads(labels)
+            cumulative = 0
+            for bound, count in zip(buckets, row):
+                cumulative += count
+                lines.append(f'{name}_bucket{_label_text(label_names, values, le=bound)} {cumulative}')
+            lines.append(f'{name}_bucket{_label_text(label_names, values, le="+Inf")} {row[-2]}')
+            lines.append(f'{name}_sum{_label_text(label_names, values)} {row[-1]}')
+            lines.append(f'{name}_count{_label_text(label_names, values)} {row[-2]}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    if not token and not settings.DEBUG:
+        raise Http404
+    if token and not constant_time_compare(
+        request.headers.get('Authorization', ''), f'Bearer {token}'
+    ):
+        return HttpResponse(status=401)
+    flush()
+    return HttpResponse(
+        render(collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
@@ -0,0 +1,84 @@
+import base64
+import json
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, connections
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.settings import api_settings
+
+from buddyscript_backend import db_router
+
+# Set on responses to requests that wrote; reads stay on the primary while
+# the client sends it back
+STICKY_COOKIE = 'db_primary'
+
+
+def token_user_id(request):
+    """The user ID claimed by the request's bearer token, unverified.
+
+    Authentication has not run yet when the database is picked. A forged
+    claim can at most send the request's reads to the primary.
+    """
+    parts = request.META.get(api_settings.AUTH_HEADER_NAME, '').split()
+    if len(parts) != 2 or parts[0] not in api_settings.AUTH_HEADER_TYPES:
+        return None
+    try:
+        payload = parts[1].split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return claims.get(api_settings.USER_ID_CLAIM)
+    except (IndexError, ValueError, AttributeError):
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """Lets safe-method requests read from a replica (see buddyscript_backend.db_router)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        replica = None
+        if request.method in SAFE_METHODS and not self.sticky(request):
+            replica = db_router.choose_replica()
+        db_router.begin(replica)
+        try:
+            if replica is None:
+                failover = nullcontext()
+            else:
+                failover = connections[replica].execute_wrapper(db_router.retry_on_primary)
+            with failover:
+                response = self.get_response(request)
+        finally:
+            wrote = db_router.end()
+
+        if wrote:
+            # The cookie also covers requests without a user yet, such as
+            # registering and then logging in
+            secure = request.is_secure()
+            response.set_cookie(
+                STICKY_COOKIE, '1',
+                max_age=settings.REPLICA_STICKY_SECONDS,
+                secure=secure,
+                httponly=True,
+                samesite='None' if secure else 'Lax'
+            )
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                db_router.stick(user.id)
+        return response
+
+    def sticky(self, request):
+        return STICKY_COOKIE in request.COOKIES or db_router.is_sticky(token_user_id(request))
+
+    def process_exception(self, request, exception):
+        # A replica that failed outside a statement (e.g. while rows were
+        # fetched) is skipped by the next requests; the view is not run again,
+        # it may already have had side effects
+        replica = db_router.current_replica()
+        if replica and isinstance(exception, (OperationalError, InterfaceError)):
+            db_router.mark_down(replica)
+        return None
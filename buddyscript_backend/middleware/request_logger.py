@@ -1,17 +1,31 @@
 import time
 import logging
 
+from buddyscript_backend import metrics
+
 logger = logging.getLogger(__name__)
 
 class RequestLoggerMiddleware:
+    """Logs every request and records its metrics (see buddyscript_backend.metrics)"""
+
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
-        start = time.time()
-        response = self.get_response(request)
-        duration = round(time.time() - start, 3)
+        start = time.perf_counter()
+        with metrics.track_request() as tracked:
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = request.resolver_match
+        route = match.route if match else 'unmatched'
+        metrics.record(route, request.method, response.status_code, duration, tracked)
+
         user = request.user if request.user.is_authenticated else "Anonymous"
-        logger.info(f"{request.method} {request.path} by {user} - {duration}s")
-        response["X-Response-Time"] = f"{duration}s"
+        logger.info(
+            f"{request.method} {request.path} [{route}] {response.status_code} by {user} - "
+            f"{duration:.3f}s, {tracked.queries} queries in {tracked.db_time:.3f}s"
+        )
+        response["X-Response-Time"] = f"{round(duration, 3)}s"
+        response["Server-Timing"] = metrics.server_timing(duration, tracked)
         return response
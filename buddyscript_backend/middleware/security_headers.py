@@ -7,5 +7,6 @@ class SecurityHeadersMiddleware:
         response["X-Content-Type-Options"] = "nosniff"
         response["X-Frame-Options"] = "DENY"
         response["Referrer-Policy"] = "strict-origin-when-cross-origin"
-        response["Cache-Control"] = "no-cache, no-store, must-revalidate"
+        # Views with their own caching policy (see http_cache) keep it
+        response.setdefault("Cache-Control", "no-cache, no-store, must-revalidate")
         return response
@@ -0,0 +1,128 @@
+import base64
+import binascii
+from collections import OrderedDict, namedtuple
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+# What a key source returns when it stopped looking before the page was
+# full: the keys found, and the position up to which it has looked
+PartialKeys = namedtuple('PartialKeys', ('keys', 'resume'))
+
+
+def keyset_filter(queryset, position, timestamp_field='created_at', pk_field='id'):
+    """Restrict a newest-first queryset to rows strictly after ``position``."""
+    if position is None:
+        return queryset
+    timestamp, pk = position
+    return queryset.filter(
+        Q(**{f'{timestamp_field}__lt': timestamp}) |
+        Q(**{timestamp_field: timestamp, f'{pk_field}__lt': pk})
+    )
+
+
+class KeysetPagination(PageNumberPagination):
+    """Page-number pagination with an opt-in opaque cursor mode.
+
+    Sending ``?cursor=`` (empty for the first page) switches to keyset
+    pagination on ``(created_at, id)``, newest first. Each page is a range
+    read on the ``-created_at`` indexes: no ``COUNT(*)``, no ``OFFSET``, and
+    rows inserted while the client scrolls never shift later pages.
+    Requests without ``cursor`` keep the regular ``?page=`` behaviour
+    unless ``cursor_only`` is set.
+    """
+    cursor_query_param = 'cursor'
+    cursor_only = False
+    invalid_cursor_message = 'Invalid cursor'
+    timestamp_field = 'created_at'
+
+    keyset = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_only or self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        self.request = request
+        field = self.timestamp_field
+        queryset = keyset_filter(
+            queryset.order_by(f'-{field}', '-id'),
+            self.decode_cursor(request),
+            field
+        )
+
+        results = list(queryset[:page_size + 1])
+        self.page = results[:page_size]
+        self.next_position = None
+        if len(results) > page_size:
+            last = self.page[-1]
+            self.next_position = (getattr(last, field), last.pk)
+        return self.page
+
+    def paginate_keys(self, fetch, request):
+        """Keyset-paginate a source that is not a single queryset.
+
+        ``fetch(position, limit)`` must return up to ``limit`` newest-first
+        ``(timestamp, pk)`` keys strictly after ``position``, or a
+        ``PartialKeys`` when it gave up early; the next page then resumes
+        where it stopped. Returns the keys of the requested page; callers
+        hydrate them however they like.
+        """
+        self.keyset = True
+        self.request = request
+        page_size = self.get_page_size(request)
+
+        keys = fetch(self.decode_cursor(request), page_size + 1)
+        if isinstance(keys, PartialKeys):
+            self.next_position = keys.resume
+            return keys.keys[:page_size]
+        page = keys[:page_size]
+        self.next_position = page[-1] if len(keys) > page_size else None
+        return page
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', None),
+            ('results', data),
+        ]))
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        cursor = self.encode_cursor(self.next_position)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def encode_cursor(self, position):
+        timestamp, pk = position
+        raw = f'{timestamp.isoformat()}|{pk}'.encode('ascii')
+        return base64.urlsafe_b64encode(raw).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii')
+            timestamp, pk = raw.rsplit('|', 1)
+            timestamp = parse_datetime(timestamp)
+            pk = int(pk)
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if timestamp is None:
+            raise NotFound(self.invalid_cursor_message)
+        return timestamp, pk
@@ -0,0 +1,27 @@
+"""Helpers shared by the user and post search indexes."""
+import re
+
+TOKEN_MAX_LENGTH = 50
+
+_SPLIT_RE = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def tokenize(text):
+    """Split text into lowercase word tokens, keeping their order."""
+    if not text:
+        return []
+    return [
+        token[:TOKEN_MAX_LENGTH]
+        for token in _SPLIT_RE.split(text.lower())
+        if token
+    ]
+
+
+def prefix_range(field, prefix):
+    """Filter kwargs matching ``field`` values that start with ``prefix``.
+
+    A range instead of ``__startswith`` keeps the lookup an index range scan
+    on both MySQL and SQLite (where ``LIKE ... ESCAPE`` cannot use an index).
+    """
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return {f'{field}__gte': prefix, f'{field}__lt': upper}
@@ -0,0 +1,103 @@
+"""Sparse fieldsets and expansion for read serializers.
+
+``?fields=id,content,author.full_name`` renders only the listed fields
+(dotted names select fields of nested serializers). ``?expand=comments``
+adds fields listed in a serializer's ``Meta.expandable_fields`` - the
+unbounded nested arrays such as ``likes`` and ``comments``. Once a request
+uses either parameter, expandable fields are left out unless asked for.
+Requests with neither parameter get the full legacy representation.
+"""
+from . import metrics
+
+
+def parse_field_list(value):
+    """Turn ``"a,b.c,b.d"`` into ``{'a': {}, 'b': {'c': {}, 'd': {}}}``."""
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for name in path.strip().split('.'):
+            if name:
+                node = node.setdefault(name, {})
+    return tree
+
+
+class FieldSelection:
+    def __init__(self, fields=None, expand=None, sparse=False):
+        # None means "every field"; a dict limits output to its keys
+        self.fields = fields
+        self.expand = expand or {}
+        self.sparse = sparse
+
+    @classmethod
+    def from_request(cls, request):
+        params = request.query_params if request is not None else {}
+        fields = params.get('fields')
+        expand = params.get('expand')
+        return cls(
+            fields=parse_field_list(fields) if fields else None,
+            expand=parse_field_list(expand) if expand else None,
+            sparse=fields is not None or expand is not None
+        )
+
+    def includes(self, name, expandable=False):
+        if name in self.expand:
+            return True
+        if self.fields is not None:
+            return name in self.fields
+        return not (expandable and self.sparse)
+
+    def child(self, name):
+        fields = self.fields.get(name) if self.fields is not None else None
+        return FieldSelection(
+            fields=fields or None,
+            expand=self.expand.get(name),
+            sparse=self.sparse
+        )
+
+
+class TimedDataMixin:
+    """Reports the time spent building ``.data`` as serialization time."""
+
+    @property
+    def data(self):
+        with metrics.timer('serialize'):
+            return super().data
+
+
+class DynamicFieldsMixin(TimedDataMixin):
+    """Applies a FieldSelection to a serializer and its nested serializers.
+
+    The root serializer reads the selection from the request; nested
+    serializers receive theirs from the parent, or through the
+    ``selection`` argument when built inside a SerializerMethodField.
+    """
+
+    def __init__(self, *args, selection=None, **kwargs):
+        self.selection = selection
+        super().__init__(*args, **kwargs)
+
+    @classmethod
+    def requests_field(cls, request, name):
+        """Whether the response for ``request`` will contain ``name``; lets
+        views skip prefetching relations that will not be rendered."""
+        expandable = name in getattr(cls.Meta, 'expandable_fields', ())
+        return FieldSelection.from_request(request).includes(name, expandable)
+
+    def get_selection(self):
+        if self.selection is None:
+            self.selection = FieldSelection.from_request(self.context.get('request'))
+        return self.selection
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selection = self.get_selection()
+        expandable = getattr(self.Meta, 'expandable_fields', ())
+
+        for name in list(fields):
+            if not selection.includes(name, name in expandable):
+                del fields[name]
+                continue
+            nested = getattr(fields[name], 'child', fields[name])
+            if isinstance(nested, DynamicFieldsMixin):
+                nested.selection = selection.child(name)
+        return fields
@@ -1,7 +1,9 @@
 import os
+import sys
+import tempfile
 from pathlib import Path
 from datetime import timedelta
-from decouple import config
+from decouple import Csv, config
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -27,6 +29,8 @@ INSTALLED_APPS = [
     # Local apps
     'accounts',
     'posts',
+    'jobs',
+    'events',
 ]
 
 MIDDLEWARE = [
@@ -34,6 +38,7 @@ MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'buddyscript_backend.middleware.replica_routing.ReplicaRoutingMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -72,6 +77,24 @@ DATABASES = {
     )
 }
 
+# Read replicas, as comma-separated database URLs (two SQLite files work for
+# local testing). Safe-method requests read from a random healthy replica;
+# see buddyscript_backend.db_router.
+DATABASE_REPLICAS = []
+for index, url in enumerate(config('DATABASE_REPLICA_URLS', default='', cast=Csv())):
+    alias = f'replica{index + 1}'
+    DATABASES[alias] = dj_database_url.parse(url, conn_max_age=600, conn_health_checks=True)
+    # Tests run everything against the primary's test database
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['buddyscript_backend.db_router.PrimaryReplicaRouter']
+
+# Seconds a user's reads stay on the primary after they wrote
+REPLICA_STICKY_SECONDS = config('REPLICA_STICKY_SECONDS', default=10, cast=int)
+# Seconds an unreachable replica is skipped before it is tried again
+REPLICA_RETRY_INTERVAL = 30
+
 
 # DATABASES = {
 #     'default': {
@@ -152,6 +175,50 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Resized derivatives generated for every uploaded image (longest side, px)
+IMAGE_VARIANTS = {
+    'avatar': 160,
+    'feed': 600,
+    'full': 1600,
+}
+
+# Background jobs (see jobs/queue.py); run workers with `manage.py run_jobs`
+JOBS_RUN_INLINE = config('JOBS_RUN_INLINE', default=False, cast=bool)
+JOBS_CONCURRENCY = config('JOBS_CONCURRENCY', default=2, cast=int)
+JOBS_VISIBILITY_TIMEOUT = 300
+JOBS_MAX_ATTEMPTS = 5
+JOBS_RETRY_DELAY = 30  # seconds, doubled after every failed attempt
+JOBS_POLL_INTERVAL = 1
+
+# Request metrics (buddyscript_backend/metrics.py), served at /metrics
+METRICS_DIR = config('METRICS_DIR', default=os.path.join(tempfile.gettempdir(), 'buddyscript-metrics'))
+METRICS_FLUSH_INTERVAL = 5  # seconds between writes of a worker's samples
+METRICS_TOKEN = config('METRICS_TOKEN', default='')  # bearer token; /metrics is 404 without one unless DEBUG
+
+# Authentication (accounts/authentication.py)
+AUTH_USER_CACHE_TTL = 60
+# Let read-only views marked trust_token_claims skip the user lookup
+AUTH_TRUST_TOKEN_CLAIMS = config('AUTH_TRUST_TOKEN_CLAIMS', default=False, cast=bool)
+
+# Presence (accounts/presence.py)
+PRESENCE_TIMEOUT = 90  # seconds without a heartbeat before a user is offline
+PRESENCE_FLUSH_INTERVAL = 30  # seconds between batched last_seen writes
+# Background thread that runs the flushes; off under `manage.py test`, where
+# tests call presence.flush() themselves
+PRESENCE_FLUSH_THREAD = config(
+    'PRESENCE_FLUSH_THREAD', default=sys.argv[1:2] != ['test'], cast=bool
+)
+
+# Server push (/api/events/). LocalBroker only reaches streams in the same
+# process; use events.broker.DatabaseBroker when running several web workers.
+EVENTS_BROKER = config('EVENTS_BROKER', default='events.broker.LocalBroker')
+EVENTS_HEARTBEAT = 15  # seconds between keepalive comments
+EVENTS_QUEUE_SIZE = 100  # undelivered events kept per stream
+EVENTS_POLL_INTERVAL = 1  # DatabaseBroker only
+EVENTS_RETENTION = 300  # DatabaseBroker only, seconds
+EVENTS_REPLAY_WINDOW = 300  # seconds LocalBroker keeps events of a disconnected user
+EVENTS_TICKET_TTL = 30  # seconds a stream ticket is valid
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -161,7 +228,7 @@ AUTH_USER_MODEL = 'accounts.User'
 # REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -176,7 +243,8 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
-    'UPDATE_LAST_LOGIN': True,
+    # last_seen is kept by accounts.presence; no extra write per login
+    'UPDATE_LAST_LOGIN': False,
     'ALGORITHM': 'HS256',
     'SIGNING_KEY': SECRET_KEY,
     'AUTH_HEADER_TYPES': ('Bearer',),
@@ -185,6 +253,55 @@ SIMPLE_JWT = {
     'USER_ID_CLAIM': 'user_id',
 }
 
+# Cache
+# LocMemCache is per process; point CACHE_BACKEND at a shared backend
+# (file, database or redis) when running several gunicorn workers so that
+# invalidations reach every worker.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='buddyscript'),
+    }
+}
+
+# Seconds a user's cached friend/pending ID sets live before a reload
+FRIEND_CACHE_TTL = 60 * 60
+
+# Home timeline
+# Authors with more friends than this are not fanned out on write; their
+# posts are merged into friends' timelines at read time instead.
+TIMELINE_FANOUT_LIMIT = config('TIMELINE_FANOUT_LIMIT', default=1000, cast=int)
+# Recent posts copied into each side's timeline when a friendship is accepted
+TIMELINE_BACKFILL_SIZE = 50
+
+# Feed previews: most recent root comments, replies per comment and likers
+# embedded in each feed item (clients may ask for up to FEED_PREVIEW_MAX)
+FEED_PREVIEW_COMMENTS = 3
+FEED_PREVIEW_REPLIES = 2
+FEED_PREVIEW_LIKERS = 3
+FEED_PREVIEW_MAX = 20
+
+# Deepest reply level accepted (root comments are level 0)
+COMMENT_MAX_DEPTH = 8
+
+# Most like/unlike operations accepted by one POST /api/posts/likes/batch/
+LIKE_BATCH_MAX = 100
+
+# Write-behind likes (posts/like_buffer.py): toggles on a post beyond the
+# threshold within one window are buffered and written in batches
+LIKE_BUFFER_HOT_THRESHOLD = config('LIKE_BUFFER_HOT_THRESHOLD', default=30, cast=int)
+LIKE_BUFFER_WINDOW = 60  # seconds
+LIKE_BUFFER_FLUSH_INTERVAL = 0.3  # seconds
+LIKE_BUFFER_INTENT_TTL = 120  # seconds a buffered like is served from the cache
+LIKE_BUFFER_MAX_RETRIES = 5  # failed writes of a post's likes retried before dropping them
+
+# Sharded post counters (posts/counters.py): posts with more counter writes
+# than the threshold within one window spread them over several rows
+COUNTER_SHARD_THRESHOLD = config('COUNTER_SHARD_THRESHOLD', default=60, cast=int)
+COUNTER_SHARD_WINDOW = 60  # seconds
+COUNTER_SHARDS = 16
+COUNTER_COMPACT_INTERVAL = 30  # seconds from the first sharded write to its compaction
+
 # CORS Settings
 # CORS_ALLOWED_ORIGINS = [
 #     "http://localhost:3000",
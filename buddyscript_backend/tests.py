@@ -0,0 +1,256 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from accounts.models import User
+from posts.models import Post
+from . import db_router, metrics
+from .middleware import replica_routing
+from .middleware.replica_routing import STICKY_COOKIE, ReplicaRoutingMiddleware
+
+
+class MetricsEndpointTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dir = directory.name
+        settings = override_settings(METRICS_DIR=self.dir)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    @override_settings(DEBUG=False, METRICS_TOKEN='')
+    def test_closed_without_a_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    @override_settings(DEBUG=True, METRICS_TOKEN='')
+    def test_open_in_debug(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE http_request_duration_seconds histogram', response.content.decode())
+
+    @override_settings(DEBUG=False, METRICS_TOKEN='secret')
+    def test_token_is_required_when_set(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+    def test_collect_drops_files_of_exited_workers(self):
+        exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+        exited.wait()
+        # One request in the first bucket: bucket counts, +Inf count, sum
+        row = [1] + [0] * (len(metrics.TIME_BUCKETS) - 1) + [1, 0.5]
+        labels = json.dumps(['posts', 'GET', '200'])
+        for pid in (os.getpid(), exited.pid):
+            with open(os.path.join(self.dir, f'worker-{pid}.json'), 'w') as target:
+                json.dump({'http_request_duration_seconds': {labels: row}}, target)
+
+        totals = metrics.collect()
+        self.assertEqual(totals['http_request_duration_seconds'][labels][-2], 1)
+        self.assertEqual(os.listdir(self.dir), [f'worker-{os.getpid()}.json'])
+
+@override_settings(DEBUG=True, METRICS_TOKEN='')
+class RequestMetricsTests(APITestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(METRICS_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        patcher = mock.patch.dict(metrics._samples, {name: {} for name in metrics.HISTOGRAMS})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_requests_are_recorded_by_route(self):
+        user = User.objects.create_user(
+            email='user@example.com', first_name='U', last_name='Ser', password='password-123'
+        )
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/posts/')
+        queries = len(context.captured_queries)
+        self.assertIn(f'desc="{queries} queries"', response['Server-Timing'])
+        self.client.get(f'/api/posts/{user.id + 1000}/')
+
+        labels = ('api/posts/', 'GET')
+        self.assertEqual(metrics._samples['http_request_db_queries'][labels][-1], queries)
+        self.assertEqual(metrics._samples['http_request_duration_seconds'][labels + ('200',)][-2], 1)
+        self.assertEqual(
+            metrics._samples['http_request_duration_seconds'][('api/posts/<int:pk>/', 'GET', '404')][-2], 1
+        )
+        self.assertGreater(metrics._samples['http_request_serialize_seconds'][labels][-1], 0)
+
+    def test_histograms_render_cumulative_buckets(self):
+        metrics.observe('http_request_duration_seconds', ('posts', 'GET', '200'), 0.003)
+        metrics.observe('http_request_duration_seconds', ('posts', 'GET', '200'), 0.03)
+        text = self.client.get('/metrics').content.decode()
+        labels = 'route="posts",method="GET",status="200"'
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},le="0.005"}} 1', text)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},le="0.05"}} 2', text)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2', text)
+        self.assertIn(f'http_request_duration_seconds_count{{{labels}}} 2', text)
+
+
+
+class PrimaryReplicaRouterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.router = db_router.PrimaryReplicaRouter()
+        self.addCleanup(db_router.end)
+
+    def test_reads_follow_the_request_until_it_writes(self):
+        self.assertEqual(self.router.db_for_read(Post), DEFAULT_DB_ALIAS)
+        db_router.begin('replica1')
+        self.assertEqual(self.router.db_for_read(Post), 'replica1')
+        self.assertEqual(self.router.db_for_write(Post), DEFAULT_DB_ALIAS)
+        self.assertEqual(self.router.db_for_read(Post), DEFAULT_DB_ALIAS)
+        self.assertTrue(db_router.end())
+        self.assertFalse(db_router.end())
+
+    def test_migrations_only_run_on_the_primary(self):
+        self.assertTrue(self.router.allow_migrate(DEFAULT_DB_ALIAS, 'posts'))
+        self.assertFalse(self.router.allow_migrate('replica1', 'posts'))
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_replica_marked_down_is_skipped(self):
+        self.addCleanup(db_router._down_until.clear)
+        with self.assertLogs('buddyscript_backend.db_router', 'WARNING'):
+            db_router.mark_down('replica1')
+        self.assertIsNone(db_router.choose_replica())
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRoutingMiddlewareTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(db_router._down_until.clear)
+        patcher = mock.patch.object(db_router, 'choose_replica', return_value='replica1')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # No query runs; the middleware only wraps the replica's connection
+        patcher = mock.patch.object(replica_routing, 'connections', {'replica1': connection})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.factory = RequestFactory()
+        self.seen = []
+
+    def view(self, write=False):
+        def get_response(request):
+            self.seen.append(db_router.current_replica())
+            if write:
+                db_router.PrimaryReplicaRouter().db_for_write(Post)
+            return HttpResponse()
+        return ReplicaRoutingMiddleware(get_response)
+
+    def test_safe_requests_read_from_a_replica(self):
+        response = self.view()(self.factory.get('/api/posts/'))
+        self.assertEqual(self.seen, ['replica1'])
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+        self.view()(self.factory.post('/api/posts/'))
+        self.assertEqual(self.seen, ['replica1', None])
+        self.assertIsNone(db_router.current_replica())
+
+    def test_writes_keep_the_client_on_the_primary(self):
+        response = self.view(write=True)(self.factory.post('/api/auth/register/'))
+        cookie = response.cookies[STICKY_COOKIE]
+        self.assertEqual(cookie['max-age'], 10)
+        self.assertTrue(cookie['httponly'])
+
+        self.factory.cookies[STICKY_COOKIE] = cookie.value
+        self.view()(self.factory.get('/api/posts/'))
+        self.assertEqual(self.seen, [None, None])
+
+    def test_sticky_token_user_reads_from_the_primary(self):
+        db_router.stick(7)
+        token = AccessToken()
+        token['user_id'] = 7
+        self.view()(self.factory.get('/api/posts/', HTTP_AUTHORIZATION=f'Bearer {token}'))
+        self.assertEqual(self.seen, [None])
+
+    def test_failed_view_marks_the_replica_down_without_running_again(self):
+        middleware = self.view()
+        request = self.factory.get('/api/posts/')
+        db_router.begin('replica1')
+        self.addCleanup(db_router.end)
+
+        with self.assertLogs('buddyscript_backend.db_router', 'WARNING'):
+            self.assertIsNone(middleware.process_exception(request, OperationalError('gone')))
+        self.assertIn('replica1', db_router._down_until)
+        self.assertEqual(self.seen, [])
+        self.assertIsNone(middleware.process_exception(request, ValueError()))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas_leaves_requests_alone(self):
+        response = self.view(write=True)(self.factory.get('/api/posts/'))
+        self.assertEqual(self.seen, [None])
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaStickinessTests(APITestCase):
+    """The test database stands in for the replica."""
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(db_router, 'choose_replica', return_value=DEFAULT_DB_ALIAS)
+        self.choose_replica = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_registering_sticks_the_anonymous_client(self):
+        response = self.client.post('/api/auth/register/', {
+            'email': 'newcomer@example.com',
+            'first_name': 'New',
+            'last_name': 'Comer',
+            'password': 'a-long-password-123',
+            'password2': 'a-long-password-123',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIn(STICKY_COOKIE, response.cookies)
+
+        user = User.objects.get(email='newcomer@example.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        self.assertEqual(self.client.get('/api/posts/').status_code, 200)
+        self.choose_replica.assert_not_called()
+
+        # Without the cookie the same user's reads go to a replica again
+        self.client.cookies.clear()
+        self.assertEqual(self.client.get('/api/posts/').status_code, 200)
+        self.choose_replica.assert_called_once()
+
+    def test_failed_replica_read_runs_again_on_the_primary_not_the_view(self):
+        self.addCleanup(db_router._down_until.clear)
+        Post.objects.create(author=User.objects.create_user(
+            email='author@example.com', first_name='A', last_name='Uthor', password='password-123'
+        ), content='Hello')
+        calls = []
+
+        def replica_gone(execute, sql, params, many, context):
+            raise OperationalError('replica gone')
+
+        def view(request):
+            calls.append(db_router.current_replica())
+            # Inside the middleware's wrapper, so the statement fails first
+            with connection.execute_wrapper(replica_gone):
+                count = Post.objects.count()
+            calls.append(db_router.current_replica())
+            return HttpResponse(str(count))
+
+        with self.assertLogs('buddyscript_backend.db_router', 'WARNING'):
+            response = ReplicaRoutingMiddleware(view)(RequestFactory().get('/api/posts/'))
+        self.assertEqual(response.content, b'1')
+        # The view body ran once; after the failure it reads from the primary
+        self.assertEqual(calls, [DEFAULT_DB_ALIAS, None])
+        self.assertIn(DEFAULT_DB_ALIAS, db_router._down_until)
@@ -0,0 +1,193 @@
+"""Per-user event fan-out for the server push channel.
+
+Views call ``notify`` and connected ``/api/events/`` streams (see
+``events.sse``) receive the event. ``LocalBroker`` delivers inside the
+process and is enough for a single web worker. With several workers a
+stream may live in a different process than the request that raised the
+event; ``DatabaseBroker`` covers that by relaying events through the
+``events`` table. The broker class is chosen with ``EVENTS_BROKER``.
+
+Every event has an ID. A stream that reconnects with the last one it got
+is first sent what it missed (``replay``): the last ``EVENTS_QUEUE_SIZE``
+events of each user for ``LocalBroker``, kept until the user has had no
+stream for ``EVENTS_REPLAY_WINDOW`` seconds, and the retained rows of the
+``events`` table for ``DatabaseBroker``.
+"""
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """One connected stream: a queue read by the stream's event loop."""
+
+    def __init__(self, user_id, loop):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=settings.EVENTS_QUEUE_SIZE)
+
+    def deliver(self, event):
+        # Called from request or poller threads; hand over to the loop
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A stalled client loses events; it reloads state on reconnect
+            pass
+
+
+class LocalBroker:
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        # Recent events of the users connected to this process, and of those
+        # who left in the last EVENTS_REPLAY_WINDOW seconds
+        self._recent = {}
+        self._left = {}  # user_id -> time.monotonic() of their last unsubscribe
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+            self._recent.setdefault(user_id, deque(maxlen=settings.EVENTS_QUEUE_SIZE))
+            self._left.pop(user_id, None)
+            self._prune()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+                    self._left[subscription.user_id] = time.monotonic()
+
+    def _prune(self):
+        # Called with _lock held
+        cutoff = time.monotonic() - settings.EVENTS_REPLAY_WINDOW
+        for user_id in [user_id for user_id, left in self._left.items() if left < cutoff]:
+            del self._left[user_id]
+            del self._recent[user_id]
+
+    def subscribed_users(self):
+        with self._lock:
+            return list(self._subscriptions)
+
+    def dispatch(self, user_id, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.deliver(event)
+
+    def publish(self, user_id, event_type, data):
+        event = {'id': next(self._ids), 'type': event_type, 'data': data}
+        with self._lock:
+            recent = self._recent.get(user_id)
+            if recent is not None:
+                recent.append(event)
+        self.dispatch(user_id, event)
+
+    def replay(self, user_id, last_id):
+        """Events for ``user_id`` published after ``last_id``, oldest first."""
+        with self._lock:
+            return [event for event in self._recent.get(user_id, ()) if event['id'] > last_id]
+
+
+class DatabaseBroker(LocalBroker):
+    """Relays events between processes through the ``events`` table.
+
+    ``publish`` inserts a row; each process with open streams runs one
+    poller thread that reads new rows for its connected users and
+    dispatches them locally. Rows older than ``EVENTS_RETENTION`` seconds
+    are pruned by the pollers.
+    """
+    PRUNE_EVERY = 60  # polls
+
+    def __init__(self):
+        super().__init__()
+        self._poller = None
+
+    def publish(self, user_id, event_type, data):
+        from .models import Event
+        Event.objects.create(user_id=user_id, type=event_type, data=data)
+
+    def replay(self, user_id, last_id):
+        from .models import Event
+        rows = Event.objects.filter(user_id=user_id, id__gt=last_id).order_by('id').values_list(
+            'id', 'type', 'data'
+        )[:settings.EVENTS_QUEUE_SIZE]
+        return [{'id': event_id, 'type': event_type, 'data': data} for event_id, event_type, data in rows]
+
+    def subscribe(self, user_id):
+        subscription = super().subscribe(user_id)
+        with self._lock:
+            if self._poller is None:
+                self._poller = threading.Thread(
+                    target=self._poll, name='events-poller', daemon=True
+                )
+                self._poller.start()
+        return subscription
+
+    def _poll(self):
+        from .models import Event
+
+        last_id = None
+        for polls in itertools.count():
+            try:
+                close_old_connections()
+                if last_id is None:
+                    # Start from "now": older events were meant for earlier streams
+                    last_id = Event.objects.aggregate(Max('id'))['id__max'] or 0
+                users = self.subscribed_users()
+                if not users:
+                    last_id = None
+                else:
+                    rows = Event.objects.filter(
+                        id__gt=last_id, user_id__in=users
+                    ).order_by('id').values_list('id', 'user_id', 'type', 'data')[:500]
+                    for event_id, user_id, event_type, data in rows:
+                        self.dispatch(user_id, {'id': event_id, 'type': event_type, 'data': data})
+                        last_id = event_id
+                if polls % self.PRUNE_EVERY == 0:
+                    cutoff = timezone.now() - timedelta(seconds=settings.EVENTS_RETENTION)
+                    Event.objects.filter(created_at__lt=cutoff).delete()
+            except Exception:
+                logger.exception('Event poller failed')
+            time.sleep(settings.EVENTS_POLL_INTERVAL)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.EVENTS_BROKER)()
+        return _broker
+
+
+def user_summary(user):
+    return {'id': user.id, 'full_name': user.get_full_name()}
+
+
+def notify(user_id, event_type, data):
+    """Push an event to ``user_id``'s open streams once the transaction commits."""
+    transaction.on_commit(lambda: get_broker().publish(user_id, event_type, data))
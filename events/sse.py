@@ -0,0 +1,117 @@
+"""``GET /api/events/`` - Server-Sent Events stream of the user's events.
+
+Served directly by the ASGI application (see ``buddyscript_backend.asgi``)
+rather than through a Django view, so an open stream holds no worker
+thread and a client disconnect is noticed straight away. ``EventSource``
+cannot send headers, so the stream is opened with a single-use ticket in
+``?ticket=`` (see ``events.tickets``), never the access token. A stream
+opened with the ID of the last event the client got (the ``Last-Event-ID``
+header ``EventSource`` sends when it reconnects, or ``?last_event_id=``)
+starts with the events it missed.
+"""
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import tickets
+from .broker import get_broker
+
+EVENTS_PATH = '/api/events/'
+
+
+def cors_headers(scope):
+    origin = dict(scope['headers']).get(b'origin', b'').decode('latin-1')
+    allowed = getattr(settings, 'CORS_ALLOW_ALL_ORIGINS', False) or origin in getattr(
+        settings, 'CORS_ALLOWED_ORIGINS', ()
+    )
+    if origin and allowed:
+        return [(b'access-control-allow-origin', origin.encode('latin-1')), (b'vary', b'Origin')]
+    return []
+
+
+def format_event(event):
+    data = json.dumps(event['data'], separators=(',', ':'))
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n".encode('utf-8')
+
+
+def last_event_id(scope, query):
+    value = dict(scope['headers']).get(b'last-event-id', b'').decode('latin-1')
+    value = value or query.get('last_event_id', [''])[0]
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+async def reject(send, headers, status, detail):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': headers + [(b'content-type', b'application/json')],
+    })
+    await send({'type': 'http.response.body', 'body': json.dumps({'detail': detail}).encode()})
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def stream(scope, receive, send):
+    headers = cors_headers(scope)
+    if scope['method'] != 'GET':
+        return await reject(send, headers, 405, 'Method not allowed.')
+
+    query = parse_qs(scope['query_string'].decode('latin-1'))
+    user_id = await sync_to_async(tickets.redeem)(query.get('ticket', [None])[0])
+    if user_id is None:
+        return await reject(send, headers, 401, 'Invalid, expired or used ticket.')
+
+    broker = get_broker()
+    subscription = broker.subscribe(user_id)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': headers + [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-store'),
+                (b'x-accel-buffering', b'no'),  # stop proxies from buffering
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': b'retry: 5000\n\n', 'more_body': True})
+
+        # Subscribed first, so nothing published meanwhile is missed; what
+        # is both replayed and queued is sent once
+        replayed = set()
+        last_id = last_event_id(scope, query)
+        if last_id is not None:
+            for event in await sync_to_async(broker.replay)(user_id, last_id):
+                replayed.add(event['id'])
+                await send({'type': 'http.response.body', 'body': format_event(event), 'more_body': True})
+
+        while not disconnected.done():
+            next_event = asyncio.ensure_future(subscription.queue.get())
+            done, _ = await asyncio.wait(
+                {next_event, disconnected},
+                timeout=settings.EVENTS_HEARTBEAT,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if next_event in done:
+                event = next_event.result()
+                if event['id'] in replayed:
+                    continue
+                body = format_event(event)
+            else:
+                next_event.cancel()
+                if disconnected.done():
+                    break
+                body = b': keepalive\n\n'
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        broker.unsubscribe(subscription)
+        disconnected.cancel()
@@ -0,0 +1,263 @@
+import asyncio
+import importlib.util
+import json
+from pathlib import Path
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core import signing
+from django.test import TestCase, override_settings
+from django.utils.module_loading import import_string
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from accounts.models import User
+from buddyscript_backend.asgi import application
+from . import broker as broker_module, tickets
+from .broker import DatabaseBroker, LocalBroker, notify
+from .models import Event
+
+
+class LocalBrokerTests(TestCase):
+
+    def test_publish_reaches_the_users_streams_only(self):
+        async def scenario():
+            broker = LocalBroker()
+            mine, other = broker.subscribe(1), broker.subscribe(2)
+            broker.publish(1, 'post_liked', {'post_id': 5})
+            event = await asyncio.wait_for(mine.queue.get(), 1)
+            await asyncio.sleep(0)
+            return event, other.queue.empty()
+
+        event, other_empty = async_to_sync(scenario)()
+        self.assertEqual(event['type'], 'post_liked')
+        self.assertEqual(event['data'], {'post_id': 5})
+        self.assertTrue(other_empty)
+
+    def test_replay_outlives_a_disconnect_but_not_the_window(self):
+        async def scenario():
+            broker = LocalBroker()
+            broker.unsubscribe(broker.subscribe(1))
+            broker.publish(1, 'tick', {})
+            kept = broker.replay(1, 0)
+            with override_settings(EVENTS_REPLAY_WINDOW=0):
+                broker.unsubscribe(broker.subscribe(2))
+            return kept, broker.replay(1, 0), sorted(broker._recent)
+
+        kept, replay, users = async_to_sync(scenario)()
+        self.assertEqual(len(kept), 1)
+        # User 1 left longer than the window ago by the time user 2 came
+        self.assertEqual((replay, users), ([], [2]))
+
+    def test_unsubscribed_streams_get_nothing(self):
+        async def scenario():
+            broker = LocalBroker()
+            subscription = broker.subscribe(1)
+            broker.unsubscribe(subscription)
+            broker.publish(1, 'post_liked', {})
+            await asyncio.sleep(0)
+            return subscription.queue.empty(), broker.subscribed_users()
+
+        self.assertEqual(async_to_sync(scenario)(), (True, []))
+
+    @override_settings(EVENTS_QUEUE_SIZE=2)
+    def test_stalled_stream_drops_overflow_and_replay_keeps_the_latest(self):
+        async def scenario():
+            broker = LocalBroker()
+            subscription = broker.subscribe(1)
+            for number in range(3):
+                broker.publish(1, 'tick', {'n': number})
+            await asyncio.sleep(0)
+            return subscription.queue.qsize(), broker.replay(1, 0)
+
+        queued, replay = async_to_sync(scenario)()
+        self.assertEqual(queued, 2)
+        self.assertEqual([event['data']['n'] for event in replay], [1, 2])
+
+    def test_notify_publishes_after_commit(self):
+        published = []
+
+        class Recorder(LocalBroker):
+            def publish(self, user_id, event_type, data):
+                published.append((user_id, event_type, data))
+
+        broker_module._broker = Recorder()
+        self.addCleanup(setattr, broker_module, '_broker', None)
+        with self.captureOnCommitCallbacks(execute=True):
+            notify(7, 'friend_request', {'id': 1})
+            self.assertEqual(published, [])
+        self.assertEqual(published, [(7, 'friend_request', {'id': 1})])
+
+
+class DatabaseBrokerTests(TestCase):
+
+    def test_publish_stores_and_replay_reads_after_the_id(self):
+        user = User.objects.create_user(
+            email='user@example.com', first_name='U', last_name='Ser', password='password-123'
+        )
+        broker = DatabaseBroker()
+        for number in range(3):
+            broker.publish(user.id, 'tick', {'n': number})
+        first = Event.objects.order_by('id').first()
+        self.assertEqual(
+            [(event['type'], event['data']) for event in broker.replay(user.id, first.id)],
+            [('tick', {'n': 1}), ('tick', {'n': 2})]
+        )
+
+
+@override_settings(EVENTS_BROKER='events.broker.LocalBroker', EVENTS_HEARTBEAT=0.05)
+class EventStreamTests(TestCase):
+
+    def setUp(self):
+        broker_module._broker = None
+        self.addCleanup(setattr, broker_module, '_broker', None)
+        self.user = User.objects.create_user(
+            email='user@example.com', first_name='U', last_name='Ser', password='password-123'
+        )
+
+    def ticket(self):
+        return f'ticket={tickets.issue(self.user)}'
+
+    def open(self, query='', headers=(), during=None, wait=0.2, method='GET'):
+        """Run a stream request until ``during`` is done and ``wait`` seconds
+        more have passed; return the response status, headers and body."""
+        async def scenario():
+            messages = []
+            disconnect = asyncio.Event()
+
+            async def receive():
+                await disconnect.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                messages.append(message)
+
+            scope = {
+                'type': 'http', 'method': method, 'path': '/api/events/',
+                'query_string': query.encode(), 'headers': list(headers),
+            }
+            request = asyncio.ensure_future(application(scope, receive, send))
+            # Until the stream has subscribed
+            while not messages and not request.done():
+                await asyncio.sleep(0.01)
+            if during is not None:
+                during()
+            await asyncio.sleep(wait)
+            disconnect.set()
+            await asyncio.wait_for(request, 1)
+            return messages
+
+        messages = async_to_sync(scenario)()
+        start = messages[0]
+        body = b''.join(message.get('body', b'') for message in messages[1:]).decode()
+        return start['status'], dict(start['headers']), body
+
+    def publish(self, event_type, data):
+        return lambda: broker_module.get_broker().publish(self.user.id, event_type, data)
+
+    def test_rejects_missing_or_bad_tickets(self):
+        self.assertEqual(self.open()[0], 401)
+        self.assertEqual(self.open('ticket=not-a-ticket')[0], 401)
+        # An access token is not accepted in the URL
+        self.assertEqual(self.open(f'token={AccessToken.for_user(self.user)}')[0], 401)
+        self.assertEqual(self.open(self.ticket(), method='POST')[0], 405)
+
+    def test_streams_events_in_sse_format(self):
+        status, headers, body = self.open(
+            self.ticket(), during=self.publish('post_liked', {'post_id': 3})
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b'content-type'], b'text/event-stream')
+        self.assertEqual(headers[b'cache-control'], b'no-store')
+        self.assertTrue(body.startswith('retry: 5000\n\n'))
+        self.assertIn('id: 1\nevent: post_liked\ndata: {"post_id":3}\n\n', body)
+
+    def test_idle_stream_gets_keepalives(self):
+        body = self.open(self.ticket(), wait=0.3)[2]
+        self.assertGreaterEqual(body.count(': keepalive\n\n'), 2)
+
+    def test_resume_sends_missed_events_once(self):
+        # A first connection saw event 1, then events 2 and 3 were missed
+        self.open(self.ticket(), during=self.publish('tick', {'n': 1}), wait=0)
+        broker = broker_module.get_broker()
+        broker.publish(self.user.id, 'tick', {'n': 2})
+        broker.publish(self.user.id, 'tick', {'n': 3})
+
+        body = self.open(
+            self.ticket(), headers=[(b'last-event-id', b'1')],
+            during=self.publish('tick', {'n': 4})
+        )[2]
+        self.assertEqual(
+            [json.loads(line[len('data: '):])['n'] for line in body.splitlines() if line.startswith('data: ')],
+            [2, 3, 4]
+        )
+        # The query parameter works the same for clients that reopen the stream
+        body = self.open(f'{self.ticket()}&last_event_id=3', wait=0)[2]
+        self.assertIn('event: tick\ndata: {"n":4}', body)
+        self.assertNotIn('"n":3', body)
+
+
+class StreamTicketTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='user@example.com', first_name='U', last_name='Ser', password='password-123'
+        )
+
+    def test_endpoint_issues_tickets_to_signed_in_users(self):
+        client = APIClient()
+        self.assertEqual(client.post('/api/events/ticket/').status_code, 401)
+        client.force_authenticate(self.user)
+        response = client.post('/api/events/ticket/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['expires_in'], settings.EVENTS_TICKET_TTL)
+        self.assertEqual(tickets.redeem(response.data['ticket']), self.user.id)
+
+    def test_ticket_is_single_use(self):
+        ticket = tickets.issue(self.user)
+        self.assertEqual(tickets.redeem(ticket), self.user.id)
+        self.assertIsNone(tickets.redeem(ticket))
+
+    def test_expired_tampered_and_revoked_tickets_are_refused(self):
+        with override_settings(EVENTS_TICKET_TTL=-1):
+            self.assertIsNone(tickets.redeem(tickets.issue(self.user)))
+        self.assertIsNone(tickets.redeem(tickets.issue(self.user) + 'x'))
+        self.assertIsNone(tickets.redeem(signing.dumps({'user': self.user.id}, salt='other')))
+
+        ticket = tickets.issue(self.user)
+        User.objects.filter(pk=self.user.pk).update(token_version=self.user.token_version + 1)
+        self.assertIsNone(tickets.redeem(ticket))
+
+
+class AsgiDeploymentTests(TestCase):
+    """The Procfile serves buddyscript_backend.asgi with uvicorn workers."""
+
+    def test_procfile_runs_the_asgi_app_on_uvicorn(self):
+        procfile = Path(settings.BASE_DIR, 'Procfile').read_text()
+        web = next(line for line in procfile.splitlines() if line.startswith('web:'))
+        self.assertIn('buddyscript_backend.asgi:application', web)
+        self.assertIn('-k uvicorn.workers.UvicornWorker', web)
+        module, name = web.split()[2].split(':')
+        self.assertIs(getattr(importlib.import_module(module), name), application)
+        if importlib.util.find_spec('uvicorn') is not None:
+            import_string('uvicorn.workers.UvicornWorker')
+
+    def test_other_paths_go_to_django(self):
+        async def scenario():
+            messages = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                messages.append(message)
+
+            await application({
+                'type': 'http', 'method': 'GET', 'path': '/api/posts/', 'query_string': b'',
+                'headers': [], 'http_version': '1.1', 'scheme': 'http',
+                'server': ('testserver', 80), 'client': ('127.0.0.1', 1234),
+            }, receive, send)
+            return messages
+
+        messages = async_to_sync(scenario)()
+        self.assertEqual(messages[0]['status'], 401)
@@ -0,0 +1,45 @@
+"""Short-lived, single-use tickets for opening the event stream.
+
+``EventSource`` cannot send an ``Authorization`` header, and an access
+token in the stream's URL would end up in proxy and server access logs,
+valid for a day. Clients instead exchange their token for a ticket
+(``POST /api/events/ticket/``) right before opening the stream. A ticket is
+signed, so any worker can check it, names the user and their
+``token_version``, expires after ``EVENTS_TICKET_TTL`` seconds and is
+refused once a stream has used it. With a per-process cache (LocMemCache)
+the single use only holds within one process; the expiry still applies.
+"""
+import secrets
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import cache
+
+User = get_user_model()
+
+SALT = 'events.ticket'
+
+
+def issue(user):
+    return signing.dumps(
+        {'user': user.id, 'ver': user.token_version, 'nonce': secrets.token_hex(8)},
+        salt=SALT
+    )
+
+
+def redeem(ticket):
+    """Return the ID of the active user a valid, unused ticket names, or None."""
+    if not ticket:
+        return None
+    try:
+        claims = signing.loads(ticket, salt=SALT, max_age=settings.EVENTS_TICKET_TTL)
+    except signing.BadSignature:
+        return None
+    # The first stream to present the ticket claims it
+    if not cache.add(f"events_ticket:{claims['nonce']}", True, settings.EVENTS_TICKET_TTL):
+        return None
+    active = User.objects.filter(
+        pk=claims['user'], is_active=True, token_version=claims['ver']
+    ).exists()
+    return claims['user'] if active else None
@@ -0,0 +1,8 @@
+from django.urls import path
+
+from .views import StreamTicketView
+
+# The stream itself (/api/events/) is served by events.sse, not Django
+urlpatterns = [
+    path('ticket/', StreamTicketView.as_view(), name='events-ticket'),
+]
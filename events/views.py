@@ -0,0 +1,17 @@
+from django.conf import settings
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from . import tickets
+
+
+class StreamTicketView(APIView):
+    """Ticket for opening GET /api/events/ (see events.tickets)"""
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def post(self, request):
+        return Response({
+            'ticket': tickets.issue(request.user),
+            'expires_in': settings.EVENTS_TICKET_TTL,
+        })
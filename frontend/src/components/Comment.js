@@ -1,11 +1,12 @@
 import React, { useState } from 'react';
-import { commentAPI } from '../services/api';
+import { commentAPI, nextCursor } from '../services/api';
 
 const Comment = ({ comment, postId, currentUser, isReply = false }) => {
   const [showReplyForm, setShowReplyForm] = useState(false);
   const [replyContent, setReplyContent] = useState('');
   const [showLikes, setShowLikes] = useState(false);
   const [localComment, setLocalComment] = useState(comment);
+  const [repliesCursor, setRepliesCursor] = useState('');
 
   const handleLike = async () => {
     try {
@@ -39,6 +40,7 @@ const Comment = ({ comment, postId, currentUser, isReply = false }) => {
       setLocalComment({
         ...localComment,
         replies: [res.data, ...(localComment.replies || [])],
+        replies_count: (localComment.replies_count || 0) + 1,
       });
 
       setReplyContent('');
@@ -48,6 +50,26 @@ const Comment = ({ comment, postId, currentUser, isReply = false }) => {
     }
   };
 
+  const loadMoreReplies = async () => {
+    try {
+      const res = await commentAPI.getReplies(localComment.id, repliesCursor);
+      const next = nextCursor(res) || '';
+
+      // The embedded replies are the newest ones, so skip any already shown
+      const shown = new Set((localComment.replies || []).map((reply) => reply.id));
+      setLocalComment({
+        ...localComment,
+        replies: [
+          ...(localComment.replies || []),
+          ...res.data.results.filter((reply) => !shown.has(reply.id)),
+        ],
+      });
+      setRepliesCursor(next);
+    } catch (error) {
+      console.error('Error loading replies:', error);
+    }
+  };
+
   const formatDate = (dateString) => {
     const date = new Date(dateString);
     const now = new Date();
@@ -190,6 +212,21 @@ const Comment = ({ comment, postId, currentUser, isReply = false }) => {
           ))}
         </div>
       )}
+
+      {!isReply && localComment.replies_count > (localComment.replies || []).length && (
+        <div
+          onClick={loadMoreReplies}
+          style={{
+            marginLeft: '40px',
+            fontSize: '13px',
+            fontWeight: '600',
+            color: '#65676b',
+            cursor: 'pointer',
+          }}
+        >
+          View more replies
+        </div>
+      )}
     </div>
   );
 };
@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { Link, useNavigate } from 'react-router-dom';
 import { useAuth } from '../context/AuthContext';
-import { friendAPI } from '../services/api';
+import { friendAPI, openEventStream } from '../services/api';
 
 const Header = () => {
   const { user, logout } = useAuth();
@@ -11,9 +11,52 @@ const Header = () => {
 
   useEffect(() => {
     fetchFriendRequests();
-    // Poll for new requests every 30 seconds
-    const interval = setInterval(fetchFriendRequests, 30000);
-    return () => clearInterval(interval);
+
+    // New requests are pushed by the server instead of polled
+    let source;
+    let retryTimer;
+    let closed = false;
+    let connectedBefore = false;
+    let lastEventId = '';
+    const retry = () => {
+      retryTimer = setTimeout(async () => {
+        await fetchFriendRequests();
+        connect();
+      }, 5000);
+    };
+    const connect = async () => {
+      try {
+        source = await openEventStream(lastEventId);
+      } catch (error) {
+        if (!closed) retry();
+        return;
+      }
+      if (closed) {
+        source.close();
+        return;
+      }
+      source.onopen = () => {
+        // Catch up on anything missed while disconnected
+        if (connectedBefore) fetchFriendRequests();
+        connectedBefore = true;
+      };
+      source.addEventListener('friend_request', (event) => {
+        lastEventId = event.lastEventId;
+        fetchFriendRequests();
+      });
+      source.onerror = () => {
+        // Tickets are single-use, so a browser reconnect with the same URL
+        // is refused; reopen with a new ticket, resuming after the last event.
+        if (source.readyState === EventSource.CLOSED) retry();
+      };
+    };
+    connect();
+
+    return () => {
+      closed = true;
+      clearTimeout(retryTimer);
+      if (source) source.close();
+    };
   }, []);
 
   const fetchFriendRequests = async () => {
@@ -1,5 +1,5 @@
 import React, { useState } from 'react';
-import { postAPI, commentAPI } from '../services/api';
+import { postAPI, commentAPI, nextCursor } from '../services/api';
 import Comment from './Comment';
 
 const Post = ({ post, onLikeToggle, onAddComment, currentUser, onDelete }) => {
@@ -7,6 +7,36 @@ const Post = ({ post, onLikeToggle, onAddComment, currentUser, onDelete }) => {
   const [commentContent, setCommentContent] = useState('');
   const [showLikes, setShowLikes] = useState(false);
   const [showOptions, setShowOptions] = useState(false); // For three-dot menu
+  const [allComments, setAllComments] = useState(null); // Loaded on demand; the feed only embeds a preview
+
+  const shownComments = allComments || post.comments || [];
+  const shownCommentsCount = shownComments.reduce(
+    (total, comment) => total + 1 + (comment.replies ? comment.replies.length : 0),
+    0
+  );
+
+  const loadAllComments = async () => {
+    try {
+      // Follow the cursor to the last page; ids guard against a comment
+      // being added (and so embedded twice) while the pages load
+      const comments = [];
+      const seen = new Set();
+      let cursor = '';
+      while (cursor !== null) {
+        const response = await commentAPI.getComments(post.id, cursor);
+        response.data.results.forEach((comment) => {
+          if (!seen.has(comment.id)) {
+            seen.add(comment.id);
+            comments.push(comment);
+          }
+        });
+        cursor = nextCursor(response);
+      }
+      setAllComments(comments);
+    } catch (error) {
+      console.error('Error loading comments:', error);
+    }
+  };
 
   const handleLike = async () => {
     try {
@@ -24,6 +54,9 @@ const Post = ({ post, onLikeToggle, onAddComment, currentUser, onDelete }) => {
     try {
       const response = await commentAPI.createComment(post.id, commentContent);
       setCommentContent('');
+      if (allComments) {
+        setAllComments([response.data, ...allComments]);
+      }
       onAddComment(post.id, response.data);
       setShowComments(true);
     } catch (error) {
@@ -142,6 +175,8 @@ const Post = ({ post, onLikeToggle, onAddComment, currentUser, onDelete }) => {
           {showLikes && post.likes && post.likes.length > 0 && (
             <div style={{ marginTop: '10px', fontSize: '12px', color: '#666' }}>
               Liked by: {post.likes.map(like => like.user.full_name).join(', ')}
+              {post.likes_count > post.likes.length &&
+                ` and ${post.likes_count - post.likes.length} other${post.likes_count - post.likes.length === 1 ? '' : 's'}`}
             </div>
           )}
         </div>
@@ -192,7 +227,7 @@ const Post = ({ post, onLikeToggle, onAddComment, currentUser, onDelete }) => {
           </div>
 
           <div className="_timline_comment_main">
-            {post.comments && post.comments.map((comment) => (
+            {shownComments.map((comment) => (
               <Comment
                 key={comment.id}
                 comment={comment}
@@ -200,6 +235,11 @@ const Post = ({ post, onLikeToggle, onAddComment, currentUser, onDelete }) => {
                 currentUser={currentUser}
               />
             ))}
+            {!allComments && post.comments_count > shownCommentsCount && (
+              <button type="button" className="btn btn-link btn-sm" onClick={loadAllComments}>
+                View more comments
+              </button>
+            )}
           </div>
         </div>
       )}
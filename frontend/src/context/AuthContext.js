@@ -1,5 +1,8 @@
 import React, { createContext, useState, useContext, useEffect } from 'react';
-import { authAPI } from '../services/api';
+import { authAPI, presenceAPI } from '../services/api';
+
+// Keep in step with PRESENCE_TIMEOUT on the server (90 seconds)
+const HEARTBEAT_INTERVAL = 60000;
 
 const AuthContext = createContext(null);
 
@@ -27,6 +30,22 @@ export const AuthProvider = ({ children }) => {
     initAuth();
   }, []);
 
+  // Tell the server this user is online while a tab is visible
+  useEffect(() => {
+    if (!user) return undefined;
+
+    const beat = () => {
+      if (!document.hidden) presenceAPI.heartbeat().catch(() => {});
+    };
+    beat();
+    const interval = setInterval(beat, HEARTBEAT_INTERVAL);
+    document.addEventListener('visibilitychange', beat);
+    return () => {
+      clearInterval(interval);
+      document.removeEventListener('visibilitychange', beat);
+    };
+  }, [user]);
+
   const login = async (email, password) => {
     try {
       const response = await authAPI.login({ email, password });
@@ -59,6 +78,7 @@ export const AuthProvider = ({ children }) => {
   };
 
   const logout = () => {
+    presenceAPI.leave().catch(() => {});
     localStorage.removeItem('access_token');
     localStorage.removeItem('refresh_token');
     localStorage.removeItem('user');
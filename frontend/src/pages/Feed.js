@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { useAuth } from '../context/AuthContext';
-import { postAPI } from '../services/api';
+import { postAPI, nextCursor } from '../services/api';
 import CreatePost from '../components/CreatePost';
 import Post from '../components/Post';
 import Header from '../components/Header';
@@ -9,22 +9,16 @@ import Header from '../components/Header';
 const Feed = () => {
   const [posts, setPosts] = useState([]);
   const [loading, setLoading] = useState(true);
-  const [page, setPage] = useState(1);
-  const [hasMore, setHasMore] = useState(true);
+  const [cursor, setCursor] = useState(null); // Next page's cursor; null on the last page
+  const [loadingMore, setLoadingMore] = useState(false);
   const { user, logout } = useAuth();
 
-  const fetchPosts = async (pageNum = 1) => {
+  const fetchPosts = async () => {
     try {
       setLoading(true);
-      const response = await postAPI.getPosts(pageNum);
-
-      if (pageNum === 1) {
-        setPosts(response.data.results);
-      } else {
-        setPosts(prev => [...prev, ...response.data.results]);
-      }
-
-      setHasMore(response.data.next !== null);
+      const response = await postAPI.getPosts();
+      setPosts(response.data.results);
+      setCursor(nextCursor(response));
     } catch (error) {
       console.error('Error fetching posts:', error);
     } finally {
@@ -33,21 +27,24 @@ const Feed = () => {
   };
 
   useEffect(() => {
-    fetchPosts(1);
+    fetchPosts();
   }, []);
 
   const handlePostCreated = () => {
-    fetchPosts(1);
-  };
-
-  const handlePostUpdate = () => {
-    fetchPosts(page);
+    fetchPosts();
   };
 
-  const loadMore = () => {
-    const nextPage = page + 1;
-    setPage(nextPage);
-    fetchPosts(nextPage);
+  const loadMore = async () => {
+    try {
+      setLoadingMore(true);
+      const response = await postAPI.getPosts(cursor);
+      setPosts((prev) => [...prev, ...response.data.results]);
+      setCursor(nextCursor(response));
+    } catch (error) {
+      console.error('Error loading more posts:', error);
+    } finally {
+      setLoadingMore(false);
+    }
   };
 
   const handlePostDelete = (postId) => {
@@ -87,7 +84,7 @@ const Feed = () => {
                     <CreatePost onPostCreated={handlePostCreated} />
 
                     {/* Posts Feed */}
-                    {loading && page === 1 ? (
+                    {loading ? (
                       <div className="text-center _padd_t24 _padd_b24">
                         <div className="spinner-border" role="status">
                           <span className="visually-hidden">Loading...</span>
@@ -132,7 +129,7 @@ const Feed = () => {
                           ))
                         )}
 
-                        {hasMore && !loading && (
+                        {cursor && !loadingMore && (
                           <div className="text-center _mar_b24">
                             <button
                               className="btn btn-primary"
@@ -143,7 +140,7 @@ const Feed = () => {
                           </div>
                         )}
 
-                        {loading && page > 1 && (
+                        {loadingMore && (
                           <div className="text-center _padd_b24">
                             <div className="spinner-border spinner-border-sm" role="status">
                               <span className="visually-hidden">Loading...</span>
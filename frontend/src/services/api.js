@@ -5,6 +5,8 @@ const API_URL = 'https://web-production-79de8.up.railway.app/api';
 
 const api = axios.create({
   baseURL: API_URL,
+  // Sends back the API's cookie that keeps reads on the primary after a write
+  withCredentials: true,
   headers: {
     'Content-Type': 'application/json',
   },
@@ -77,11 +79,23 @@ export const authAPI = {
   searchUsers: (query) => api.get(`/auth/users/search/?q=${query}`),
 };
 
+// Presence APIs
+export const presenceAPI = {
+  heartbeat: () => api.post('/auth/presence/'),
+  leave: () => api.delete('/auth/presence/'),
+};
+
+// The cursor for the page after a keyset-paginated response, or null on the last page
+export const nextCursor = (response) =>
+  response.data.next ? new URL(response.data.next).searchParams.get('cursor') : null;
+
 // Post APIs
 export const postAPI = {
-  getPosts: (page = 1) => api.get(`/posts/?page=${page}`),
+  // Newest first; pass the previous page's cursor (see nextCursor) for the next one
+  getPosts: (cursor = '') => api.get(`/posts/?cursor=${encodeURIComponent(cursor)}`),
   getPost: (id) => api.get(`/posts/${id}/`),
-  getUserPosts: (userId, page = 1) => api.get(`/posts/?author=${userId}&page=${page}`),
+  getUserPosts: (userId, cursor = '') =>
+    api.get(`/posts/?author=${userId}&cursor=${encodeURIComponent(cursor)}`),
   createPost: (postData) => {
     const formData = new FormData();
     formData.append('content', postData.content);
@@ -96,11 +110,17 @@ export const postAPI = {
   updatePost: (id, postData) => api.patch(`/posts/${id}/`, postData),
   deletePost: (id) => api.delete(`/posts/${id}/`),
   toggleLike: (id) => api.post(`/posts/${id}/like/`),
+  // operations: [{ type: 'post' | 'comment', id, liked }]
+  setLikes: (operations) => api.post('/posts/likes/batch/', { operations }),
 };
 
 // Comment APIs
 export const commentAPI = {
-  getComments: (postId) => api.get(`/posts/${postId}/comments/`),
+  getComments: (postId, cursor = '', limit = 20) =>
+    api.get(`/posts/${postId}/comments/?limit=${limit}&cursor=${encodeURIComponent(cursor)}`),
+  // Direct replies, newest first; pass the previous page's cursor for the next one
+  getReplies: (id, cursor = '') =>
+    api.get(`/posts/comments/${id}/replies/?cursor=${encodeURIComponent(cursor)}`),
   createComment: (postId, content, parentId = null) =>
     api.post(`/posts/${postId}/comments/`, { content, parent: parentId }),
   updateComment: (id, content) => api.patch(`/posts/comments/${id}/`, { content }),
@@ -118,4 +138,14 @@ export const friendAPI = {
   unfriend: (userId) => api.delete(`/auth/unfriend/${userId}/`),
 };
 
+// Server push: a stream of events for the logged-in user. The stream is
+// opened with a short-lived, single-use ticket so the access token never
+// appears in a URL.
+export const openEventStream = async (lastEventId) => {
+  const response = await api.post('/events/ticket/');
+  const params = new URLSearchParams({ ticket: response.data.ticket });
+  if (lastEventId) params.set('last_event_id', lastEventId);
+  return new EventSource(`${API_URL}/events/?${params}`);
+};
+
 export default api;
\ No newline at end of file
@@ -0,0 +1,78 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from jobs import queue
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs from the database queue.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=settings.JOBS_CONCURRENCY,
+            help='Number of jobs to run at the same time (one thread each).'
+        )
+        parser.add_argument(
+            '--visibility-timeout', type=int, default=settings.JOBS_VISIBILITY_TIMEOUT,
+            help='Seconds a claimed job stays leased before another worker may retry it.'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=settings.JOBS_POLL_INTERVAL,
+            help='Seconds to wait when the queue is empty.'
+        )
+        parser.add_argument(
+            '--burst', action='store_true',
+            help='Exit once no due jobs are left instead of waiting for more.'
+        )
+
+    def handle(self, *args, **options):
+        self.stopping = threading.Event()
+        self.processed = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+
+        threads = [
+            threading.Thread(
+                target=self.work,
+                args=(options['visibility_timeout'], options['poll_interval'], options['burst']),
+                name=f'job-worker-{index}'
+            )
+            for index in range(max(1, options['concurrency']))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {self.processed} job(s), {self.failed} failed'
+        ))
+
+    def stop(self, signum, frame):
+        # Let running jobs finish; their leases would expire otherwise
+        self.stopping.set()
+
+    def work(self, visibility_timeout, poll_interval, burst):
+        try:
+            while not self.stopping.is_set():
+                close_old_connections()
+                job = queue.claim(visibility_timeout)
+                if job is None:
+                    if burst:
+                        return
+                    self.stopping.wait(poll_interval)
+                    continue
+                succeeded = queue.run(job)
+                with self.lock:
+                    self.processed += 1
+                    self.failed += not succeeded
+        finally:
+            connection.close()
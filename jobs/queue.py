@@ -0,0 +1,128 @@
+"""Database-backed background jobs.
+
+``enqueue`` stores a call to a module-level function as a ``Job`` row. The
+row is written in the caller's transaction, so a job exists only if the
+work that scheduled it commits. ``run_jobs`` workers claim due jobs with a
+conditional UPDATE (no broker, no row locks held while a job runs) and lease
+them for ``JOBS_VISIBILITY_TIMEOUT`` seconds; a job whose worker died is
+picked up again when the lease expires. Failed jobs are retried with
+exponential backoff and kept with their error once out of attempts.
+Finished jobs are deleted. A job may run more than once (a lease can expire
+under a slow run), so tasks must be idempotent.
+"""
+import logging
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+CLAIM_CANDIDATES = 10
+
+
+def task_path(task):
+    if isinstance(task, str):
+        return task
+    return f'{task.__module__}.{task.__qualname__}'
+
+
+def enqueue(task, *args, **kwargs):
+    """Schedule ``task(*args, **kwargs)`` to run on a worker.
+
+    ``task`` is a module-level function or its dotted path; arguments must
+    be JSON serializable. With ``JOBS_RUN_INLINE`` the call runs in-process
+    once the current transaction commits, which is handy in development.
+    """
+    return _schedule(task, args, kwargs, timezone.now())
+
+
+def enqueue_in(delay, task, *args, **kwargs):
+    """``enqueue`` with the job held back for ``delay`` seconds (not with
+    ``JOBS_RUN_INLINE``, which runs it on commit as usual)."""
+    return _schedule(task, args, kwargs, timezone.now() + timedelta(seconds=delay))
+
+
+def _schedule(task, args, kwargs, run_at):
+    path = task_path(task)
+    if settings.JOBS_RUN_INLINE:
+        transaction.on_commit(lambda: import_string(path)(*args, **kwargs))
+        return None
+    return Job.objects.create(
+        task=path,
+        args=list(args),
+        kwargs=kwargs,
+        run_at=run_at,
+        max_attempts=settings.JOBS_MAX_ATTEMPTS
+    )
+
+
+def _due(now):
+    return (
+        Q(status='queued', run_at__lte=now) |
+        Q(status='running', locked_until__lt=now)
+    )
+
+
+def claim(visibility_timeout=None):
+    """Lease the next due job to the calling worker, or return None."""
+    timeout = visibility_timeout or settings.JOBS_VISIBILITY_TIMEOUT
+    now = timezone.now()
+    candidates = Job.objects.filter(_due(now)).order_by(
+        'run_at', 'id'
+    ).values_list('id', flat=True)[:CLAIM_CANDIDATES]
+
+    for job_id in candidates:
+        token = uuid.uuid4().hex
+        # Only one worker's UPDATE can still match the "due" condition
+        claimed = Job.objects.filter(_due(now), id=job_id).update(
+            status='running',
+            locked_until=now + timedelta(seconds=timeout),
+            locked_by=token,
+            attempts=F('attempts') + 1
+        )
+        if claimed:
+            return Job.objects.get(id=job_id)
+    return None
+
+
+def _owned(job):
+    return Job.objects.filter(id=job.id, locked_by=job.locked_by)
+
+
+def _fail(job, error):
+    if job.attempts < job.max_attempts:
+        delay = settings.JOBS_RETRY_DELAY * 2 ** (job.attempts - 1)
+        _owned(job).update(
+            status='queued',
+            run_at=timezone.now() + timedelta(seconds=delay),
+            locked_until=None,
+            last_error=error
+        )
+    else:
+        _owned(job).update(status='failed', locked_until=None, last_error=error)
+
+
+def run(job):
+    """Run a claimed job and record the outcome. Returns True on success."""
+    if job.attempts > job.max_attempts:
+        # Leased and lost (worker killed, timeout) too many times already
+        _fail(job, job.last_error or 'Visibility timeout expired')
+        return False
+
+    try:
+        import_string(job.task)(*job.args, **job.kwargs)
+    except Exception:
+        logger.exception('Job %s (%s) failed on attempt %s', job.id, job.task, job.attempts)
+        _fail(job, traceback.format_exc())
+        return False
+
+    _owned(job).delete()
+    return True
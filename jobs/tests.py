@@ -0,0 +1,163 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from accounts.models import User
+from posts.models import Post, PostLike, Comment, CommentLike, TimelineEntry
+from . import queue
+from .models import Job
+
+calls = []
+
+
+def record(*args, **kwargs):
+    calls.append((args, kwargs))
+
+
+def explode():
+    raise RuntimeError('boom')
+
+
+@override_settings(JOBS_RUN_INLINE=False, JOBS_MAX_ATTEMPTS=3, JOBS_RETRY_DELAY=10)
+class QueueTests(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueue_stores_the_call(self):
+        job = queue.enqueue(record, 1, 'two', three=3)
+        self.assertEqual(job.task, 'jobs.tests.record')
+        self.assertEqual((job.args, job.kwargs), ([1, 'two'], {'three': 3}))
+        self.assertEqual(job.max_attempts, 3)
+
+    def test_claim_leases_one_due_job_in_order(self):
+        first = queue.enqueue(record, 1)
+        queue.enqueue_in(60, record, 2)
+        queue.enqueue(record, 3)
+
+        job = queue.claim()
+        self.assertEqual(job.id, first.id)
+        self.assertEqual((job.status, job.attempts), ('running', 1))
+        self.assertTrue(job.locked_by)
+        # The held-back job is not due yet
+        self.assertEqual(queue.claim().args, [3])
+        self.assertIsNone(queue.claim())
+
+    def test_success_runs_and_deletes_the_job(self):
+        queue.enqueue(record, 1, key='value')
+        self.assertTrue(queue.run(queue.claim()))
+        self.assertEqual(calls, [((1,), {'key': 'value'})])
+        self.assertFalse(Job.objects.exists())
+
+    def test_failure_retries_with_backoff(self):
+        queue.enqueue(explode)
+        delays = []
+        for attempt in range(1, 4):
+            job = queue.claim()
+            self.assertEqual(job.attempts, attempt)
+            before = timezone.now()
+            with self.assertLogs('jobs.queue', 'ERROR'):
+                self.assertFalse(queue.run(job))
+            job.refresh_from_db()
+            if attempt < 3:
+                self.assertEqual(job.status, 'queued')
+                delays.append(round((job.run_at - before).total_seconds()))
+                Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        self.assertEqual(delays, [10, 20])
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('RuntimeError: boom', job.last_error)
+        self.assertIsNone(queue.claim())
+
+    def test_expired_lease_is_reclaimed(self):
+        queue.enqueue(record, 1)
+        lost = queue.claim()
+        self.assertIsNone(queue.claim())
+
+        Job.objects.filter(pk=lost.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        job = queue.claim()
+        self.assertEqual((job.id, job.attempts), (lost.id, 2))
+        self.assertNotEqual(job.locked_by, lost.locked_by)
+
+        # The first worker no longer owns the job and cannot finish it
+        queue._fail(lost, 'late')
+        self.assertEqual(Job.objects.get(pk=job.pk).status, 'running')
+        self.assertTrue(queue.run(job))
+        self.assertFalse(Job.objects.exists())
+
+    def test_too_many_lost_leases_fail_the_job(self):
+        queue.enqueue(record, 1)
+        Job.objects.update(attempts=3)
+        Job.objects.update(status='running', locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertFalse(queue.run(queue.claim()))
+        self.assertEqual(Job.objects.get().status, 'failed')
+        self.assertEqual(calls, [])
+
+    @override_settings(JOBS_RUN_INLINE=True)
+    def test_inline_mode_runs_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertIsNone(queue.enqueue(record, 1))
+            self.assertEqual(calls, [])
+        self.assertEqual(calls, [((1,), {})])
+
+
+@override_settings(JOBS_RUN_INLINE=False)
+class RunJobsCommandTests(TransactionTestCase):
+    """The worker threads use their own connections, so the jobs are committed."""
+
+    def setUp(self):
+        calls.clear()
+
+    def test_burst_drains_the_queue(self):
+        for number in range(3):
+            queue.enqueue(record, number)
+        queue.enqueue(explode)
+        out = StringIO()
+        with self.assertLogs('jobs.queue', 'ERROR'):
+            call_command('run_jobs', '--burst', '--concurrency', '2', stdout=out)
+        self.assertEqual(sorted(args for args, _ in calls), [(0,), (1,), (2,)])
+        self.assertIn('Processed 4 job(s), 1 failed', out.getvalue())
+        # Only the failed job is left, waiting for its retry
+        self.assertEqual(Job.objects.get().status, 'queued')
+
+
+@override_settings(JOBS_RUN_INLINE=False)
+class PurgePostTests(APITestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            email='author@example.com', first_name='A', last_name='Author', password='password-123'
+        )
+        self.client.force_authenticate(self.author)
+        self.post = Post.objects.create(author=self.author, content='doomed')
+        self.comment = Comment.objects.create(post=self.post, author=self.author, content='hi')
+        Comment.objects.create(post=self.post, author=self.author, content='re', parent=self.comment)
+        PostLike.objects.create(post=self.post, user=self.author)
+        CommentLike.objects.create(comment=self.comment, user=self.author)
+        TimelineEntry.objects.create(
+            user=self.author, post=self.post, created_at=self.post.created_at
+        )
+
+    def test_delete_hides_now_and_purges_in_a_job(self):
+        self.assertEqual(self.client.delete(f'/api/posts/{self.post.id}/').status_code, 204)
+
+        self.assertFalse(Post.objects.filter(pk=self.post.pk).exists())
+        self.assertTrue(Post.all_objects.filter(pk=self.post.pk).exists())
+        job = queue.claim()
+        self.assertEqual((job.task, job.args), ('posts.tasks.purge_post', [self.post.pk]))
+
+        with mock.patch('posts.tasks.PURGE_CHUNK_SIZE', 1):
+            self.assertTrue(queue.run(job))
+        self.assertFalse(Post.all_objects.filter(pk=self.post.pk).exists())
+        for model in (Comment, PostLike, CommentLike, TimelineEntry):
+            self.assertFalse(model.objects.exists(), model.__name__)
+
+    def test_purge_leaves_live_posts_alone(self):
+        queue.enqueue('posts.tasks.purge_post', self.post.pk)
+        self.assertTrue(queue.run(queue.claim()))
+        self.assertTrue(Post.objects.filter(pk=self.post.pk).exists())
+        self.assertEqual(Comment.objects.count(), 2)
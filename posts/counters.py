@@ -0,0 +1,177 @@
+"""Stored like/comment/reply/post counters.
+
+Counters are adjusted in SQL as rows are written. A post getting more than
+``COUNTER_SHARD_THRESHOLD`` counter writes in ``COUNTER_SHARD_WINDOW``
+seconds is "hot": its like and comment counts then go to a random one of
+``COUNTER_SHARDS`` ``PostCounterShard`` rows instead of the post row, so
+concurrent writers do not queue on one row lock. ``shard_totals`` gives the
+amounts not yet folded in, and a ``compact_post_counters`` job scheduled
+``COUNTER_COMPACT_INTERVAL`` seconds after the first sharded write adds
+them to the post. Readers add ``shard_totals`` to the stored counts of every
+post they show: one query on the ``(post, shard)`` index per page, which
+finds nothing for posts that were never hot.
+"""
+import random
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Greatest
+
+from jobs.queue import enqueue_in
+from . import threads
+from .models import Post, PostCounterShard, Comment
+
+User = get_user_model()
+
+SHARDED_FIELDS = ('likes_count', 'comments_count')
+
+
+def adjust_counter(model, pk, field, delta):
+    """Atomically add ``delta`` to a stored counter column.
+
+    The update happens in SQL so concurrent writers never lose increments,
+    and decrements never take the counter below zero.
+    """
+    if not delta:
+        return
+    queryset = model.objects.filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def adjust_counters(model, pks, field, delta):
+    """``adjust_counter`` for many rows with one UPDATE."""
+    if not delta or not pks:
+        return
+    queryset = model.objects.filter(pk__in=pks)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def hits(name, post_id, window):
+    """Count an event on a post; return how many happened in this window."""
+    key = f'{name}:{post_id}:{int(time.time() // window)}'
+    cache.add(key, 0, window)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Expired between add() and incr()
+        return 0
+
+
+def is_hot(post_id):
+    window = settings.COUNTER_SHARD_WINDOW
+    return hits('counter_writes', post_id, window) > settings.COUNTER_SHARD_THRESHOLD
+
+
+def _add_to_shard(post_id, field, delta):
+    shard = random.randrange(settings.COUNTER_SHARDS)
+    rows = PostCounterShard.objects.filter(post_id=post_id, shard=shard)
+    if not rows.update(**{field: F(field) + delta}):
+        try:
+            with transaction.atomic():
+                PostCounterShard.objects.create(post_id=post_id, shard=shard, **{field: delta})
+        except IntegrityError:
+            # Another writer created the shard first
+            rows.update(**{field: F(field) + delta})
+
+    interval = settings.COUNTER_COMPACT_INTERVAL
+    if cache.add(f'counter_compaction:{post_id}', True, interval):
+        enqueue_in(interval, 'posts.tasks.compact_post_counters', post_id)
+
+
+def adjust_post_counter(post_id, field, delta):
+    if not delta:
+        return
+    if is_hot(post_id):
+        _add_to_shard(post_id, field, delta)
+    else:
+        adjust_counter(Post, post_id, field, delta)
+
+
+def shard_totals(post_ids):
+    """Return ``{post_id: {field: delta}}`` still held in counter shards."""
+    if not post_ids:
+        return {}
+    rows = PostCounterShard.objects.filter(
+        post_id__in=list(post_ids)
+    ).order_by().values('post_id').annotate(
+        **{field: Sum(field) for field in SHARDED_FIELDS}
+    )
+    return {row.pop('post_id'): row for row in rows}
+
+
+def post_counts(post):
+    """Return ``post``'s likes and comments counts including its shards."""
+    pending = shard_totals([post.id]).get(post.id, {})
+    return {
+        field: max(0, getattr(post, field) + (pending.get(field) or 0))
+        for field in SHARDED_FIELDS
+    }
+
+
+def compact(post_id):
+    """Fold a post's counter shards into the post row."""
+    with transaction.atomic():
+        shards = list(PostCounterShard.objects.select_for_update().filter(post_id=post_id))
+        if not shards:
+            return
+        Post.all_objects.filter(pk=post_id).update(**{
+            field: Greatest(F(field) + sum(getattr(shard, field) for shard in shards), 0)
+            for field in SHARDED_FIELDS
+        })
+        PostCounterShard.objects.filter(id__in=[shard.id for shard in shards]).delete()
+
+
+def compact_all():
+    post_ids = PostCounterShard.objects.values_list('post_id', flat=True).distinct()
+    for post_id in list(post_ids):
+        compact(post_id)
+
+
+def post_created(post):
+    adjust_counter(User, post.author_id, 'posts_count', 1)
+
+
+def post_deleted(post):
+    adjust_counter(User, post.author_id, 'posts_count', -1)
+
+
+def post_liked(post_id, delta=1):
+    adjust_post_counter(post_id, 'likes_count', delta)
+
+
+def posts_liked(post_ids, delta):
+    cold = [post_id for post_id in post_ids if not is_hot(post_id)]
+    for post_id in set(post_ids) - set(cold):
+        _add_to_shard(post_id, 'likes_count', delta)
+    adjust_counters(Post, cold, 'likes_count', delta)
+
+
+def comment_liked(comment_id, delta=1):
+    adjust_counter(Comment, comment_id, 'likes_count', delta)
+
+
+def comments_liked(comment_ids, delta):
+    adjust_counters(Comment, comment_ids, 'likes_count', delta)
+
+
+def comment_created(comment):
+    adjust_post_counter(comment.post_id, 'comments_count', 1)
+    if comment.parent_id:
+        adjust_counter(Comment, comment.parent_id, 'replies_count', 1)
+
+
+def comment_deleted(comment):
+    # Must run before the delete: replies at every depth go with the
+    # comment and are counted in the post's comments_count as well.
+    removed = threads.subtree(comment).count()
+    adjust_post_counter(comment.post_id, 'comments_count', -removed)
+    if comment.parent_id:
+        adjust_counter(Comment, comment.parent_id, 'replies_count', -1)
@@ -0,0 +1,203 @@
+"""Write-behind buffer for likes on hot posts.
+
+Once a post gets more than ``LIKE_BUFFER_HOT_THRESHOLD`` like toggles in a
+``LIKE_BUFFER_WINDOW``, further toggles no longer write ``post_likes``
+themselves. The user's intent (liked or not) is stored in the cache, which
+serves their own ``is_liked`` right away, and the change is added to a
+cached per-post delta that is shown on top of the stored ``likes_count``.
+The intents also go into a per-process buffer that a background thread
+writes every ``LIKE_BUFFER_FLUSH_INTERVAL`` seconds: one transaction per
+post, with the net changes of all its users (see ``likes.apply_intents``).
+A post whose write fails is retried on the next flushes, up to
+``LIKE_BUFFER_MAX_RETRIES`` times, and its intents are then dropped.
+
+A post stays buffered for as long as any of its intents is served from the
+cache, even once its toggles slow down: every like write on it, single or
+batched, must go through ``toggle`` or ``set_liked`` until then (see
+``buffers``), or it would not see the intents nor move the delta.
+
+With a per-process cache (LocMemCache) only the process that took a toggle
+sees it before the flush; point CACHE_BACKEND at a shared cache when running
+several workers.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+
+from . import counters, likes
+from .models import PostLike
+
+logger = logging.getLogger(__name__)
+
+_pending = defaultdict(dict)  # post_id -> {user_id: liked}
+_deltas = defaultdict(int)  # post_id -> change added to the cached delta
+_failures = defaultdict(int)  # post_id -> flushes in a row that failed
+_lock = threading.Lock()
+_flusher = None
+
+
+def _intent_key(post_id, user_id):
+    return f'like_intent:{post_id}:{user_id}'
+
+
+def _delta_key(post_id):
+    return f'like_delta:{post_id}'
+
+
+def _buffered_key(post_id):
+    return f'like_buffered:{post_id}'
+
+
+def _add(key, amount, timeout=None):
+    cache.add(key, 0, timeout)
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        # Expired between add() and incr()
+        cache.set(key, amount, timeout)
+    else:
+        cache.touch(key, timeout)
+
+
+def _unbuffer(post_id, amount):
+    """Take ``amount`` flushed (or dropped) changes out of the cached delta."""
+    if not amount:
+        return
+    try:
+        cache.incr(_delta_key(post_id), -amount)
+    except ValueError:
+        # Expired along with the intents it covered
+        pass
+
+
+def is_hot(post_id):
+    """Count a toggle on ``post_id``; True once the post should be buffered."""
+    toggles = counters.hits('like_toggles', post_id, settings.LIKE_BUFFER_WINDOW)
+    return toggles > settings.LIKE_BUFFER_HOT_THRESHOLD
+
+
+def buffers(post_id):
+    """Count a like write on ``post_id``; True if it must go through the
+    buffer: the post is hot, or still has intents served from the cache."""
+    return is_hot(post_id) or cache.get(_buffered_key(post_id)) is not None
+
+
+def _current(post_id, user_id):
+    liked = cache.get(_intent_key(post_id, user_id))
+    if liked is None:
+        liked = PostLike.objects.filter(post_id=post_id, user_id=user_id).exists()
+    return liked
+
+
+def _record(user_id, post_id, liked):
+    ttl = settings.LIKE_BUFFER_INTENT_TTL
+    change = 1 if liked else -1
+    # Set first and never shorter-lived than the intents, so no write skips
+    # the buffer while one of them is served
+    cache.set(_buffered_key(post_id), True, ttl)
+    cache.set(_intent_key(post_id, user_id), liked, ttl)
+    _add(_delta_key(post_id), change, ttl)
+    with _lock:
+        _pending[post_id][user_id] = liked
+        _deltas[post_id] += change
+        _start_flusher()
+
+
+def _likes_count(post):
+    delta = cache.get(_delta_key(post.id)) or 0
+    return max(0, counters.post_counts(post)['likes_count'] + delta)
+
+
+def toggle(user_id, post):
+    """Buffer a like toggle; return ``(liked, approximate likes_count)``."""
+    liked = not _current(post.id, user_id)
+    _record(user_id, post.id, liked)
+    return liked, _likes_count(post)
+
+
+def set_liked(user_id, post, liked):
+    """Buffer a "set liked" operation of ``likes.apply_batch``; return
+    whether it changed anything."""
+    changed = _current(post.id, user_id) != liked
+    if changed:
+        _record(user_id, post.id, liked)
+    return changed
+
+
+def overlay(user_id, post_ids):
+    """Return ``({post_id: liked}, {post_id: delta})`` of unflushed likes
+    for a page of posts, with one cache read."""
+    keys = {}
+    for post_id in post_ids:
+        keys[_delta_key(post_id)] = ('delta', post_id)
+        if user_id is not None:
+            keys[_intent_key(post_id, user_id)] = ('liked', post_id)
+    found = cache.get_many(list(keys))
+    liked, deltas = {}, {}
+    for key, value in found.items():
+        kind, post_id = keys[key]
+        (liked if kind == 'liked' else deltas)[post_id] = value
+    return liked, deltas
+
+
+def _retry(post_id, intents, delta):
+    with _lock:
+        _failures[post_id] += 1
+        if _failures[post_id] <= settings.LIKE_BUFFER_MAX_RETRIES:
+            # Toggles taken since the failed flush are newer and win
+            _pending[post_id] = {**intents, **_pending.get(post_id, {})}
+            _deltas[post_id] += delta
+            return
+        del _failures[post_id]
+        dropped = [user_id for user_id in intents if user_id not in _pending.get(post_id, {})]
+    logger.error(
+        'Dropping %s buffered like(s) of post %s after %s failed writes',
+        len(intents), post_id, settings.LIKE_BUFFER_MAX_RETRIES + 1
+    )
+    # Serve what the table holds again
+    cache.delete_many([_intent_key(post_id, user_id) for user_id in dropped])
+    _unbuffer(post_id, delta)
+
+
+def flush():
+    """Write buffered intents to ``post_likes`` and the stored counters."""
+    global _pending, _deltas
+    with _lock:
+        pending, _pending = _pending, defaultdict(dict)
+        deltas, _deltas = _deltas, defaultdict(int)
+    for post_id, intents in pending.items():
+        try:
+            likes.apply_intents(post_id, intents)
+        except Exception:
+            logger.exception('Could not write buffered likes of post %s', post_id)
+            _retry(post_id, intents, deltas[post_id])
+            continue
+        with _lock:
+            _failures.pop(post_id, None)
+        # The stored counter now includes them
+        _unbuffer(post_id, deltas[post_id])
+
+
+def _run():
+    while True:
+        time.sleep(settings.LIKE_BUFFER_FLUSH_INTERVAL)
+        try:
+            close_old_connections()
+            flush()
+        except Exception:
+            logger.exception('Like buffer flush failed')
+
+
+def _start_flusher():
+    # Called with _lock held
+    global _flusher
+    if _flusher is None:
+        _flusher = threading.Thread(target=_run, name='like-buffer-flusher', daemon=True)
+        _flusher.start()
+        atexit.register(flush)
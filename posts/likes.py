@@ -0,0 +1,174 @@
+"""Batched like/unlike operations.
+
+``apply_batch`` takes a list of idempotent "set liked"/"set unliked"
+operations on posts and comments (the last one for a target wins) and
+applies them with a fixed number of queries per target type, however long
+the batch: one visibility check, one read of the user's existing likes,
+one ``bulk_create``, one ``DELETE``, one counter ``UPDATE`` per direction
+and one read of the final counts.
+Likes on posts that are in the write-behind buffer (see ``like_buffer``)
+are set through the buffer instead.
+
+Counter deltas come from the read of existing likes, so two batches from
+the same user racing on the same target can move a counter by one too many;
+``recount_engagement`` repairs that.
+"""
+from django.db import transaction
+from django.db.models import Q
+
+from events.broker import notify, user_summary
+from . import counters, like_buffer
+from .models import Post, PostLike, Comment, CommentLike
+
+
+def visible_posts(user):
+    return Post.objects.filter(Q(visibility='public') | Q(author=user))
+
+
+def visible_comments(user):
+    return Comment.objects.filter(
+        Q(post__visibility='public') | Q(post__author=user),
+        post__is_deleted=False
+    )
+
+
+class Target:
+    """How the likes of one model are stored, checked and announced."""
+
+    def __init__(self, name, model, like_model, fk, visible, fields, event, counted):
+        self.name = name
+        self.model = model
+        self.like_model = like_model
+        self.fk = fk
+        self.visible = visible
+        # counters function taking (ids, delta)
+        self.counted = counted
+        # Loaded for the event sent to the author
+        self.fields = fields
+        self.event = event
+
+    def load(self, user, ids):
+        """Return ``{id: obj}`` for the targets ``user`` may see."""
+        return self.visible(user).filter(id__in=ids).only(*self.fields).in_bulk()
+
+    def event_data(self, obj, user, likes_count):
+        data = {'user': user_summary(user), 'likes_count': likes_count}
+        if self.model is Post:
+            data['post_id'] = obj.id
+        else:
+            data.update(post_id=obj.post_id, comment_id=obj.id)
+        return data
+
+
+TARGETS = {
+    'post': Target(
+        'post', Post, PostLike, 'post_id', visible_posts,
+        ('id', 'author_id'), 'post_liked', counters.posts_liked
+    ),
+    'comment': Target(
+        'comment', Comment, CommentLike, 'comment_id', visible_comments,
+        ('id', 'author_id', 'post_id'), 'comment_liked', counters.comments_liked
+    ),
+}
+
+
+def apply_batch(user, operations):
+    """Apply ``[{'type', 'id', 'liked'}, ...]`` for ``user``.
+
+    Returns ``{'posts': [...], 'comments': [...], 'not_found': [...]}``
+    with the final ``liked`` state and ``likes_count`` of every target.
+    """
+    wanted = {name: {} for name in TARGETS}
+    for operation in operations:
+        wanted[operation['type']][operation['id']] = operation['liked']
+
+    result = {'not_found': []}
+    for name, target in TARGETS.items():
+        states = wanted[name]
+        result[f'{name}s'] = _apply(user, target, states, result['not_found']) if states else []
+    return result
+
+
+def _apply(user, target, states, not_found):
+    objects = target.load(user, list(states))
+    not_found.extend({'type': target.name, 'id': pk} for pk in states if pk not in objects)
+    states = {pk: liked for pk, liked in states.items() if pk in objects}
+    if not states:
+        return []
+
+    # Posts with likes in the write-behind buffer take these through it too,
+    # so its cached intents and delta stay in step with the table
+    buffered = []
+    if target.model is Post:
+        buffered = [pk for pk in states if like_buffer.buffers(pk)]
+    added = [
+        pk for pk in buffered
+        if like_buffer.set_liked(user.id, objects[pk], states[pk]) and states[pk]
+    ]
+    direct = {pk: liked for pk, liked in states.items() if pk not in buffered}
+
+    like_model = target.like_model
+    if direct:
+        with transaction.atomic():
+            existing = set(
+                like_model.objects.filter(
+                    user=user, **{f'{target.fk}__in': list(direct)}
+                ).values_list(target.fk, flat=True)
+            )
+            created = [pk for pk, liked in direct.items() if liked and pk not in existing]
+            removed = [pk for pk, liked in direct.items() if not liked and pk in existing]
+
+            if created:
+                like_model.objects.bulk_create(
+                    [like_model(user=user, **{target.fk: pk}) for pk in created],
+                    ignore_conflicts=True
+                )
+                target.counted(created, 1)
+            if removed:
+                like_model.objects.filter(
+                    user=user, **{f'{target.fk}__in': removed}
+                ).delete()
+                target.counted(removed, -1)
+        added += created
+
+    counts = dict(
+        target.model.objects.filter(id__in=list(states)).values_list('id', 'likes_count')
+    )
+    if target.model is Post:
+        for pk, pending in counters.shard_totals(list(counts)).items():
+            counts[pk] += pending['likes_count'] or 0
+        _, deltas = like_buffer.overlay(None, buffered)
+        for pk, delta in deltas.items():
+            counts[pk] += delta
+        counts = {pk: max(0, count) for pk, count in counts.items()}
+    for pk in added:
+        obj = objects[pk]
+        if obj.author_id != user.id:
+            notify(obj.author_id, target.event, target.event_data(obj, user, counts.get(pk, 0)))
+
+    return [
+        {'id': pk, 'liked': liked, 'likes_count': counts.get(pk, 0)}
+        for pk, liked in states.items()
+    ]
+
+
+def apply_intents(post_id, intents):
+    """Write ``{user_id: liked}`` for one post in one transaction (the like
+    buffer's flush); return the net change of its ``likes_count``."""
+    with transaction.atomic():
+        existing = set(
+            PostLike.objects.filter(
+                post_id=post_id, user_id__in=list(intents)
+            ).values_list('user_id', flat=True)
+        )
+        added = [user_id for user_id, liked in intents.items() if liked and user_id not in existing]
+        removed = [user_id for user_id, liked in intents.items() if not liked and user_id in existing]
+        if added:
+            PostLike.objects.bulk_create(
+                [PostLike(user_id=user_id, post_id=post_id) for user_id in added],
+                ignore_conflicts=True
+            )
+        if removed:
+            PostLike.objects.filter(post_id=post_id, user_id__in=removed).delete()
+        counters.post_liked(post_id, len(added) - len(removed))
+    return len(added) - len(removed)
@@ -0,0 +1,277 @@
+"""Drive the API in-process and report per-endpoint throughput and latency.
+
+Each worker thread runs a weighted mix of scenarios through the full
+middleware stack and URLconf with Django's test ``Client``. Requests carry
+real JWT access tokens for a sample of existing users. For every endpoint
+the command reports requests/sec, p50/p95/p99 latency and the queries each
+request ran, and writes the numbers as JSON so runs can be compared
+(``--compare``).
+
+Scenarios write (likes, friend requests), so run it against a seeded
+benchmark database (``seed_social_graph``), never production. Latency
+includes the client and the GIL: compare runs with each other, not with
+numbers from a real server.
+"""
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.utils import timezone
+
+from accounts.views import CustomTokenObtainPairSerializer
+from buddyscript_backend.metrics import RequestMetrics
+from posts.models import Post
+
+User = get_user_model()
+
+DEFAULT_MIX = 'feed=40,like=20,thread=20,search=15,friend=5'
+FEED_PAGES = 3
+SAMPLE_POSTS = 5000
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in Session.SCENARIOS:
+            raise CommandError(
+                f'Unknown scenario "{name}"; choose from {", ".join(Session.SCENARIOS)}'
+            )
+        try:
+            mix[name] = float(weight or 1)
+        except ValueError:
+            raise CommandError(f'Invalid weight in "{part}"')
+    return mix
+
+
+class Session:
+    """One worker thread: a client, a random source and its samples."""
+
+    SCENARIOS = ('feed', 'like', 'thread', 'search', 'friend')
+
+    def __init__(self, fixture, seed, recording):
+        self.fixture = fixture
+        self.rng = random.Random(seed)
+        self.recording = recording
+        self.client = Client()
+        self.samples = []
+
+    def request(self, endpoint, method, url, user_id, **kwargs):
+        tracked = RequestMetrics()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(tracked))
+            start = time.perf_counter()
+            response = getattr(self.client, method)(
+                url,
+                HTTP_AUTHORIZATION=f'Bearer {self.fixture.tokens[user_id]}',
+                **kwargs
+            )
+            elapsed = time.perf_counter() - start
+        if self.recording.is_set():
+            self.samples.append((endpoint, elapsed, tracked.queries, response.status_code))
+        return response
+
+    def run(self, scenario):
+        getattr(self, f'scenario_{scenario}')(self.rng.choice(self.fixture.user_ids))
+
+    def scenario_feed(self, user_id):
+        url = '/api/posts/?cursor='
+        for _ in range(FEED_PAGES):
+            response = self.request('feed', 'get', url, user_id)
+            url = response.status_code == 200 and response.json().get('next')
+            if not url:
+                break
+
+    def scenario_like(self, user_id):
+        # A toggle, so repeated runs keep the like counts stable
+        post_id = self.rng.choice(self.fixture.post_ids)
+        self.request('like', 'post', f'/api/posts/{post_id}/like/', user_id)
+
+    def scenario_thread(self, user_id):
+        post_id = self.rng.choice(self.fixture.commented_post_ids or self.fixture.post_ids)
+        response = self.request('comments', 'get', f'/api/posts/{post_id}/comments/', user_id)
+        results = response.json().get('results') if response.status_code == 200 else None
+        if results:
+            comment_id = self.rng.choice(results)['id']
+            self.request('comment_detail', 'get', f'/api/posts/comments/{comment_id}/', user_id)
+
+    def scenario_search(self, user_id):
+        query = self.rng.choice(self.fixture.search_terms)
+        self.request('user_search', 'get', f'/api/auth/users/search/?q={query}', user_id)
+
+    def scenario_friend(self, user_id):
+        # Send, accept, then unfriend, leaving the graph as it was
+        other_id = self.rng.choice(self.fixture.user_ids)
+        if other_id == user_id:
+            return
+        response = self.request(
+            'friend_request', 'post', f'/api/auth/friend-requests/send/{other_id}/', user_id
+        )
+        if response.status_code != 201:
+            return
+        self.request(
+            'friend_respond', 'post', f'/api/auth/friend-requests/{response.json()["id"]}/respond/',
+            other_id, data={'action': 'accept'}, content_type='application/json'
+        )
+        self.request('unfriend', 'delete', f'/api/auth/unfriend/{other_id}/', user_id)
+
+
+class Fixture:
+    """Users with tokens and the posts the scenarios pick from."""
+
+    def __init__(self, user_count, rng):
+        all_ids = list(User.objects.filter(is_active=True).values_list('id', flat=True))
+        if len(all_ids) < 2:
+            raise CommandError('Need at least two users; run seed_social_graph first.')
+        users = list(User.objects.filter(id__in=rng.sample(all_ids, min(user_count, len(all_ids)))))
+        self.user_ids = [user.id for user in users]
+        self.tokens = {
+            user.id: str(CustomTokenObtainPairSerializer.get_token(user).access_token)
+            for user in users
+        }
+        self.search_terms = sorted({user.first_name[:3].lower() for user in users if user.first_name})
+
+        recent = list(Post.objects.values_list('id', 'comments_count')[:SAMPLE_POSTS])
+        if not recent:
+            raise CommandError('No posts to benchmark; run seed_social_graph first.')
+        self.post_ids = [post_id for post_id, _ in recent]
+        self.commented_post_ids = [post_id for post_id, count in recent if count]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark API endpoints in-process and report throughput and latency percentiles.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to measure.')
+        parser.add_argument('--warmup', type=float, default=3, help='Unrecorded seconds first.')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--users', type=int, default=100,
+                            help='Existing users to sample as the authenticated clients.')
+        parser.add_argument('--mix', default=DEFAULT_MIX,
+                            help=f'Scenario weights (default "{DEFAULT_MIX}").')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='Write results as JSON to this file.')
+        parser.add_argument('--compare', help='Print changes against an earlier --output file.')
+
+    def handle(self, *args, **options):
+        mix = parse_mix(options['mix'])
+        rng = random.Random(options['seed'])
+        fixture = Fixture(options['users'], rng)
+        recording = threading.Event()
+        stopping = threading.Event()
+        sessions = [
+            Session(fixture, rng.random(), recording) for _ in range(options['concurrency'])
+        ]
+        scenarios, weights = list(mix), list(mix.values())
+        errors = []
+
+        def work(session):
+            try:
+                while not stopping.is_set():
+                    session.run(session.rng.choices(scenarios, weights)[0])
+            except Exception as exc:
+                errors.append(exc)
+                stopping.set()
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work, args=(session,)) for session in sessions]
+        for thread in threads:
+            thread.start()
+        time.sleep(options['warmup'])
+        recording.set()
+        started = time.perf_counter()
+        stopping.wait(options['duration'])
+        stopping.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        if errors:
+            raise CommandError(f'Benchmark aborted: {errors[0]!r}')
+
+        results = self.summarize(sessions, elapsed)
+        results['options'] = {
+            key: options[key]
+            for key in ('duration', 'warmup', 'concurrency', 'users', 'mix', 'seed')
+        }
+        results['database'] = connection.vendor
+        results['created_at'] = timezone.now().isoformat()
+        self.report(results)
+
+        if options['compare']:
+            with open(options['compare']) as source:
+                self.compare(json.load(source), results)
+        if options['output']:
+            with open(options['output'], 'w') as target:
+                json.dump(results, target, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+    def summarize(self, sessions, elapsed):
+        by_endpoint = defaultdict(list)
+        for session in sessions:
+            for endpoint, seconds, queries, status in session.samples:
+                by_endpoint[endpoint].append((seconds, queries, status))
+
+        endpoints = {}
+        for endpoint, samples in sorted(by_endpoint.items()):
+            latencies = sorted(seconds for seconds, _, _ in samples)
+            queries = [count for _, count, _ in samples]
+            endpoints[endpoint] = {
+                'requests': len(samples),
+                'errors': sum(1 for _, _, status in samples if status >= 500),
+                'rejected': sum(1 for _, _, status in samples if 400 <= status < 500),
+                'rps': len(samples) / elapsed,
+                'p50_ms': percentile(latencies, 0.50) * 1000,
+                'p95_ms': percentile(latencies, 0.95) * 1000,
+                'p99_ms': percentile(latencies, 0.99) * 1000,
+                'queries_mean': sum(queries) / len(queries),
+                'queries_max': max(queries),
+            }
+        total = sum(row['requests'] for row in endpoints.values())
+        return {
+            'elapsed': elapsed,
+            'requests': total,
+            'rps': total / elapsed if elapsed else 0,
+            'endpoints': endpoints,
+        }
+
+    def report(self, results):
+        header = f'{"endpoint":<16}{"reqs":>8}{"rps":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"queries":>9}{"4xx":>6}{"5xx":>6}'
+        self.stdout.write(header)
+        for endpoint, row in results['endpoints'].items():
+            self.stdout.write(
+                f'{endpoint:<16}{row["requests"]:>8}{row["rps"]:>9.1f}{row["p50_ms"]:>9.1f}'
+                f'{row["p95_ms"]:>9.1f}{row["p99_ms"]:>9.1f}{row["queries_mean"]:>9.1f}'
+                f'{row["rejected"]:>6}{row["errors"]:>6}'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'{results["requests"]} requests in {results["elapsed"]:.1f}s, '
+            f'{results["rps"]:.1f} requests/sec'
+        ))
+
+    def compare(self, before, after):
+        self.stdout.write('Change against the baseline (rps, p50, p99, queries):')
+        for endpoint, row in after['endpoints'].items():
+            old = before.get('endpoints', {}).get(endpoint)
+            if not old:
+                continue
+            changes = ', '.join(
+                f'{(row[key] - old[key]) / old[key] * 100:+.0f}%' if old[key] else 'n/a'
+                for key in ('rps', 'p50_ms', 'p99_ms', 'queries_mean')
+            )
+            self.stdout.write(f'  {endpoint:<16}{changes}')
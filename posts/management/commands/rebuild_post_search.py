@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.search import index_post
+
+
+class Command(BaseCommand):
+    help = 'Build or repair the post content search index.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_pk = 0
+        total = 0
+
+        while True:
+            posts = list(
+                Post.objects.filter(pk__gt=last_pk)
+                .order_by('pk')
+                .only('pk', 'author_id', 'content', 'visibility', 'created_at')[:chunk_size]
+            )
+            if not posts:
+                break
+            last_pk = posts[-1].pk
+            for post in posts:
+                index_post(post)
+            total += len(posts)
+
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} post(s)'))
@@ -0,0 +1,102 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from django.contrib.auth import get_user_model
+
+from accounts.models import Friendship
+from posts import counters
+from posts.models import Post, PostLike, Comment, CommentLike
+
+User = get_user_model()
+
+
+def _count_subquery(model, fk, **filters):
+    counts = (
+        model.objects.filter(**{fk: OuterRef('pk')}, **filters)
+        .order_by()
+        .values(fk)
+        .annotate(n=Count('pk'))
+        .values('n')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+class Command(BaseCommand):
+    help = 'Recompute stored like/comment/reply/post/friend counters that have drifted from the real row counts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        dry_run = options['dry_run']
+
+        if not dry_run:
+            # Pending counter shards would otherwise be counted twice
+            counters.compact_all()
+        post_fixed = self.recount(
+            Post,
+            chunk_size,
+            dry_run,
+            actual_likes_count=_count_subquery(PostLike, 'post'),
+            actual_comments_count=_count_subquery(Comment, 'post'),
+        )
+        comment_fixed = self.recount(
+            Comment,
+            chunk_size,
+            dry_run,
+            actual_likes_count=_count_subquery(CommentLike, 'comment'),
+            actual_replies_count=_count_subquery(Comment, 'parent'),
+        )
+        user_fixed = self.recount(
+            User,
+            chunk_size,
+            dry_run,
+            actual_posts_count=_count_subquery(Post, 'author'),
+            actual_friends_count=(
+                _count_subquery(Friendship, 'from_user', status='accepted') +
+                _count_subquery(Friendship, 'to_user', status='accepted')
+            ),
+        )
+
+        verb = 'Would fix' if dry_run else 'Fixed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {post_fixed} post(s), {comment_fixed} comment(s) and {user_fixed} user(s)'
+        ))
+
+    def recount(self, model, chunk_size, dry_run, **actual):
+        # Walk the table in primary key order so every chunk is an index
+        # range read and no long-running transaction is held.
+        fields = [name[len('actual_'):] for name in actual]
+        fixed = 0
+        last_pk = 0
+
+        while True:
+            rows = list(
+                model.objects.filter(pk__gt=last_pk)
+                .order_by('pk')
+                .only('pk', *fields)
+                .annotate(**actual)[:chunk_size]
+            )
+            if not rows:
+                break
+            last_pk = rows[-1].pk
+
+            drifted = []
+            for row in rows:
+                changed = False
+                for field in fields:
+                    real = getattr(row, f'actual_{field}')
+                    if getattr(row, field) != real:
+                        setattr(row, field, real)
+                        changed = True
+                if changed:
+                    drifted.append(row)
+
+            if drifted and not dry_run:
+                model.objects.bulk_update(drifted, fields)
+            fixed += len(drifted)
+
+        return fixed
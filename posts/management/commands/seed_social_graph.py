@@ -0,0 +1,337 @@
+"""Generate a large synthetic social graph for benchmarking.
+
+Friendships follow preferential attachment, so a few users have very many
+friends and most have a handful. Post authorship, commenting and liking are
+skewed the same way: every user gets a Zipf activity weight, and the number
+of likes, comments and replies each item receives is drawn from a Pareto
+distribution with the requested mean.
+
+Rows are written with chunked ``bulk_create`` and explicit primary keys, so
+replies and likes can point at rows that were generated but not yet saved
+and the command works the same on MySQL, which does not return inserted
+IDs. Stored counters, timelines and both search indexes are filled in as
+the rows are generated; no per-row signals or recounts are needed after.
+The same ``--seed`` against the same starting IDs produces the same graph;
+timestamps are laid out over the ``--days`` before the run.
+"""
+import itertools
+import random
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from accounts.models import Friendship, UserSearchToken
+from accounts.search import user_tokens
+from buddyscript_backend.search import tokenize
+from posts.models import (
+    Post, PostLike, Comment, CommentLike, TimelineEntry, PostSearchTerm, path_segment
+)
+
+User = get_user_model()
+
+FIRST_NAMES = (
+    'Ava', 'Liam', 'Noah', 'Emma', 'Olivia', 'Mia', 'Lucas', 'Amir', 'Sofia', 'Yuki',
+    'Fatima', 'Mateo', 'Chloe', 'Ethan', 'Zara', 'Arjun', 'Layla', 'Omar', 'Nina', 'Leo',
+)
+LAST_NAMES = (
+    'Smith', 'Khan', 'Garcia', 'Chen', 'Rahman', 'Silva', 'Kim', 'Novak', 'Okafor', 'Rossi',
+    'Haddad', 'Nguyen', 'Ivanova', 'Jensen', 'Ali', 'Tanaka', 'Murphy', 'Costa', 'Singh', 'Weber',
+)
+WORDS = (
+    'today', 'weekend', 'coffee', 'friends', 'family', 'travel', 'music', 'football', 'sunset',
+    'project', 'launch', 'happy', 'birthday', 'dinner', 'recipe', 'garden', 'movie', 'book',
+    'morning', 'city', 'beach', 'mountain', 'training', 'finally', 'amazing', 'great', 'new',
+    'photo', 'thanks', 'everyone', 'love', 'work', 'team', 'weather', 'rain', 'summer',
+    'winter', 'road', 'trip', 'concert', 'game', 'win', 'lost', 'learned', 'code', 'hello',
+)
+
+# Pareto shape for per-item counts; below 2 the tail is very heavy, as real
+# engagement is (most posts get little, a few go viral).
+PARETO_ALPHA = 1.5
+PENDING_RATIO = 0.1
+PRIVATE_RATIO = 0.1
+
+
+def skewed(rng, mean, limit):
+    """Draw a count with the given mean from a heavy-tailed distribution."""
+    if mean <= 0:
+        return 0
+    value = mean * (rng.paretovariate(PARETO_ALPHA) - 1) * (PARETO_ALPHA - 1)
+    # Random rounding keeps the mean that int() alone would bias down
+    return min(limit, int(value + rng.random()))
+
+
+class Writer:
+    """Buffers generated rows and writes them in foreign key order."""
+
+    ORDER = (
+        User, UserSearchToken, Friendship, Post, Comment,
+        PostLike, CommentLike, TimelineEntry, PostSearchTerm,
+    )
+
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.pending = {model: [] for model in self.ORDER}
+        self.size = 0
+        self.written = Counter()
+
+    def add(self, row):
+        self.pending[type(row)].append(row)
+        self.size += 1
+
+    def done(self):
+        """Called between items: the rows of one item are written together."""
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        with transaction.atomic():
+            for model, rows in self.pending.items():
+                if rows:
+                    model.objects.bulk_create(rows, batch_size=self.chunk_size)
+                    self.written[model] += len(rows)
+                    rows.clear()
+        self.size = 0
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic social graph (users, friendships, posts, comments and likes).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--posts', type=int, default=10000)
+        parser.add_argument('--friends', type=int, default=20,
+                            help='Average friendships per user.')
+        parser.add_argument('--likes', type=float, default=8,
+                            help='Average likes per post.')
+        parser.add_argument('--comments', type=float, default=3,
+                            help='Average top-level comments per post.')
+        parser.add_argument('--replies', type=float, default=1,
+                            help='Average replies per comment.')
+        parser.add_argument('--comment-likes', type=float, default=1,
+                            help='Average likes per comment or reply.')
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--password', default='password123',
+                            help='Password shared by every generated user.')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if options['users'] < 2:
+            raise CommandError('--users must be at least 2')
+
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.writer = Writer(options['chunk_size'])
+        self.end = timezone.now()
+        self.start = self.end - timedelta(days=options['days'])
+        started = time.monotonic()
+
+        user_count = options['users']
+        self.first_user_id = (User.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+        # Zipf activity: the user of rank r is picked with weight 1/r
+        ranks = list(range(1, user_count + 1))
+        self.rng.shuffle(ranks)
+        self.activity = list(itertools.accumulate(1 / rank for rank in ranks))
+
+        authors = self.pick_users(options['posts'])
+        self.create_users(Counter(authors))
+        self.friends = self.create_friendships()
+        self.create_posts(authors)
+        self.writer.flush()
+        User.objects.bulk_update(
+            [
+                User(id=self.user_id(index), friends_count=len(friends))
+                for index, friends in enumerate(self.friends) if friends
+            ],
+            ['friends_count'],
+            batch_size=options['chunk_size']
+        )
+
+        written = self.writer.written
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {written[User]} users, {written[Friendship]} friendships, '
+            f'{written[Post]} posts, {written[Comment]} comments, '
+            f'{written[PostLike] + written[CommentLike]} likes and '
+            f'{written[TimelineEntry]} timeline entries '
+            f'in {time.monotonic() - started:.0f}s'
+        ))
+
+    def pick_users(self, count):
+        """Return ``count`` user indexes weighted by activity."""
+        return self.rng.choices(range(len(self.activity)), cum_weights=self.activity, k=count)
+
+    def user_id(self, index):
+        return self.first_user_id + index
+
+    def moment(self, after, before=None):
+        # Engagement clusters soon after the thing it reacts to
+        before = before or self.end
+        return after + (before - after) * self.rng.random() ** 3
+
+    def create_users(self, posts_per_user):
+        password = make_password(self.options['password'])
+        joined_span = self.end - self.start
+        self.joined = []
+        for index in range(len(self.activity)):
+            user_id = self.user_id(index)
+            user = User(
+                id=user_id,
+                email=f'user{user_id}@example.com',
+                first_name=self.rng.choice(FIRST_NAMES),
+                last_name=self.rng.choice(LAST_NAMES),
+                password=password,
+                date_joined=self.start - joined_span * self.rng.random(),
+                posts_count=posts_per_user[index],
+            )
+            self.joined.append(user.date_joined)
+            self.writer.add(user)
+            for token, weight in user_tokens(user).items():
+                self.writer.add(UserSearchToken(user_id=user_id, token=token, weight=weight))
+            self.writer.done()
+        self.stdout.write(f'Generated {len(self.joined)} users')
+
+    def create_friendships(self):
+        """Preferential attachment: each new user befriends ``--friends / 2``
+        existing users, picked in proportion to how many friends they have."""
+        rng = self.rng
+        per_user = max(1, round(self.options['friends'] / 2))
+        friends = [[] for _ in self.joined]
+        # Every user appears here once per friendship they are part of
+        endpoints = []
+        count = 0
+
+        for index in range(1, len(friends)):
+            targets = set()
+            while len(targets) < min(per_user, index):
+                targets.add(rng.choice(endpoints) if endpoints else rng.randrange(index))
+            for other in sorted(targets):
+                endpoints += (index, other)
+                accepted = rng.random() >= PENDING_RATIO
+                if accepted:
+                    friends[index].append(other)
+                    friends[other].append(index)
+                sender, receiver = (index, other) if rng.random() < 0.5 else (other, index)
+                self.writer.add(Friendship(
+                    from_user_id=self.user_id(sender),
+                    to_user_id=self.user_id(receiver),
+                    status='accepted' if accepted else 'pending',
+                    created_at=self.moment(max(self.joined[index], self.joined[other]), self.start),
+                ))
+                count += 1
+            self.writer.done()
+
+        self.stdout.write(f'Generated {count} friendships')
+        return friends
+
+    def create_posts(self, authors):
+        rng = self.rng
+        options = self.options
+        user_count = len(self.joined)
+        span = (self.end - self.start) / max(1, len(authors))
+        post_id = (Post.all_objects.aggregate(Max('id'))['id__max'] or 0) + 1
+        self.next_comment_id = (Comment.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+
+        for position, author in enumerate(authors):
+            # Posts are spread evenly with jitter, so IDs follow created_at
+            created_at = self.start + span * (position + rng.random())
+            content = ' '.join(rng.choices(WORDS, k=rng.randint(3, 30)))
+            visibility = 'private' if rng.random() < PRIVATE_RATIO else 'public'
+            friends = self.friends[author]
+            fanned_out = len(friends) <= settings.TIMELINE_FANOUT_LIMIT
+
+            likers = rng.sample(range(user_count), skewed(rng, options['likes'], user_count))
+            for liker in likers:
+                self.writer.add(PostLike(
+                    user_id=self.user_id(liker), post_id=post_id,
+                    created_at=self.moment(created_at)
+                ))
+            comments_count = self.create_comments(post_id, created_at)
+
+            self.writer.add(Post(
+                id=post_id,
+                author_id=self.user_id(author),
+                content=content,
+                visibility=visibility,
+                likes_count=len(likers),
+                comments_count=comments_count,
+                fanned_out=fanned_out,
+                created_at=created_at,
+            ))
+
+            readers = [author]
+            if visibility == 'public' and fanned_out:
+                readers += friends
+            for reader in readers:
+                self.writer.add(TimelineEntry(
+                    user_id=self.user_id(reader), post_id=post_id, created_at=created_at
+                ))
+            for term in set(tokenize(content)):
+                self.writer.add(PostSearchTerm(
+                    term=term, post_id=post_id, author_id=self.user_id(author),
+                    visibility=visibility, created_at=created_at
+                ))
+
+            self.writer.done()
+            post_id += 1
+            if (position + 1) % 10000 == 0:
+                self.stdout.write(f'Generated {position + 1} posts')
+
+    def create_comments(self, post_id, posted_at):
+        """Generate a post's comments and replies; return how many."""
+        rng = self.rng
+        options = self.options
+        user_count = len(self.joined)
+        total = 0
+
+        roots = skewed(rng, options['comments'], user_count)
+        for root_author in self.pick_users(roots):
+            root_id, root_at = self.next_comment_id, self.moment(posted_at)
+            self.next_comment_id += 1
+            replies = skewed(rng, options['replies'], user_count)
+            self.add_comment(root_id, post_id, root_author, None, root_at, replies)
+            for reply_author in self.pick_users(replies):
+                self.add_comment(
+                    self.next_comment_id, post_id, reply_author, root_id,
+                    self.moment(root_at), 0
+                )
+                self.next_comment_id += 1
+            total += 1 + replies
+
+        return total
+
+    def add_comment(self, comment_id, post_id, author, parent_id, created_at, replies):
+        rng = self.rng
+        user_count = len(self.joined)
+        likers = rng.sample(
+            range(user_count), skewed(rng, self.options['comment_likes'], user_count)
+        )
+        # Replies are one level deep, so the parent is a root comment
+        path = path_segment(comment_id)
+        if parent_id is not None:
+            path = path_segment(parent_id) + path
+        self.writer.add(Comment(
+            id=comment_id,
+            post_id=post_id,
+            author_id=self.user_id(author),
+            parent_id=parent_id,
+            path=path,
+            depth=0 if parent_id is None else 1,
+            content=' '.join(rng.choices(WORDS, k=rng.randint(1, 12))),
+            likes_count=len(likers),
+            replies_count=replies,
+            created_at=created_at,
+        ))
+        for liker in likers:
+            self.writer.add(CommentLike(
+                user_id=self.user_id(liker), comment_id=comment_id,
+                created_at=self.moment(created_at)
+            ))
@@ -0,0 +1,65 @@
+# Generated by Django 4.2.26 on 2026-10-18 09:37
+
+from django.db import migrations, models
+from django.db.models import Count
+
+CHUNK_SIZE = 1000
+
+
+def _fill(model, field, related, fk):
+    # One grouped read of the related table, written back in chunks; rows
+    # with nothing related keep the default of 0
+    counts = (
+        related.objects.filter(**{f'{fk}__isnull': False})
+        .order_by().values_list(fk).annotate(n=Count('pk'))
+    )
+    batch = []
+    for pk, n in list(counts):
+        batch.append(model(pk=pk, **{field: n}))
+        if len(batch) == CHUNK_SIZE:
+            model.objects.bulk_update(batch, [field])
+            batch = []
+    if batch:
+        model.objects.bulk_update(batch, [field])
+
+
+def fill_counters(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    PostLike = apps.get_model('posts', 'PostLike')
+    Comment = apps.get_model('posts', 'Comment')
+    CommentLike = apps.get_model('posts', 'CommentLike')
+    _fill(Post, 'likes_count', PostLike, 'post')
+    _fill(Post, 'comments_count', Comment, 'post')
+    _fill(Comment, 'likes_count', CommentLike, 'comment')
+    _fill(Comment, 'replies_count', Comment, 'parent')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='replies_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
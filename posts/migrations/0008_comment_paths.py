@@ -0,0 +1,81 @@
+# Generated by Django 4.2.26 on 2026-10-18 10:20
+
+from django.db import migrations, models
+
+CHUNK_SIZE = 1000
+PATH_STEP = 8
+PATH_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+MAX_LEVELS = 255 // PATH_STEP
+
+
+def path_segment(pk):
+    digits = ''
+    while pk:
+        pk, digit = divmod(pk, 36)
+        digits = PATH_DIGITS[digit] + digits
+    return digits.rjust(PATH_STEP, '0')
+
+
+def _write(Comment, rows, depth):
+    Comment.objects.bulk_update(
+        [
+            Comment(id=pk, path=(parent_path or '') + path_segment(pk), depth=depth)
+            for pk, parent_path in rows
+        ],
+        ['path', 'depth']
+    )
+
+
+def fill_paths(apps, schema_editor):
+    # Level by level: roots first, then the replies of the level above. Each
+    # chunk fills its rows, so every level ends, and no path holds more than
+    # MAX_LEVELS levels.
+    Comment = apps.get_model('posts', 'Comment')
+    for depth in range(MAX_LEVELS):
+        if depth == 0:
+            pending = Comment.objects.filter(parent__isnull=True, path='')
+        else:
+            pending = Comment.objects.filter(path='', parent__depth=depth - 1).exclude(parent__path='')
+        filled = False
+        while True:
+            rows = list(pending.values_list('id', 'parent__path')[:CHUNK_SIZE])
+            if not rows:
+                break
+            _write(Comment, rows, depth)
+            filled = True
+        if not filled:
+            break
+
+    # Left over: parents that never lead to a root (a cycle) or threads too
+    # deep for a path. Each becomes the root of its own path, so it can
+    # still be read and deleted.
+    while True:
+        rows = list(Comment.objects.filter(path='').values_list('id', flat=True)[:CHUNK_SIZE])
+        if not rows:
+            return
+        _write(Comment, [(pk, '') for pk in rows], 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0007_counter_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(default='', max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'path'], name='comments_post_id_5f9abc_idx'),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.26 on 2026-10-18 11:40
+
+from django.db import migrations
+
+from buddyscript_backend.search import tokenize
+
+CHUNK_SIZE = 1000
+
+
+def fill_search_terms(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    PostSearchTerm = apps.get_model('posts', 'PostSearchTerm')
+    # Posts written since 0004 were indexed by the views; index the rest
+    posts = Post.objects.filter(is_deleted=False, search_terms__isnull=True).order_by('pk')
+    last_pk = 0
+    while True:
+        rows = list(
+            posts.filter(pk__gt=last_pk)
+            .values_list('pk', 'author_id', 'content', 'visibility', 'created_at')[:CHUNK_SIZE]
+        )
+        if not rows:
+            break
+        last_pk = rows[-1][0]
+        PostSearchTerm.objects.bulk_create([
+            PostSearchTerm(
+                term=term,
+                post_id=pk,
+                author_id=author_id,
+                visibility=visibility,
+                created_at=created_at
+            )
+            for pk, author_id, content, visibility, created_at in rows
+            for term in set(tokenize(content))
+        ], batch_size=CHUNK_SIZE, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0008_comment_paths'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_search_terms, migrations.RunPython.noop),
+    ]
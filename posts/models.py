@@ -3,6 +3,12 @@ from django.conf import settings
 from django.utils import timezone
 
 
+class PostManager(models.Manager):
+    def get_queryset(self):
+        # Deleted posts stay hidden until their purge job removes them
+        return super().get_queryset().filter(is_deleted=False)
+
+
 class Post(models.Model):
     VISIBILITY_CHOICES = [
         ('public', 'Public'),
@@ -16,14 +22,24 @@ class Post(models.Model):
     )
     content = models.TextField(max_length=5000)
     image = models.ImageField(upload_to='posts/%Y/%m/%d/', null=True, blank=True)
+    image_variants = models.JSONField(null=True, blank=True)
     visibility = models.CharField(
         max_length=10,
         choices=VISIBILITY_CHOICES,
         default='public'
     )
+    likes_count = models.PositiveIntegerField(default=0)
+    comments_count = models.PositiveIntegerField(default=0)
+    # False when the author had too many friends to push the post into
+    # their timelines; such posts are pulled in at read time instead.
+    fanned_out = models.BooleanField(default=True)
+    is_deleted = models.BooleanField(default=False)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = PostManager()
+    all_objects = models.Manager()
+
     class Meta:
         db_table = 'posts'
         ordering = ['-created_at']
@@ -31,18 +47,36 @@ class Post(models.Model):
             models.Index(fields=['-created_at']),
             models.Index(fields=['author', '-created_at']),
             models.Index(fields=['visibility', '-created_at']),
+            models.Index(fields=['author', 'fanned_out', '-created_at']),
         ]
 
     def __str__(self):
         return f"Post by {self.author.get_full_name()} at {self.created_at}"
 
-    @property
-    def likes_count(self):
-        return self.likes.count()
 
-    @property
-    def comments_count(self):
-        return self.comments.count()
+class PostCounterShard(models.Model):
+    """Not yet folded changes to a hot post's counters.
+
+    Writes to a post getting many of them go to one of ``COUNTER_SHARDS``
+    rows picked at random instead of all locking the post row;
+    ``counters.compact`` adds the shards to the post and removes them.
+    """
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='counter_shards'
+    )
+    shard = models.PositiveSmallIntegerField()
+    # Deltas, so they can be negative
+    likes_count = models.IntegerField(default=0)
+    comments_count = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'post_counter_shards'
+        unique_together = ('post', 'shard')
+
+    def __str__(self):
+        return f"Counter shard {self.shard} of post {self.post_id}"
 
 
 class PostLike(models.Model):
@@ -70,6 +104,19 @@ class PostLike(models.Model):
         return f"{self.user.get_full_name()} likes {self.post.id}"
 
 
+PATH_STEP = 8
+PATH_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def path_segment(pk):
+    """Fixed-width base 36 form of a comment ID, so paths sort like IDs."""
+    digits = ''
+    while pk:
+        pk, digit = divmod(pk, 36)
+        digits = PATH_DIGITS[digit] + digits
+    return digits.rjust(PATH_STEP, '0')
+
+
 class Comment(models.Model):
     post = models.ForeignKey(
         Post,
@@ -89,6 +136,12 @@ class Comment(models.Model):
         related_name='replies'
     )
     content = models.TextField(max_length=2000)
+    likes_count = models.PositiveIntegerField(default=0)
+    replies_count = models.PositiveIntegerField(default=0)
+    # Materialized path: the ID segments of the root comment down to this
+    # one, so a whole thread is one range read (see posts/threads.py)
+    path = models.CharField(max_length=255, default='')
+    depth = models.PositiveSmallIntegerField(default=0)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -98,18 +151,21 @@ class Comment(models.Model):
         indexes = [
             models.Index(fields=['post', '-created_at']),
             models.Index(fields=['parent', '-created_at']),
+            models.Index(fields=['post', 'path']),
         ]
 
     def __str__(self):
         return f"Comment by {self.author.get_full_name()} on post {self.post.id}"
 
-    @property
-    def likes_count(self):
-        return self.likes.count()
-
-    @property
-    def replies_count(self):
-        return self.replies.count()
+    def save(self, *args, **kwargs):
+        creating = self._state.adding
+        super().save(*args, **kwargs)
+        if creating and not self.path:
+            # The path ends with the comment's own ID, known only now
+            parent = self.parent if self.parent_id else None
+            self.path = (parent.path if parent else '') + path_segment(self.pk)
+            self.depth = parent.depth + 1 if parent else 0
+            Comment.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
 
 
 class CommentLike(models.Model):
@@ -134,4 +190,61 @@ class CommentLike(models.Model):
         ]
 
     def __str__(self):
-        return f"{self.user.get_full_name()} likes comment {self.comment.id}"
\ No newline at end of file
+        return f"{self.user.get_full_name()} likes comment {self.comment.id}"
+
+
+class TimelineEntry(models.Model):
+    """A post materialized into a user's home timeline."""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries'
+    )
+    # Copy of post.created_at so a timeline page is a single index range read
+    created_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'timeline_entries'
+        unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-post']),
+        ]
+
+    def __str__(self):
+        return f"Post {self.post_id} in timeline of user {self.user_id}"
+
+
+class PostSearchTerm(models.Model):
+    """Inverted index entry: one distinct word of a post's content.
+
+    Author, visibility and created_at are copied from the post so a search
+    page is answered from this table alone, in keyset order.
+    """
+    term = models.CharField(max_length=50)
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='search_terms'
+    )
+    author = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    visibility = models.CharField(max_length=10)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'post_search_terms'
+        unique_together = ('term', 'post')
+        indexes = [
+            models.Index(fields=['term', '-created_at', '-post']),
+        ]
+
+    def __str__(self):
+        return f"{self.term} -> post {self.post_id}"
@@ -0,0 +1,100 @@
+"""Prefetches for the nested arrays embedded in posts and comments.
+
+Related objects are loaded into ``shown_likes``, ``shown_comments`` and
+``shown_replies`` lists, which the serializers render. Relations the
+request's field selection leaves out are not loaded at all.
+
+Feed lists pass ``PreviewLimits`` to embed only the most recent few
+comments, replies and likers per parent. Django runs each sliced Prefetch
+as one ``ROW_NUMBER()`` window query for the whole page, so a page costs the
+same number of queries however busy its posts are.
+"""
+from collections import namedtuple
+
+from django.conf import settings
+from django.db.models import Prefetch
+
+from buddyscript_backend.serializers import FieldSelection
+from .models import PostLike, Comment, CommentLike
+
+PreviewLimits = namedtuple('PreviewLimits', ('comments', 'replies', 'likers'))
+
+
+def _limit(request, name, default):
+    try:
+        value = int(request.query_params.get(f'preview_{name}', default))
+    except ValueError:
+        value = default
+    return min(max(value, 0), settings.FEED_PREVIEW_MAX)
+
+
+def preview_limits(request):
+    """Preview sizes for a feed request; ``?preview_comments=``,
+    ``?preview_replies=`` and ``?preview_likers=`` override the defaults."""
+    return PreviewLimits(
+        comments=_limit(request, 'comments', settings.FEED_PREVIEW_COMMENTS),
+        replies=_limit(request, 'replies', settings.FEED_PREVIEW_REPLIES),
+        likers=_limit(request, 'likers', settings.FEED_PREVIEW_LIKERS),
+    )
+
+
+def _newest(queryset, limit=None):
+    queryset = queryset.order_by('-created_at', '-id')
+    return queryset if limit is None else queryset[:limit]
+
+
+def _likes(lookup, model, limit):
+    return Prefetch(
+        lookup,
+        queryset=_newest(model.objects.select_related('user'), limit),
+        to_attr='shown_likes'
+    )
+
+
+def _comment_lookups(prefix, selection, limits, with_replies=True):
+    lookups = []
+    if selection.includes('likes', expandable=True):
+        lookups.append(_likes(f'{prefix}likes', CommentLike, limits and limits.likers))
+    if with_replies and selection.includes('replies', expandable=True):
+        lookups.append(Prefetch(
+            f'{prefix}replies',
+            queryset=_newest(Comment.objects.select_related('author'), limits and limits.replies),
+            to_attr='shown_replies'
+        ))
+        # Replies are rendered one level deep only
+        lookups += _comment_lookups(
+            f'{prefix}shown_replies__',
+            selection.child('replies'),
+            limits,
+            with_replies=False
+        )
+    return lookups
+
+
+def post_prefetches(request, limits=None):
+    selection = FieldSelection.from_request(request)
+    lookups = []
+    if selection.includes('likes', expandable=True):
+        lookups.append(_likes('likes', PostLike, limits and limits.likers))
+    if selection.includes('comments', expandable=True):
+        lookups.append(Prefetch(
+            'comments',
+            queryset=_newest(
+                Comment.objects.filter(parent=None).select_related('author'),
+                limits and limits.comments
+            ),
+            to_attr='shown_comments'
+        ))
+        lookups += _comment_lookups('shown_comments__', selection.child('comments'), limits)
+    return lookups
+
+
+def comment_prefetches(request):
+    # Only the newest replies are embedded; the rest load lazily from
+    # /comments/<id>/replies/
+    limits = PreviewLimits(None, preview_limits(request).replies, None)
+    return _comment_lookups('', FieldSelection.from_request(request), limits)
+
+
+def reply_prefetches(request):
+    return _comment_lookups('', FieldSelection.from_request(request), None, with_replies=False)
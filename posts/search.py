@@ -0,0 +1,98 @@
+"""Inverted index over post content.
+
+``PostSearchTerm`` holds one row per distinct word of each post. The views
+re-index a post when it is created or edited; deleting a post cascades to
+its rows. A search reads the posting list of its rarest term in
+``(created_at, post_id)`` order and checks each candidate against the other
+terms on the ``(term, post)`` index, so a common word in the query never
+means reading its whole list. A request checks at most ``SEARCH_MAX_BATCHES``
+batches of candidates: when terms rarely occur together the page can come
+back short, or empty, with a cursor to look further. Results page with the
+same keyset cursor as the feed and never touch the ``posts`` table until
+hydration.
+"""
+from collections import Counter
+
+from django.db.models import Q
+
+from buddyscript_backend.pagination import PartialKeys, keyset_filter
+from buddyscript_backend.search import tokenize
+from .models import PostSearchTerm
+
+MAX_TERMS = 5
+# Postings counted per term to find the rarest one
+RAREST_SAMPLE = 1000
+# Postings of the rarest term checked against the other terms at a time
+SEARCH_BATCH = 100
+# Batches checked per request before handing the client a cursor
+SEARCH_MAX_BATCHES = 10
+
+
+def index_post(post):
+    PostSearchTerm.objects.filter(post=post).delete()
+    PostSearchTerm.objects.bulk_create([
+        PostSearchTerm(
+            term=term,
+            post_id=post.id,
+            author_id=post.author_id,
+            visibility=post.visibility,
+            created_at=post.created_at
+        )
+        for term in set(tokenize(post.content))
+    ])
+
+
+def query_terms(query):
+    return list(dict.fromkeys(tokenize(query)))[:MAX_TERMS]
+
+
+def _driver(terms):
+    """The term with the shortest posting list, counting at most
+    ``RAREST_SAMPLE`` rows of each."""
+    sizes = {
+        term: PostSearchTerm.objects.filter(term=term)[:RAREST_SAMPLE].count()
+        for term in terms
+    }
+    return min(terms, key=sizes.get)
+
+
+def search(user, terms, position, limit):
+    """Return up to ``limit`` ``(created_at, post_id)`` keys of posts that
+    contain every term and are visible to ``user``; ``PartialKeys`` when
+    the batch cap was reached first."""
+    if not terms:
+        return []
+
+    driver = _driver(terms) if len(terms) > 1 else terms[0]
+    others = [term for term in terms if term != driver]
+    postings = PostSearchTerm.objects.filter(
+        Q(visibility='public') | Q(author_id=user.id),
+        term=driver
+    ).order_by('-created_at', '-post_id')
+    if not others:
+        return list(
+            keyset_filter(postings, position, pk_field='post_id')
+            .values_list('created_at', 'post_id')[:limit]
+        )
+
+    # Walk the rarest term's postings in keyset order and keep the posts
+    # that have a row for every other term, until the page is full
+    keys = []
+    batch_size = max(limit, SEARCH_BATCH)
+    for _ in range(SEARCH_MAX_BATCHES):
+        batch = list(
+            keyset_filter(postings, position, pk_field='post_id')
+            .values_list('created_at', 'post_id')[:batch_size]
+        )
+        if not batch:
+            return keys
+        found = Counter(
+            PostSearchTerm.objects.filter(
+                term__in=others, post_id__in=[post_id for _, post_id in batch]
+            ).values_list('post_id', flat=True)
+        )
+        keys += [key for key in batch if found[key[1]] == len(others)]
+        position = batch[-1]
+        if len(keys) >= limit or len(batch) < batch_size:
+            return keys[:limit]
+    return PartialKeys(keys, position)
@@ -1,30 +1,111 @@
+from django.conf import settings
+from django.db import models
 from rest_framework import serializers
 from .models import Post, PostLike, Comment, CommentLike
-from accounts.serializers import UserSerializer
+from .viewer_state import get_viewer_state
+from accounts.serializers import (
+    UserSerializer, prime_friendship_statuses, prime_presence, prefetched
+)
+from buddyscript_backend.images import variant_urls
+from buddyscript_backend.serializers import DynamicFieldsMixin, TimedDataMixin
 
 
-class PostLikeSerializer(serializers.ModelSerializer):
+def preloaded(obj, attr, relation):
+    """Related objects the view already loaded for ``obj``: the (possibly
+    bounded) list prefetched into ``attr``, else the prefetched
+    ``relation``, else []."""
+    if hasattr(obj, attr):
+        return getattr(obj, attr)
+    return prefetched(obj, relation)
+
+
+def related(obj, attr, relation):
+    """Like ``preloaded`` but falls back to querying the whole relation."""
+    if hasattr(obj, attr):
+        return getattr(obj, attr)
+    return getattr(obj, relation).all()
+
+
+class PageListSerializer(TimedDataMixin, serializers.ListSerializer):
+    """Resolves viewer-specific state for the whole page before rendering:
+    ``is_liked`` (one query per model) and the viewer's friendship status
+    with every user shown (one query)."""
+
+    def get_post_ids(self, items):
+        return []
+
+    def get_users(self, items):
+        return []
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        get_viewer_state(self.context).add_posts(self.get_post_ids(items))
+        users = self.get_users(items)
+        prime_friendship_statuses(self.context, users)
+        prime_presence(self.context, users)
+        return super().to_representation(items)
+
+
+class LikeListSerializer(PageListSerializer):
+    def get_users(self, items):
+        return [like.user for like in items]
+
+
+class PostListSerializer(PageListSerializer):
+    def get_post_ids(self, items):
+        return [post.id for post in items]
+
+    def get_users(self, items):
+        users = [post.author for post in items]
+        for post in items:
+            users.extend(like.user for like in preloaded(post, 'shown_likes', 'likes'))
+            for comment in getattr(post, 'shown_comments', []):
+                users.append(comment.author)
+                users.extend(like.user for like in getattr(comment, 'shown_likes', []))
+                for reply in getattr(comment, 'shown_replies', []):
+                    users.append(reply.author)
+                    users.extend(like.user for like in getattr(reply, 'shown_likes', []))
+        return users
+
+
+class CommentListSerializer(PageListSerializer):
+    def get_post_ids(self, items):
+        return {comment.post_id for comment in items}
+
+    def get_users(self, items):
+        users = [comment.author for comment in items]
+        for comment in items:
+            users.extend(like.user for like in preloaded(comment, 'shown_likes', 'likes'))
+            for reply in preloaded(comment, 'shown_replies', 'replies'):
+                users.append(reply.author)
+                users.extend(like.user for like in getattr(reply, 'shown_likes', []))
+        return users
+
+
+class PostLikeSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
 
     class Meta:
         model = PostLike
         fields = ('id', 'user', 'created_at')
+        list_serializer_class = LikeListSerializer
 
 
-class CommentLikeSerializer(serializers.ModelSerializer):
+class CommentLikeSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
 
     class Meta:
         model = CommentLike
         fields = ('id', 'user', 'created_at')
+        list_serializer_class = LikeListSerializer
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     likes_count = serializers.IntegerField(read_only=True)
     replies_count = serializers.IntegerField(read_only=True)
     is_liked = serializers.SerializerMethodField()
-    likes = CommentLikeSerializer(many=True, read_only=True)
+    likes = serializers.SerializerMethodField()
     replies = serializers.SerializerMethodField()
 
     class Meta:
@@ -35,20 +116,29 @@ class CommentSerializer(serializers.ModelSerializer):
             'replies_count', 'is_liked', 'likes', 'replies'
         )
         read_only_fields = ('id', 'created_at', 'updated_at', 'post')
+        expandable_fields = ('likes', 'replies')
+        list_serializer_class = CommentListSerializer
 
     def get_is_liked(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return CommentLike.objects.filter(
-                comment=obj,
-                user=request.user
-            ).exists()
-        return False
+        return get_viewer_state(self.context).is_comment_liked(obj)
+
+    def get_likes(self, obj):
+        return CommentLikeSerializer(
+            related(obj, 'shown_likes', 'likes'),
+            many=True,
+            context=self.context,
+            selection=self.get_selection().child('likes')
+        ).data
 
     def get_replies(self, obj):
-        if obj.parent is None:  # Only get replies for root comments
-            replies = obj.replies.all()
-            return CommentSerializer(replies, many=True, context=self.context).data
+        if obj.parent_id is None:  # Only get replies for root comments
+            replies = related(obj, 'shown_replies', 'replies')
+            return CommentSerializer(
+                replies,
+                many=True,
+                context=self.context,
+                selection=self.get_selection().child('replies')
+            ).data
         return []
 
     # def validate_content(self, value):
@@ -71,33 +161,36 @@ class CommentSerializer(serializers.ModelSerializer):
         return data
 
 
-class PostSerializer(serializers.ModelSerializer):
+class PostSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
-    likes_count = serializers.IntegerField(read_only=True)
-    comments_count = serializers.IntegerField(read_only=True)
+    likes_count = serializers.SerializerMethodField()
+    comments_count = serializers.SerializerMethodField()
     is_liked = serializers.SerializerMethodField()
-    likes = PostLikeSerializer(many=True, read_only=True)
+    likes = serializers.SerializerMethodField()
     comments = serializers.SerializerMethodField()
     image_url = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Post
         fields = (
-            'id', 'author', 'content', 'image', 'image_url',
+            'id', 'author', 'content', 'image', 'image_url', 'image_variants',
             'visibility', 'created_at', 'updated_at',
             'likes_count', 'comments_count', 'is_liked',
             'likes', 'comments'
         )
         read_only_fields = ('id', 'created_at', 'updated_at')
+        expandable_fields = ('likes', 'comments')
+        list_serializer_class = PostListSerializer
+
+    def get_likes_count(self, obj):
+        return get_viewer_state(self.context).likes_count(obj)
+
+    def get_comments_count(self, obj):
+        return get_viewer_state(self.context).comments_count(obj)
 
     def get_is_liked(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return PostLike.objects.filter(
-                post=obj,
-                user=request.user
-            ).exists()
-        return False
+        return get_viewer_state(self.context).is_post_liked(obj.id)
 
     def get_image_url(self, obj):
         if obj.image:
@@ -106,10 +199,31 @@ class PostSerializer(serializers.ModelSerializer):
                 return request.build_absolute_uri(obj.image.url)
         return None
 
+    def get_image_variants(self, obj):
+        if obj.image:
+            return variant_urls(obj.image_variants, self.context.get('request'))
+        return None
+
+    def get_likes(self, obj):
+        return PostLikeSerializer(
+            related(obj, 'shown_likes', 'likes'),
+            many=True,
+            context=self.context,
+            selection=self.get_selection().child('likes')
+        ).data
+
     def get_comments(self, obj):
         # Only get root comments (no parent)
-        comments = obj.comments.filter(parent=None)
-        return CommentSerializer(comments, many=True, context=self.context).data
+        if hasattr(obj, 'shown_comments'):
+            comments = obj.shown_comments
+        else:
+            comments = obj.comments.filter(parent=None)
+        return CommentSerializer(
+            comments,
+            many=True,
+            context=self.context,
+            selection=self.get_selection().child('comments')
+        ).data
 
 
 class PostCreateSerializer(serializers.ModelSerializer):
@@ -137,4 +251,18 @@ class PostCreateSerializer(serializers.ModelSerializer):
     def validate_image(self, image):
         if image.size > 2 * 1024 * 1024:  # 2 MB limit
             raise serializers.ValidationError("Image size cannot exceed 2MB.")
-        return image
\ No newline at end of file
+        return image
+
+
+class LikeOperationSerializer(serializers.Serializer):
+    type = serializers.ChoiceField(choices=('post', 'comment'))
+    id = serializers.IntegerField(min_value=1)
+    liked = serializers.BooleanField()
+
+
+class LikeBatchSerializer(serializers.Serializer):
+    operations = serializers.ListField(
+        child=LikeOperationSerializer(),
+        allow_empty=False,
+        max_length=settings.LIKE_BATCH_MAX
+    )
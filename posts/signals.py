@@ -0,0 +1,18 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from accounts.models import Friendship
+from jobs.queue import enqueue
+from . import tasks
+
+
+@receiver(post_save, sender=Friendship)
+def backfill_timelines(sender, instance, **kwargs):
+    if instance.status == 'accepted':
+        enqueue(tasks.backfill_friends, instance.from_user_id, instance.to_user_id)
+
+
+@receiver(post_delete, sender=Friendship)
+def prune_timelines(sender, instance, **kwargs):
+    if instance.status == 'accepted':
+        enqueue(tasks.prune_friends, instance.from_user_id, instance.to_user_id)
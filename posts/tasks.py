@@ -0,0 +1,48 @@
+"""Background jobs for posts; scheduled with ``jobs.queue.enqueue``."""
+from . import counters, timeline
+from .models import Post, PostLike, Comment, CommentLike, TimelineEntry
+
+PURGE_CHUNK_SIZE = 1000
+
+
+def fan_out_post(post_id):
+    post = Post.objects.filter(pk=post_id).first()
+    if post is not None:
+        timeline.fan_out(post)
+
+
+def compact_post_counters(post_id):
+    counters.compact(post_id)
+
+
+def backfill_friends(user_id, friend_id):
+    timeline.backfill(user_id, friend_id)
+    timeline.backfill(friend_id, user_id)
+
+
+def prune_friends(user_id, friend_id):
+    timeline.remove_author(user_id, friend_id)
+    timeline.remove_author(friend_id, user_id)
+
+
+def _delete_in_chunks(queryset):
+    while True:
+        ids = list(queryset.values_list('id', flat=True)[:PURGE_CHUNK_SIZE])
+        if not ids:
+            return
+        queryset.model.objects.filter(id__in=ids).delete()
+
+
+def purge_post(post_id):
+    """Delete a post marked ``is_deleted`` together with everything under it.
+
+    Likes and timeline entries are removed in short chunks first so the
+    final cascading delete stays small.
+    """
+    if not Post.all_objects.filter(pk=post_id, is_deleted=True).exists():
+        return
+    _delete_in_chunks(CommentLike.objects.filter(comment__post_id=post_id))
+    _delete_in_chunks(PostLike.objects.filter(post_id=post_id))
+    _delete_in_chunks(TimelineEntry.objects.filter(post_id=post_id))
+    _delete_in_chunks(Comment.objects.filter(post_id=post_id, parent__isnull=False))
+    Post.all_objects.filter(pk=post_id).delete()
@@ -1,3 +1,1377 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from importlib import import_module
+from io import BytesIO, StringIO
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.apps import apps
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.test import APIClient, APITestCase
+
+from accounts import presence
+from accounts.models import User, Friendship
+from jobs import queue
+from jobs.models import Job
+from buddyscript_backend.images import build_variants, render_variants, variant_urls
+from buddyscript_backend.pagination import KeysetPagination, PartialKeys
+from . import counters, like_buffer, likes, threads, timeline
+from .counters import adjust_counters
+from .models import (
+    Post, PostCounterShard, PostLike, PostSearchTerm, Comment, CommentLike, TimelineEntry,
+    path_segment
+)
+from . import search
+from .search import index_post
+
+
+def build_graph(users=8, posts=12, likes=6, comments=5, replies=3):
+    """Users with friendships, and posts with liked comments and replies."""
+    people = [
+        User.objects.create_user(
+            email=f'user{index}@example.com',
+            first_name=f'First{index}',
+            last_name=f'Last{index}',
+            password='password-123'
+        )
+        for index in range(users)
+    ]
+    viewer = people[0]
+    for index, other in enumerate(people[1:], start=1):
+        Friendship.objects.create(
+            from_user=viewer if index % 2 else other,
+            to_user=other if index % 2 else viewer,
+            status='accepted' if index % 3 else 'pending'
+        )
+
+    for index in range(posts):
+        post = Post.objects.create(
+            author=people[index % users],
+            content=f'hello world number {index}'
+        )
+        counters.post_created(post)
+        for liker in people[:likes]:
+            PostLike.objects.create(user=liker, post=post)
+        for position in range(comments):
+            comment = Comment.objects.create(
+                post=post, author=people[position % users], content='comment'
+            )
+            CommentLike.objects.create(user=viewer, comment=comment)
+            for reply in range(replies):
+                Comment.objects.create(
+                    post=post, author=people[reply % users], content='reply', parent=comment
+                )
+        timeline.fan_out(post)
+        index_post(post)
+
+    call_command('recount_engagement', stdout=StringIO())
+    return people
+
+
+# Replicas configured through DATABASE_REPLICA_URLS cannot see the test's
+# transaction, so budgets are measured with every read on the primary
+@override_settings(DATABASE_REPLICAS=[])
+class QueryBudgetTestCase(APITestCase):
+    """Query budgets that must hold however much content a page carries.
+
+    Every check runs against a small graph and a graph with several times
+    the likes, comments and replies; both must fit the same budget.
+    """
+    scale = {'likes': 2, 'comments': 1, 'replies': 1}
+
+    @classmethod
+    def setUpTestData(cls):
+        # Friend sets cached by an earlier test class name other users
+        cache.clear()
+        cls.people = build_graph(**cls.scale)
+        cls.viewer = cls.people[0]
+        cls.post = Post.objects.filter(author=cls.viewer).first()
+        cls.comment = Comment.objects.filter(
+            post=cls.post, author=cls.viewer, parent=None
+        ).first()
+
+    def setUp(self):
+        # Cold caches make the budgets deterministic
+        cache.clear()
+        self.client.force_authenticate(self.viewer)
+
+    def request(self, method, url, **kwargs):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, **kwargs)
+        return response, len(context.captured_queries)
+
+    def assertBudget(self, method, url, budget, status=200, **kwargs):
+        response, queries = self.request(method, url, **kwargs)
+        self.assertEqual(response.status_code, status, getattr(response, 'data', None))
+        self.assertLessEqual(
+            queries, budget,
+            f'{method.upper()} {url} ran {queries} queries, budget is {budget}'
+        )
+        return response
+
+
+class PostEndpointBudgets(QueryBudgetTestCase):
+
+    def test_feed(self):
+        response = self.assertBudget('get', '/api/posts/', 11)
+        self.assertTrue(response.data['results'])
+
+    def test_feed_cursor_page(self):
+        response = self.assertBudget('get', '/api/posts/?cursor=', 10)
+        next_url = response.data['next']
+        self.assertBudget('get', next_url, 10)
+
+    def test_feed_sparse_fields(self):
+        self.assertBudget('get', '/api/posts/?fields=id,content,author.full_name', 3)
+
+    def test_timeline(self):
+        response = self.assertBudget('get', '/api/posts/timeline/', 12)
+        self.assertTrue(response.data['results'])
+
+    def test_search(self):
+        response = self.assertBudget('get', '/api/posts/search/?q=hello', 11)
+        self.assertTrue(response.data['results'])
+
+    def test_post_detail(self):
+        self.assertBudget('get', f'/api/posts/{self.post.id}/', 15)
+
+    def test_post_detail_not_modified(self):
+        url = f'/api/posts/{self.post.id}/'
+        etag = self.client.get(url)['ETag']
+        self.assertBudget('get', url, 5, status=304, HTTP_IF_NONE_MATCH=etag)
+
+    def test_comments(self):
+        response = self.assertBudget('get', f'/api/posts/{self.post.id}/comments/', 7)
+        self.assertTrue(response.data['results'])
+
+    def test_post_likers(self):
+        self.assertBudget('get', f'/api/posts/posts/{self.post.id}/likes/', 5)
+
+    def test_comment_likers(self):
+        self.assertBudget('get', f'/api/posts/comments/{self.comment.id}/likes/', 4)
+
+    def test_comment_detail(self):
+        self.assertBudget('get', f'/api/posts/comments/{self.comment.id}/', 7)
+
+    def test_comment_replies(self):
+        response = self.assertBudget(
+            'get', f'/api/posts/comments/{self.comment.id}/replies/?limit=2', 4
+        )
+        if response.data['next']:
+            self.assertBudget('get', response.data['next'], 4)
+
+    def test_comment_thread(self):
+        response = self.assertBudget(
+            'get', f'/api/posts/comments/{self.comment.id}/replies/?thread=&limit=2', 5
+        )
+        self.assertTrue(response.data['results'])
+        if response.data['next']:
+            self.assertBudget('get', response.data['next'], 5)
+
+    def test_create_post(self):
+        self.assertBudget(
+            'post', '/api/posts/', 9, status=201,
+            data={'content': 'a new post', 'visibility': 'public'}, format='json'
+        )
+
+    def test_update_post(self):
+        self.assertBudget(
+            'patch', f'/api/posts/{self.post.id}/', 15,
+            data={'content': 'edited words'}, format='json'
+        )
+
+    def test_delete_post(self):
+        self.assertBudget('delete', f'/api/posts/{self.post.id}/', 12, status=204)
+
+    def test_toggle_post_like(self):
+        self.assertBudget('post', f'/api/posts/{self.post.id}/like/', 8)
+
+    def test_toggle_comment_like(self):
+        self.assertBudget('post', f'/api/posts/comments/{self.comment.id}/like/', 7)
+
+    def test_like_batch(self):
+        posts = list(Post.objects.filter(visibility='public').values_list('id', flat=True))
+        comments = list(Comment.objects.values_list('id', flat=True)[:20])
+        operations = (
+            [{'type': 'post', 'id': pk, 'liked': index % 2 == 0} for index, pk in enumerate(posts)] +
+            [{'type': 'comment', 'id': pk, 'liked': index % 2 == 1} for index, pk in enumerate(comments)] +
+            [{'type': 'post', 'id': 999999, 'liked': True}]
+        )
+        response = self.assertBudget(
+            'post', '/api/posts/likes/batch/', 17,
+            data={'operations': operations}, format='json'
+        )
+        self.assertEqual(response.data['not_found'], [{'type': 'post', 'id': 999999}])
+        for row in response.data['posts']:
+            post = Post.objects.get(pk=row['id'])
+            self.assertEqual(post.likes.filter(user=self.viewer).exists(), row['liked'])
+            self.assertEqual(post.likes_count, row['likes_count'])
+            self.assertEqual(post.likes.count(), row['likes_count'])
+        for row in response.data['comments']:
+            comment = Comment.objects.get(pk=row['id'])
+            self.assertEqual(comment.likes.filter(user=self.viewer).exists(), row['liked'])
+            self.assertEqual(comment.likes.count(), row['likes_count'])
+
+    def test_create_comment(self):
+        self.assertBudget(
+            'post', f'/api/posts/{self.post.id}/comments/', 11, status=201,
+            data={'content': 'a reply', 'parent': self.comment.id}, format='json'
+        )
+
+    def test_update_comment(self):
+        self.assertBudget(
+            'patch', f'/api/posts/comments/{self.comment.id}/', 8,
+            data={'content': 'edited'}, format='json'
+        )
+
+    def test_delete_comment(self):
+        self.assertBudget('delete', f'/api/posts/comments/{self.comment.id}/', 13, status=204)
+
+
+class PostEndpointBudgetsLargeGraph(PostEndpointBudgets):
+    """The same budgets with several times more likes, comments and replies."""
+    scale = {'likes': 8, 'comments': 6, 'replies': 4}
+
+
+class EngagementCounterTests(APITestCase):
+    """Stored counters follow likes, comments and deletes made through the API."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(
+            email='author@example.com', first_name='A', last_name='Author', password='password-123'
+        )
+        self.fan = User.objects.create_user(
+            email='fan@example.com', first_name='F', last_name='Fan', password='password-123'
+        )
+        self.client.force_authenticate(self.author)
+        self.client.post('/api/posts/', {'content': 'counted', 'visibility': 'public'}, format='json')
+        self.post = Post.objects.get(author=self.author)
+
+    def comment(self, parent=None, user=None):
+        self.client.force_authenticate(user or self.author)
+        response = self.client.post(
+            f'/api/posts/{self.post.id}/comments/',
+            {'content': 'hi', 'parent': parent and parent.id}, format='json'
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        return Comment.objects.get(pk=response.data['id'])
+
+    def assertCounts(self, obj, **expected):
+        obj.refresh_from_db()
+        self.assertEqual({field: getattr(obj, field) for field in expected}, expected)
+
+    def test_post_likes(self):
+        for user in (self.author, self.fan):
+            self.client.force_authenticate(user)
+            response = self.client.post(f'/api/posts/{self.post.id}/like/')
+        self.assertEqual(response.data['likes_count'], 2)
+        self.assertCounts(self.post, likes_count=2)
+
+        self.client.post(f'/api/posts/{self.post.id}/like/')
+        self.assertCounts(self.post, likes_count=1)
+
+    def test_comment_likes(self):
+        comment = self.comment()
+        self.client.force_authenticate(self.fan)
+        self.client.post(f'/api/posts/comments/{comment.id}/like/')
+        self.assertCounts(comment, likes_count=1)
+        self.client.post(f'/api/posts/comments/{comment.id}/like/')
+        self.assertCounts(comment, likes_count=0)
+
+    def test_comments_and_replies(self):
+        root = self.comment()
+        self.comment(parent=root, user=self.fan)
+        reply = self.comment(parent=root)
+        self.assertCounts(self.post, comments_count=3)
+        self.assertCounts(root, replies_count=2)
+
+        self.client.force_authenticate(self.author)
+        self.client.delete(f'/api/posts/comments/{reply.id}/')
+        self.assertCounts(self.post, comments_count=2)
+        self.assertCounts(root, replies_count=1)
+
+        # The remaining reply goes with its parent
+        self.client.delete(f'/api/posts/comments/{root.id}/')
+        self.assertCounts(self.post, comments_count=0)
+
+    def test_posts_count(self):
+        self.assertCounts(self.author, posts_count=1)
+        self.client.force_authenticate(self.author)
+        self.client.delete(f'/api/posts/{self.post.id}/')
+        self.assertCounts(self.author, posts_count=0)
+
+    def test_recount_finds_no_drift(self):
+        root = self.comment()
+        self.comment(parent=root, user=self.fan)
+        self.client.post(f'/api/posts/{self.post.id}/like/')
+        out = StringIO()
+        call_command('recount_engagement', '--dry-run', stdout=out)
+        self.assertIn('Would fix 0 post(s), 0 comment(s) and 0 user(s)', out.getvalue())
+
+class ViewerStateTests(APITestCase):
+    """``is_liked`` for a whole page is resolved with one query per model."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(
+            email='author@example.com', first_name='A', last_name='Author', password='password-123'
+        )
+        self.viewer = User.objects.create_user(
+            email='viewer@example.com', first_name='V', last_name='Viewer', password='password-123'
+        )
+        self.posts = [Post.objects.create(author=self.author, content=f'post {n}') for n in range(4)]
+        for post in self.posts:
+            comment = Comment.objects.create(post=post, author=self.author, content='comment')
+            Comment.objects.create(post=post, author=self.author, content='reply', parent=comment)
+        PostLike.objects.create(user=self.viewer, post=self.posts[0])
+        self.liked_reply = Comment.objects.filter(post=self.posts[1], parent__isnull=False).get()
+        CommentLike.objects.create(user=self.viewer, comment=self.liked_reply)
+
+    def feed(self, user):
+        self.client.force_authenticate(user)
+        return self.client.get(
+            '/api/posts/?fields=id,is_liked,comments.id,comments.is_liked,'
+            'comments.replies.id,comments.replies.is_liked'
+        )
+
+    def liked(self, response):
+        liked = set()
+        for post in response.data['results']:
+            if post['is_liked']:
+                liked.add(('post', post['id']))
+            for comment in post['comments']:
+                for item in [comment] + comment['replies']:
+                    if item['is_liked']:
+                        liked.add(('comment', item['id']))
+        return liked
+
+    def test_is_liked_follows_the_viewer(self):
+        self.assertEqual(
+            self.liked(self.feed(self.viewer)),
+            {('post', self.posts[0].id), ('comment', self.liked_reply.id)}
+        )
+        self.assertEqual(self.liked(self.feed(self.author)), set())
+
+    def test_page_reads_each_like_table_once(self):
+        with CaptureQueriesContext(connection) as context:
+            self.feed(self.viewer)
+        for table in (PostLike._meta.db_table, CommentLike._meta.db_table):
+            reads = [
+                query for query in context.captured_queries
+                if f'FROM {connection.ops.quote_name(table)}' in query['sql']
+            ]
+            self.assertEqual(len(reads), 1, table)
+
+
+@mock.patch.object(KeysetPagination, 'page_size', 2)
+class KeysetPaginationTests(APITestCase):
+    """``?cursor=`` pages newest first on ``(created_at, id)``."""
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            email='author@example.com', first_name='A', last_name='Author', password='password-123'
+        )
+        self.client.force_authenticate(self.author)
+        self.posts = [Post.objects.create(author=self.author, content=f'post {n}') for n in range(5)]
+        # Two posts share a timestamp; the ID breaks the tie
+        Post.objects.filter(pk=self.posts[3].pk).update(created_at=self.posts[2].created_at)
+
+    def pages(self, url):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIsNone(response.data['previous'])
+            self.assertNotIn('count', response.data)
+            pages.append([post['id'] for post in response.data['results']])
+            url = response.data['next']
+        return pages
+
+    def test_cursor_pages_cover_every_post_once_newest_first(self):
+        pages = self.pages('/api/posts/?cursor=')
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(sum(pages, []), [post.id for post in reversed(self.posts)])
+
+    def test_new_posts_do_not_shift_later_pages(self):
+        first = self.client.get('/api/posts/?cursor=')
+        Post.objects.create(author=self.author, content='newer')
+        second = self.client.get(first.data['next'])
+        self.assertEqual(
+            [post['id'] for post in second.data['results']],
+            [self.posts[2].id, self.posts[1].id]
+        )
+
+    def test_invalid_cursor_is_not_found(self):
+        self.assertEqual(self.client.get('/api/posts/?cursor=not-a-cursor').status_code, 404)
+
+    def test_page_numbers_still_work_without_a_cursor(self):
+        response = self.client.get('/api/posts/?page=3')
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual([post['id'] for post in response.data['results']], [self.posts[0].id])
+
+    def test_comment_list_pages_by_cursor(self):
+        comments = [
+            Comment.objects.create(post=self.posts[0], author=self.author, content=f'c{n}')
+            for n in range(3)
+        ]
+        pages = self.pages(f'/api/posts/{self.posts[0].id}/comments/?cursor=&limit=2')
+        self.assertEqual(sum(pages, []), [comment.id for comment in reversed(comments)])
+
+
+class SparseFieldsTests(APITestCase):
+    """``?fields=`` and ``?expand=`` on post and comment output."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(
+            email='author@example.com', first_name='A', last_name='Author', password='password-123'
+        )
+        self.post = Post.objects.create(author=self.author, content='hello')
+        self.comment = Comment.objects.create(post=self.post, author=self.author, content='comment')
+        Comment.objects.create(post=self.post, author=self.author, content='reply', parent=self.comment)
+        PostLike.objects.create(user=self.author, post=self.post)
+        self.client.force_authenticate(self.author)
+
+    def first(self, query):
+        return self.client.get(f'/api/posts/{query}').data['results'][0]
+
+    def test_without_parameters_everything_is_rendered(self):
+        post = self.first('')
+        self.assertEqual(len(post['likes']), 1)
+        self.assertEqual(len(post['comments'][0]['replies']), 1)
+        self.assertIn('friendship_status', post['author'])
+
+    def test_fields_select_nested_fields(self):
+        post = self.first('?fields=id,content,author.full_name')
+        self.assertEqual(set(post), {'id', 'content', 'author'})
+        self.assertEqual(post['author'], {'full_name': 'A Author'})
+
+    def test_expandable_fields_are_left_out_unless_expanded(self):
+        post = self.first('?fields=id')
+        self.assertEqual(set(post), {'id'})
+        post = self.first('?expand=comments')
+        self.assertIn('comments', post)
+        self.assertNotIn('likes', post)
+        self.assertIn('content', post)
+        # Nested expandable fields need expanding too
+        self.assertNotIn('replies', post['comments'][0])
+        post = self.first('?expand=comments.replies')
+        self.assertEqual(len(post['comments'][0]['replies']), 1)
+
+    def test_relations_left_out_are_not_loaded(self):
+        with CaptureQueriesContext(connection) as context:
+            self.first('?fields=id,content')
+        tables = (Comment._meta.db_table, PostLike._meta.db_table, CommentLike._meta.db_table)
+        for query in context.captured_queries:
+            for table in tables:
+                self.assertNotIn(f'FROM {connection.ops.quote_name(table)}', query['sql'])
+
+    def test_comment_list_takes_fields(self):
+        response = self.client.get(f'/api/posts/{self.post.id}/comments/?fields=id,content')
+        self.assertEqual(response.data['results'], [{'id': self.comment.id, 'content': 'comment'}])
+
+
+@override_settings(FEED_PREVIEW_COMMENTS=3, FEED_PREVIEW_REPLIES=2, FEED_PREVIEW_LIKERS=3)
+class FeedPreviewTests(APITestCase):
+    """Feed items embed bounded previews; post detail embeds everything."""
+
+    def setUp(self):
+        cache.clear()
+        self.people = [
+            User.objects.create_user(
+                email=f'user{n}@example.com', first_name=f'First{n}', last_name='Test',
+                password='password-123'
+            )
+            for n in range(5)
+        ]
+        self.post = Post.objects.create(author=self.people[0], content='busy')
+        self.roots = [
+            Comment.objects.create(post=self.post, author=self.people[0], content=f'root {n}')
+            for n in range(5)
+        ]
+        self.replies = [
+            Comment.objects.create(
+                post=self.post, author=self.people[1], content=f'reply {n}', parent=self.roots[-1]
+            )
+            for n in range(4)
+        ]
+        self.likes = [PostLike.objects.create(user=user, post=self.post) for user in self.people]
+        self.client.force_authenticate(self.people[0])
+
+    def feed_item(self, query=''):
+        return self.client.get(f'/api/posts/{query}').data['results'][0]
+
+    def test_feed_embeds_the_newest_few(self):
+        post = self.feed_item()
+        self.assertEqual(
+            [comment['id'] for comment in post['comments']],
+            [comment.id for comment in reversed(self.roots[-3:])]
+        )
+        self.assertEqual(
+            [reply['id'] for reply in post['comments'][0]['replies']],
+            [reply.id for reply in reversed(self.replies[-2:])]
+        )
+        self.assertEqual(
+            [like['id'] for like in post['likes']],
+            [like.id for like in reversed(self.likes[-3:])]
+        )
+
+    @override_settings(FEED_PREVIEW_MAX=4)
+    def test_clients_choose_sizes_up_to_the_maximum(self):
+        post = self.feed_item('?preview_comments=1&preview_replies=0&preview_likers=99')
+        self.assertEqual([comment['id'] for comment in post['comments']], [self.roots[-1].id])
+        self.assertEqual(post['comments'][0]['replies'], [])
+        self.assertEqual(len(post['likes']), 4)
+
+    def test_post_detail_embeds_everything(self):
+        post = self.client.get(f'/api/posts/{self.post.id}/').data
+        self.assertEqual(len(post['comments']), 5)
+        self.assertEqual(len(post['comments'][0]['replies']), 4)
+        self.assertEqual(len(post['likes']), 5)
+
+
+
+@override_settings(JOBS_RUN_INLINE=False)
+class TimelineTests(APITestCase):
+    """Timelines as built by the views and the jobs they schedule."""
+
+    def setUp(self):
+        cache.clear()
+        self.alice, self.bob, self.carol = [
+            User.objects.create_user(
+                email=f'{name}@example.com', first_name=name.title(), last_name='Test',
+                password='password-123'
+            )
+            for name in ('alice', 'bob', 'carol')
+        ]
+        self.befriend(self.alice, self.bob)
+
+    def run_jobs(self):
+        while (job := queue.claim()) is not None:
+            self.assertTrue(queue.run(job))
+
+    def befriend(self, user, other):
+        self.client.force_authenticate(user)
+        self.client.post(f'/api/auth/friend-requests/send/{other.id}/')
+        request = Friendship.objects.get(from_user=user, to_user=other)
+        self.client.force_authenticate(other)
+        self.client.post(
+            f'/api/auth/friend-requests/{request.id}/respond/', {'action': 'accept'}, format='json'
+        )
+        self.run_jobs()
+
+    def publish(self, user, content, visibility='public'):
+        self.client.force_authenticate(user)
+        self.client.post('/api/posts/', {'content': content, 'visibility': visibility}, format='json')
+        return Post.objects.filter(author=user).latest('id').id
+
+    def timeline(self, user):
+        self.client.force_authenticate(user)
+        return [post['id'] for post in self.client.get('/api/posts/timeline/').data['results']]
+
+    def test_new_posts_reach_friends_after_the_job(self):
+        post = self.publish(self.alice, 'hello friends')
+        self.assertEqual(self.timeline(self.alice), [post])
+        self.assertEqual(self.timeline(self.bob), [])
+
+        self.run_jobs()
+        self.assertEqual(self.timeline(self.bob), [post])
+        self.assertEqual(self.timeline(self.carol), [])
+
+    def test_private_posts_stay_with_their_author(self):
+        post = self.publish(self.alice, 'just me', visibility='private')
+        self.run_jobs()
+        self.assertEqual(self.timeline(self.alice), [post])
+        self.assertEqual(self.timeline(self.bob), [])
+
+    def test_new_friend_gets_recent_posts(self):
+        older = self.publish(self.carol, 'older')
+        newer = self.publish(self.carol, 'newer')
+        self.befriend(self.alice, self.carol)
+        self.assertEqual(self.timeline(self.alice), [newer, older])
+
+    def test_unfriending_prunes_both_timelines(self):
+        mine = self.publish(self.alice, 'mine')
+        theirs = self.publish(self.bob, 'theirs')
+        self.run_jobs()
+        self.assertEqual(self.timeline(self.alice), [theirs, mine])
+
+        self.client.force_authenticate(self.alice)
+        self.client.delete(f'/api/auth/unfriend/{self.bob.id}/')
+        self.run_jobs()
+        self.assertEqual(self.timeline(self.alice), [mine])
+        self.assertEqual(self.timeline(self.bob), [theirs])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_authors_with_many_friends_are_merged_at_read_time(self):
+        mine = self.publish(self.bob, 'pushed to me only')
+        popular = self.publish(self.alice, 'too many friends to push')
+        self.assertFalse(Post.objects.get(pk=popular).fanned_out)
+        self.run_jobs()
+        self.assertFalse(TimelineEntry.objects.filter(user=self.bob, post_id=popular).exists())
+        self.assertEqual(self.timeline(self.bob), [popular, mine])
+
+        # Pages continue across pushed entries and pulled posts
+        self.client.force_authenticate(self.bob)
+        with mock.patch.object(KeysetPagination, 'page_size', 1):
+            first = self.client.get('/api/posts/timeline/').data
+            second = self.client.get(first['next']).data
+        self.assertEqual(
+            [post['id'] for post in first['results'] + second['results']], [popular, mine]
+        )
+
+
+class DeletedPostTests(APITestCase):
+    """A deleted post's comments and likes are gone before its purge job runs."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(
+            email='author@example.com', first_name='A', last_name='Author', password='password-123'
+        )
+        self.post = Post.objects.create(author=self.author, content='soon gone')
+        self.comment = Comment.objects.create(post=self.post, author=self.author, content='hi')
+        PostLike.objects.create(post=self.post, user=self.author)
+        CommentLike.objects.create(comment=self.comment, user=self.author)
+        self.client.force_authenticate(self.author)
+        self.assertEqual(self.client.delete(f'/api/posts/{self.post.id}/').status_code, 204)
+
+    def test_comments_are_hidden(self):
+        response = self.client.get(f'/api/posts/{self.post.id}/comments/')
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(self.client.get(f'/api/posts/comments/{self.comment.id}/').status_code, 404)
+
+    def test_cannot_comment_or_edit(self):
+        response = self.client.post(
+            f'/api/posts/{self.post.id}/comments/', {'content': 'late'}, format='json'
+        )
+        self.assertEqual(response.status_code, 404)
+        response = self.client.patch(
+            f'/api/posts/comments/{self.comment.id}/', {'content': 'edited'}, format='json'
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_likes_are_hidden_and_frozen(self):
+        response = self.client.get(f'/api/posts/posts/{self.post.id}/likes/?cursor=')
+        self.assertEqual(response.data['results'], [])
+        response = self.client.get(f'/api/posts/comments/{self.comment.id}/likes/?cursor=')
+        self.assertEqual(response.data['results'], [])
+        response = self.client.post(f'/api/posts/comments/{self.comment.id}/like/')
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(CommentLike.objects.filter(comment=self.comment).exists())
+
+
+class ConditionalGetTests(APITestCase):
+    """ETags of post detail and likers lists follow everything they embed."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        presence._pending.clear()
+        self.addCleanup(presence._pending.clear)
+        self.viewer, self.author, self.fan = [
+            User.objects.create_user(
+                email=f'{name}@example.com', first_name=name.title(), last_name='Test',
+                password='password-123'
+            )
+            for name in ('viewer', 'author', 'fan')
+        ]
+        self.post = Post.objects.create(author=self.author, content='tagged')
+        self.comment = Comment.objects.create(post=self.post, author=self.author, content='hi')
+        PostLike.objects.create(post=self.post, user=self.fan)
+        CommentLike.objects.create(comment=self.comment, user=self.fan)
+        call_command('recount_engagement', stdout=StringIO())
+        self.client.force_authenticate(self.viewer)
+        self.urls = [
+            f'/api/posts/{self.post.id}/',
+            f'/api/posts/posts/{self.post.id}/likes/',
+            f'/api/posts/posts/{self.post.id}/likes/?cursor=',
+            f'/api/posts/comments/{self.comment.id}/likes/',
+        ]
+
+    def tags(self):
+        tags = {}
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            tags[url] = response['ETag']
+        return tags
+
+    def revalidated(self, tags):
+        """Status of each URL revalidated with its earlier tag."""
+        return {
+            url: self.client.get(url, HTTP_IF_NONE_MATCH=tag).status_code
+            for url, tag in tags.items()
+        }
+
+    def assertChanged(self, tags, *urls):
+        self.assertEqual(
+            self.revalidated(tags), {url: 200 if url in urls else 304 for url in self.urls}
+        )
+
+    def test_unchanged_responses_are_not_modified(self):
+        self.assertChanged(self.tags())
+
+    def test_liker_profile_changes(self):
+        tags = self.tags()
+        self.fan.first_name = 'Renamed'
+        self.fan.save()
+        self.assertChanged(tags, *self.urls)
+
+    def test_stored_counters_of_embedded_users(self):
+        tags = self.tags()
+        adjust_counters(User, [self.author.id], 'friends_count', 1)
+        self.assertChanged(tags, self.urls[0])
+
+    def test_presence_of_embedded_users(self):
+        tags = self.tags()
+        presence.heartbeat(self.fan.id)
+        self.assertChanged(tags, *self.urls)
+
+    def test_friendship_status_with_embedded_users(self):
+        tags = self.tags()
+        self.client.post(f'/api/auth/friend-requests/send/{self.fan.id}/')
+        self.assertChanged(tags, *self.urls)
+
+    def test_new_likes(self):
+        tags = self.tags()
+        self.client.post(f'/api/posts/{self.post.id}/like/')
+        self.assertChanged(tags, *self.urls[:3])
+        tags = self.tags()
+        self.client.post(f'/api/posts/comments/{self.comment.id}/like/')
+        self.assertChanged(tags, self.urls[0], self.urls[3])
+
+    def test_comment_edits(self):
+        tags = self.tags()
+        self.client.force_authenticate(self.author)
+        self.client.patch(f'/api/posts/comments/{self.comment.id}/', {'content': 'edited'}, format='json')
+        self.client.force_authenticate(self.viewer)
+        self.assertChanged(tags, self.urls[0])
+
+    @override_settings(LIKE_BUFFER_HOT_THRESHOLD=0)
+    def test_buffered_likes(self):
+        like_buffer._pending.clear()
+        self.addCleanup(like_buffer._pending.clear)
+        tags = self.tags()
+        with mock.patch.object(like_buffer, '_start_flusher'):
+            self.client.post(f'/api/posts/{self.post.id}/like/')
+        self.assertChanged(tags, self.urls[0])
+
+
+@override_settings(LIKE_BUFFER_HOT_THRESHOLD=0)
+class LikeBufferTests(APITestCase):
+    """Every toggle is buffered (threshold 0); tests flush by hand."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        like_buffer._pending.clear()
+        like_buffer._deltas.clear()
+        like_buffer._failures.clear()
+        patcher = mock.patch.object(like_buffer, '_start_flusher')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.author, self.fan = [
+            User.objects.create_user(
+                email=f'{name}@example.com', first_name=name, last_name='Test',
+                password='password-123'
+            )
+            for name in ('author', 'fan')
+        ]
+        self.post = Post.objects.create(author=self.author, content='hot')
+        self.client.force_authenticate(self.fan)
+
+    def toggle(self):
+        return self.client.post(f'/api/posts/{self.post.id}/like/').data
+
+    def shown(self):
+        data = self.client.get(f'/api/posts/{self.post.id}/').data
+        return data['is_liked'], data['likes_count']
+
+    def stored(self):
+        self.post.refresh_from_db()
+        return PostLike.objects.filter(post=self.post, user=self.fan).exists(), self.post.likes_count
+
+    def test_toggle_is_served_then_flushed(self):
+        self.assertEqual(self.toggle(), {'liked': True, 'likes_count': 1})
+        self.assertEqual(self.stored(), (False, 0))
+        self.assertEqual(self.shown(), (True, 1))
+
+        like_buffer.flush()
+        self.assertEqual(self.stored(), (True, 1))
+        self.assertEqual(self.shown(), (True, 1))
+
+    def test_double_toggle_in_one_window(self):
+        self.toggle()
+        self.assertEqual(self.toggle(), {'liked': False, 'likes_count': 0})
+        self.assertEqual(self.shown(), (False, 0))
+        like_buffer.flush()
+        self.assertEqual(self.stored(), (False, 0))
+        self.assertEqual(self.shown(), (False, 0))
+
+    def test_post_stays_buffered_after_it_cools_down(self):
+        self.toggle()
+        with override_settings(LIKE_BUFFER_HOT_THRESHOLD=1000):
+            # Goes through the buffer, which knows about the first toggle
+            self.assertEqual(self.toggle(), {'liked': False, 'likes_count': 0})
+            self.assertEqual(self.shown(), (False, 0))
+            like_buffer.flush()
+            self.assertEqual(self.stored(), (False, 0))
+
+            # Once the cached intents expire, writes go to the table again
+            cache.clear()
+            self.assertEqual(self.toggle(), {'liked': True, 'likes_count': 1})
+            self.assertEqual(self.stored(), (True, 1))
+
+    def test_batch_goes_through_the_buffer(self):
+        self.toggle()
+        response = self.client.post('/api/posts/likes/batch/', {'operations': [
+            {'type': 'post', 'id': self.post.id, 'liked': False},
+        ]}, format='json')
+        self.assertEqual(response.data['posts'], [{'id': self.post.id, 'liked': False, 'likes_count': 0}])
+        self.assertEqual(self.shown(), (False, 0))
+        like_buffer.flush()
+        self.assertEqual(self.stored(), (False, 0))
+
+    def test_failed_flush_is_retried(self):
+        self.toggle()
+        with mock.patch.object(likes, 'apply_intents', side_effect=OperationalError):
+            with self.assertLogs('posts.like_buffer', 'ERROR'):
+                like_buffer.flush()
+        self.assertEqual(self.stored(), (False, 0))
+        self.assertEqual(self.shown(), (True, 1))
+
+        like_buffer.flush()
+        self.assertEqual(self.stored(), (True, 1))
+        self.assertEqual(self.shown(), (True, 1))
+
+    @override_settings(LIKE_BUFFER_MAX_RETRIES=1)
+    def test_likes_are_dropped_after_the_last_retry(self):
+        self.toggle()
+        with mock.patch.object(likes, 'apply_intents', side_effect=OperationalError):
+            with self.assertLogs('posts.like_buffer', 'ERROR'):
+                like_buffer.flush()
+                like_buffer.flush()
+        self.assertEqual(dict(like_buffer._pending), {})
+        # Back to what the table holds
+        self.assertEqual(self.shown(), (False, 0))
+        self.assertEqual(self.stored(), (False, 0))
+
+
+@override_settings(COUNTER_SHARD_THRESHOLD=0, JOBS_RUN_INLINE=False)
+class CounterShardTests(APITestCase):
+    """Every counter write goes to a shard (threshold 0)."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.author = User.objects.create_user(
+            email='author@example.com', first_name='A', last_name='Author', password='password-123'
+        )
+        self.post = Post.objects.create(author=self.author, content='hot')
+        self.client.force_authenticate(self.author)
+
+    def shown(self):
+        data = self.client.get(f'/api/posts/{self.post.id}/').data
+        return data['likes_count'], data['comments_count']
+
+    def test_reads_include_shards_before_compaction(self):
+        for shard in range(3):
+            with mock.patch('posts.counters.random.randrange', return_value=shard):
+                counters.post_liked(self.post.id, 2)
+        counters.post_liked(self.post.id, -1)
+        counters.adjust_post_counter(self.post.id, 'comments_count', 1)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.likes_count, self.post.comments_count), (0, 0))
+
+        self.assertEqual(counters.shard_totals([self.post.id]), {
+            self.post.id: {'likes_count': 5, 'comments_count': 1}
+        })
+        self.assertEqual(self.shown(), (5, 1))
+        # Nothing per-process decides whether the shards are read
+        cache.clear()
+        self.assertEqual(self.shown(), (5, 1))
+
+    def test_compaction_folds_shards_into_the_post(self):
+        counters.post_liked(self.post.id, 3)
+        counters.post_liked(self.post.id, -1)
+        self.assertEqual(Job.objects.get().task, 'posts.tasks.compact_post_counters')
+
+        counters.compact(self.post.id)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 2)
+        self.assertFalse(PostCounterShard.objects.exists())
+        self.assertEqual(counters.shard_totals([self.post.id]), {})
+        self.assertEqual(self.shown(), (2, 0))
+
+    def test_writer_losing_the_shard_creation_race_still_counts(self):
+        update = QuerySet.update
+        raced = []
+
+        def rival_creates_the_shard(queryset, **kwargs):
+            if queryset.model is PostCounterShard and not raced:
+                # Finds no shard row, then another writer creates it
+                raced.append(True)
+                PostCounterShard.objects.create(post=self.post, shard=0, likes_count=1)
+                return 0
+            return update(queryset, **kwargs)
+
+        with mock.patch('posts.counters.random.randrange', return_value=0), \
+                mock.patch.object(QuerySet, 'update', autospec=True, side_effect=rival_creates_the_shard):
+            counters.post_liked(self.post.id)
+        self.assertEqual(counters.shard_totals([self.post.id])[self.post.id]['likes_count'], 2)
+
+    def test_compaction_never_goes_below_zero(self):
+        counters.post_liked(self.post.id, -3)
+        counters.compact(self.post.id)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 0)
+
+
+@skipIf(connection.vendor == 'sqlite', 'SQLite allows one writer at a time')
+@override_settings(COUNTER_SHARD_THRESHOLD=0, JOBS_RUN_INLINE=False)
+class ConcurrentCounterShardTests(TransactionTestCase):
+
+    def test_concurrent_increments_are_all_counted(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        author = User.objects.create_user(
+            email='author@example.com', first_name='A', last_name='Author', password='password-123'
+        )
+        post = Post.objects.create(author=author, content='hot')
+        errors = []
+
+        def like(times):
+            try:
+                for _ in range(times):
+                    counters.post_liked(post.id)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=like, args=(25,)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(counters.shard_totals([post.id])[post.id]['likes_count'], 100)
+        counters.compact(post.id)
+        post.refresh_from_db()
+        self.assertEqual(post.likes_count, 100)
+
+
+class CommentThreadTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(
+            email='author@example.com', first_name='A', last_name='Author', password='password-123'
+        )
+        self.post = Post.objects.create(author=self.author, content='threads')
+        self.client.force_authenticate(self.author)
+
+    def reply(self, parent=None):
+        response = self.client.post(
+            f'/api/posts/{self.post.id}/comments/',
+            {'content': 'hi', 'parent': parent and parent.id}, format='json'
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        return Comment.objects.get(pk=response.data['id'])
+
+    def test_paths_follow_the_thread(self):
+        root = self.reply()
+        child = self.reply(root)
+        grandchild = self.reply(child)
+        self.assertEqual((root.path, root.depth), (path_segment(root.id), 0))
+        self.assertEqual((child.path, child.depth), (root.path + path_segment(child.id), 1))
+        self.assertEqual((grandchild.path, grandchild.depth), (child.path + path_segment(grandchild.id), 2))
+
+    def test_subtree_is_in_thread_order(self):
+        root = self.reply()
+        first = self.reply(root)
+        second = self.reply(root)
+        nested = self.reply(first)
+        other = self.reply()
+        self.assertEqual(list(threads.subtree(root)), [root, first, nested, second])
+        self.assertEqual(list(threads.subtree(root, include_self=False)), [first, nested, second])
+        self.assertEqual(list(threads.subtree(other)), [other])
+
+    def test_delete_removes_the_whole_subtree(self):
+        root = self.reply()
+        child = self.reply(root)
+        sibling = self.reply(root)
+        self.reply(self.reply(child))
+
+        self.assertEqual(self.client.delete(f'/api/posts/comments/{child.id}/').status_code, 204)
+        self.assertEqual(set(Comment.objects.all()), {root, sibling})
+        self.post.refresh_from_db()
+        root.refresh_from_db()
+        self.assertEqual((self.post.comments_count, root.replies_count), (2, 1))
+
+    def test_thread_mode_pages_the_subtree_in_order(self):
+        root = self.reply()
+        first = self.reply(root)
+        second = self.reply(root)
+        nested = self.reply(first)
+        deeper = self.reply(nested)
+        self.reply()
+
+        url = f'/api/posts/comments/{root.id}/replies/?thread=&limit=2'
+        found = []
+        while url:
+            data = self.client.get(url).data
+            self.assertLessEqual(len(data['results']), 2)
+            found += [(comment['id'], comment['parent']) for comment in data['results']]
+            url = data['next']
+        self.assertEqual(found, [
+            (first.id, root.id), (nested.id, first.id), (deeper.id, nested.id), (second.id, root.id)
+        ])
+
+        # Without it only the direct replies, newest first
+        data = self.client.get(f'/api/posts/comments/{root.id}/replies/').data
+        self.assertEqual([comment['id'] for comment in data['results']], [second.id, first.id])
+
+    def test_thread_mode_checks_the_comment(self):
+        root = self.reply()
+        self.assertEqual(self.client.get('/api/posts/comments/999999/replies/?thread=').status_code, 404)
+        Post.objects.filter(pk=self.post.pk).update(visibility='private')
+        stranger = User.objects.create_user(
+            email='stranger@example.com', first_name='S', last_name='Tranger', password='password-123'
+        )
+        self.client.force_authenticate(stranger)
+        response = self.client.get(f'/api/posts/comments/{root.id}/replies/?thread=')
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(COMMENT_MAX_DEPTH=3)
+    def test_depth_limit(self):
+        deepest = self.reply(self.reply(self.reply()))
+        self.assertEqual(deepest.depth, 2)
+        response = self.client.post(
+            f'/api/posts/{self.post.id}/comments/',
+            {'content': 'too deep', 'parent': deepest.id}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Comment.objects.count(), 3)
+
+    def test_comment_without_a_path_still_has_a_subtree(self):
+        root = self.reply()
+        child = self.reply(root)
+        nested = self.reply(child)
+        Comment.objects.filter(pk=root.pk).update(path='')
+        root.refresh_from_db()
+        self.assertEqual(set(threads.subtree(root)), {root, child, nested})
+
+    def test_path_backfill_ends_on_broken_threads(self):
+        root = self.reply()
+        child = self.reply(root)
+        nested = self.reply(child)
+        looped = [self.reply(), self.reply()]
+        Comment.objects.filter(pk=looped[0].pk).update(parent=looped[1])
+        Comment.objects.filter(pk=looped[1].pk).update(parent=looped[0])
+        Comment.objects.update(path='', depth=0)
+
+        import_module('posts.migrations.0008_comment_paths').fill_paths(apps, None)
+        for comment in (root, child, nested):
+            stored = Comment.objects.get(pk=comment.pk)
+            self.assertEqual((stored.path, stored.depth), (comment.path, comment.depth))
+        for comment in looped:
+            self.assertEqual(Comment.objects.get(pk=comment.pk).path, path_segment(comment.id))
+
+
+class PostSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer, cls.other = [
+            User.objects.create_user(
+                email=f'{name}@example.com', first_name=name, last_name='Test',
+                password='password-123'
+            )
+            for name in ('viewer', 'other')
+        ]
+        # Newest first: every post says "common", every fourth one also "rare"
+        now = timezone.now()
+        cls.posts = []
+        for index in range(20):
+            content = 'common rare words' if index % 4 == 0 else 'common words'
+            post = Post.objects.create(author=cls.other, content=content)
+            Post.objects.filter(pk=post.pk).update(created_at=now - timedelta(minutes=index))
+            post.refresh_from_db()
+            index_post(post)
+            cls.posts.append(post)
+        cls.private = Post.objects.create(
+            author=cls.other, content='common rare secret', visibility='private'
+        )
+        index_post(cls.private)
+
+    def ids(self, keys):
+        return [post_id for _, post_id in keys]
+
+    def test_rarest_term_drives(self):
+        self.assertEqual(search._driver(['common', 'words', 'rare']), 'rare')
+
+    def test_every_term_must_match(self):
+        expected = [post.id for post in self.posts[::4]]
+        with mock.patch.object(search, 'SEARCH_BATCH', 2):
+            keys = search.search(self.viewer, ['words', 'rare'], None, 10)
+        self.assertEqual(self.ids(keys), expected)
+
+    def test_pages_continue_after_the_cursor(self):
+        expected = [post.id for post in self.posts[::4]]
+        with mock.patch.object(search, 'SEARCH_BATCH', 2):
+            first = search.search(self.viewer, ['common', 'rare'], None, 2)
+            second = search.search(self.viewer, ['common', 'rare'], first[-1], 2)
+        self.assertEqual(self.ids(first + second), expected[:4])
+
+    def common_driver(self):
+        """Walk the postings of "words", where "rare" is one post in four,
+        a page's worth at a time."""
+        return mock.patch.multiple(search, _driver=mock.Mock(return_value='words'), SEARCH_BATCH=1)
+
+    def test_scan_is_capped_per_request(self):
+        with self.common_driver(), mock.patch.object(search, 'SEARCH_MAX_BATCHES', 2):
+            keys = search.search(self.viewer, ['words', 'rare'], None, 3)
+        # Two batches of three postings checked, two of them matches
+        self.assertIsInstance(keys, PartialKeys)
+        self.assertEqual(self.ids(keys.keys), [self.posts[0].id, self.posts[4].id])
+        self.assertEqual(keys.resume[1], self.posts[5].id)
+
+    def test_capped_pages_carry_a_cursor_to_the_rest(self):
+        client = APIClient()
+        client.force_authenticate(self.viewer)
+        found = []
+        url = '/api/posts/search/?q=words+rare'
+        with self.common_driver(), mock.patch.object(search, 'SEARCH_MAX_BATCHES', 1), \
+                mock.patch.object(KeysetPagination, 'page_size', 2):
+            while url:
+                data = client.get(url).data
+                found += [post['id'] for post in data['results']]
+                url = data['next']
+        self.assertEqual(found, [post.id for post in self.posts[::4]])
+
+    def test_migration_indexes_existing_posts(self):
+        PostSearchTerm.objects.filter(post=self.posts[0]).delete()
+        import_module('posts.migrations.0009_post_search_backfill').fill_search_terms(apps, None)
+        self.assertEqual(
+            set(PostSearchTerm.objects.filter(post=self.posts[0]).values_list('term', flat=True)),
+            {'common', 'rare', 'words'}
+        )
+        self.assertIn(self.posts[0].id, self.ids(search.search(self.viewer, ['rare'], None, 10)))
+
+    def test_private_posts_only_for_their_author(self):
+        self.assertNotIn(self.private.id, self.ids(search.search(self.viewer, ['secret', 'rare'], None, 10)))
+        self.assertEqual(self.ids(search.search(self.other, ['secret', 'rare'], None, 10)), [self.private.id])
+
+
+class BuildVariantsTests(TestCase):
+
+    def setUp(self):
+        author = User.objects.create_user(
+            email='author@example.com', first_name='Author', last_name='Test',
+            password='password-123'
+        )
+        self.post = Post.objects.create(author=author, content='photo', image='posts/photo.jpg')
+        Post.objects.filter(pk=self.post.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+        self.post.refresh_from_db()
+
+    def build(self):
+        variants = {'width': 10, 'height': 10, 'sizes': {}}
+        with mock.patch('buddyscript_backend.images.render_variants', return_value=variants):
+            build_variants('posts.Post', self.post.pk, 'image', 'image_variants')
+        return Post.objects.get(pk=self.post.pk)
+
+    def test_stores_variants_and_bumps_updated_at(self):
+        post = self.build()
+        self.assertEqual(post.image_variants['width'], 10)
+        self.assertGreater(post.updated_at, self.post.updated_at)
+
+    def test_newer_upload_is_not_overwritten(self):
+        def replaced_while_rendering(name):
+            Post.objects.filter(pk=self.post.pk).update(image='posts/newer.jpg')
+            return {'width': 10, 'height': 10, 'sizes': {}}
+
+        with mock.patch('buddyscript_backend.images.render_variants', replaced_while_rendering):
+            build_variants('posts.Post', self.post.pk, 'image', 'image_variants')
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertIsNone(post.image_variants)
+        self.assertEqual(post.updated_at, self.post.updated_at)
+
+    def test_variants_of_a_newer_upload_are_deleted(self):
+        def replaced_while_rendering(name):
+            Post.objects.filter(pk=self.post.pk).update(image='posts/newer.jpg')
+            return {'width': 10, 'height': 10, 'sizes': {'feed': {
+                'width': 10, 'height': 10, 'webp': 'posts/photo_feed.webp', 'jpeg': 'posts/photo_feed.jpeg'
+            }}}
+
+        with mock.patch('buddyscript_backend.images.render_variants', replaced_while_rendering), \
+                mock.patch('buddyscript_backend.images.default_storage') as storage:
+            build_variants('posts.Post', self.post.pk, 'image', 'image_variants')
+        self.assertEqual(
+            [call.args for call in storage.delete.call_args_list],
+            [('posts/photo_feed.webp',), ('posts/photo_feed.jpeg',)]
+        )
+
+@override_settings(IMAGE_VARIANTS={'avatar': 40, 'feed': 100, 'full': 400})
+class RenderVariantsTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        patcher = override_settings(MEDIA_ROOT=media.name, MEDIA_URL='/media/')
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        buffer = BytesIO()
+        Image.new('P', (300, 150)).save(buffer, 'PNG')
+        self.name = default_storage.save('posts/wide.png', ContentFile(buffer.getvalue()))
+
+    def test_sizes_keep_the_aspect_ratio_and_never_upscale(self):
+        variants = render_variants(self.name)
+        self.assertEqual((variants['width'], variants['height']), (300, 150))
+        sizes = variants['sizes']
+        self.assertEqual((sizes['feed']['width'], sizes['feed']['height']), (100, 50))
+        self.assertEqual((sizes['full']['width'], sizes['full']['height']), (300, 150))
+        # Avatars are square crops
+        self.assertEqual((sizes['avatar']['width'], sizes['avatar']['height']), (40, 40))
+        for entry in sizes.values():
+            for extension, pil_format in (('webp', 'WEBP'), ('jpeg', 'JPEG')):
+                with default_storage.open(entry[extension]) as stored:
+                    image = Image.open(stored)
+                    self.assertEqual(image.format, pil_format)
+                    self.assertEqual(image.size, (entry['width'], entry['height']))
+
+    def test_urls_and_srcsets(self):
+        urls = variant_urls(render_variants(self.name))
+        self.assertEqual(urls['sizes']['feed']['webp'], '/media/posts/wide_feed.webp')
+        self.assertEqual(
+            urls['srcset']['jpeg'],
+            '/media/posts/wide_feed.jpeg 100w, /media/posts/wide_full.jpeg 300w'
+        )
+        self.assertIsNone(variant_urls(None))
+
+
+
+@override_settings(JOBS_RUN_INLINE=False)
+class ReplacedImageTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = media.name
+        patcher = override_settings(MEDIA_ROOT=self.media)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        self.author = User.objects.create_user(
+            email='author@example.com', first_name='Author', last_name='Test',
+            password='password-123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def upload(self, name):
+        buffer = BytesIO()
+        Image.new('RGB', (40, 30), 'red').save(buffer, 'JPEG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+    def drain(self):
+        while (job := queue.claim()) is not None:
+            queue.run(job)
+
+    def files(self):
+        return {
+            os.path.relpath(os.path.join(root, name), self.media)
+            for root, _, names in os.walk(self.media) for name in names
+        }
+
+    def test_replacing_an_image_deletes_its_variants(self):
+        self.client.post('/api/posts/', {'content': 'photo', 'image': self.upload('old.jpg')})
+        self.drain()
+        post = Post.objects.get(author=self.author)
+        old = {
+            entry[extension] for entry in post.image_variants['sizes'].values()
+            for extension in ('webp', 'jpeg')
+        }
+        self.assertLessEqual(old, self.files())
+
+        response = self.client.patch(f'/api/posts/{post.id}/', {'image': self.upload('new.jpg')})
+        self.assertEqual(response.status_code, 200)
+        self.drain()
+        post.refresh_from_db()
+        new = {
+            entry[extension] for entry in post.image_variants['sizes'].values()
+            for extension in ('webp', 'jpeg')
+        }
+        files = self.files()
+        self.assertFalse(old & files)
+        self.assertLessEqual(new, files)
+
+
+class SeedSocialGraphTests(TestCase):
+
+    def test_stored_counters_match_the_generated_rows(self):
+        out = StringIO()
+        call_command(
+            'seed_social_graph', users=30, posts=60, friends=4, likes=3, comments=2,
+            replies=1, comment_likes=1, days=30, seed=7, chunk_size=40, stdout=out
+        )
+        self.assertIn('Created 30 users', out.getvalue())
+        self.assertEqual(Post.objects.count(), 60)
+
+        for user in User.objects.all():
+            accepted = Friendship.objects.filter(
+                Q(from_user=user) | Q(to_user=user), status='accepted'
+            ).count()
+            self.assertEqual(user.friends_count, accepted)
+            self.assertEqual(user.posts_count, Post.objects.filter(author=user).count())
+        for post in Post.objects.all():
+            self.assertEqual(post.likes_count, PostLike.objects.filter(post=post).count())
+            self.assertEqual(post.comments_count, Comment.objects.filter(post=post).count())
+        for comment in Comment.objects.all():
+            self.assertEqual(comment.likes_count, CommentLike.objects.filter(comment=comment).count())
+            self.assertEqual(comment.replies_count, Comment.objects.filter(parent=comment).count())
+        self.assertTrue(PostLike.objects.exists())
+        self.assertTrue(Comment.objects.filter(parent__isnull=False).exists())
+
+
+class BenchmarkCommandTests(TransactionTestCase):
+
+    def test_short_run_writes_results_as_json(self):
+        build_graph(users=4, posts=3, likes=2, comments=1, replies=1)
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            call_command(
+                'benchmark', duration=1, warmup=0, concurrency=1, users=4,
+                output=output, stdout=StringIO()
+            )
+            with open(output) as source:
+                results = json.load(source)
+
+        self.assertEqual(
+            set(results), {'elapsed', 'requests', 'rps', 'endpoints', 'options', 'database', 'created_at'}
+        )
+        self.assertGreater(results['requests'], 0)
+        self.assertEqual(results['options']['duration'], 1)
+        self.assertEqual(results['requests'], sum(row['requests'] for row in results['endpoints'].values()))
+        for row in results['endpoints'].values():
+            self.assertEqual(set(row), {
+                'requests', 'errors', 'rejected', 'rps', 'p50_ms', 'p95_ms', 'p99_ms',
+                'queries_mean', 'queries_max',
+            })
+            self.assertEqual(row['errors'], 0)
+            self.assertLessEqual(row['p50_ms'], row['p99_ms'])
@@ -0,0 +1,52 @@
+"""Comment threads stored as materialized paths.
+
+Every comment's ``path`` is the fixed-width IDs of its root comment down to
+itself (``Comment.save`` fills it in), so the comments under one comment
+are those whose path starts with its path. With the ``(post, path)`` index
+a whole subtree is one range read however deep it goes; the ``replies``
+endpoint pages through one that way with ``?thread=``. ``replies_count``,
+the embedded reply previews and the plain ``replies`` endpoint use
+``parent`` for the direct replies.
+"""
+from django.conf import settings
+
+from buddyscript_backend.search import prefix_range
+from .models import Comment
+
+
+def _walk(comment):
+    # Replies level by level through ``parent``, for a comment without a path
+    ids, level = {comment.pk}, [comment.pk]
+    while level:
+        level = [
+            pk for pk in Comment.objects.filter(parent_id__in=level).values_list('id', flat=True)
+            if pk not in ids
+        ]
+        ids.update(level)
+    return ids
+
+
+def subtree(comment, include_self=True):
+    """The comment and everything under it, in thread order: each comment
+    followed by its replies, oldest first."""
+    if comment.path:
+        queryset = Comment.objects.filter(
+            post_id=comment.post_id,
+            **prefix_range('path', comment.path)
+        )
+    else:
+        # Saved but not given its path yet (see Comment.save)
+        queryset = Comment.objects.filter(id__in=_walk(comment))
+    if not include_self:
+        queryset = queryset.exclude(pk=comment.pk)
+    return queryset.order_by('path', 'id')
+
+
+def can_reply_to(parent):
+    return parent.depth + 1 < settings.COMMENT_MAX_DEPTH
+
+
+def delete_subtree(comment):
+    """Delete a comment and its replies at every depth with one lookup."""
+    ids = list(subtree(comment).values_list('id', flat=True))
+    Comment.objects.filter(id__in=ids).delete()
@@ -0,0 +1,87 @@
+"""Materialized per-user home timelines.
+
+New posts are pushed (fan-out on write) into ``TimelineEntry`` rows for the
+author and their accepted friends, so reading a timeline is an index range
+read of post IDs followed by one batched hydrate. Authors with more than
+``TIMELINE_FANOUT_LIMIT`` friends are not pushed; their posts are flagged
+``fanned_out=False`` and merged in at read time (fan-out on read).
+"""
+from django.conf import settings
+
+from accounts.friend_cache import friend_ids
+from buddyscript_backend.pagination import keyset_filter
+from .models import Post, TimelineEntry
+
+BATCH_SIZE = 1000
+
+
+def _insert(post, user_ids):
+    entries = [
+        TimelineEntry(user_id=user_id, post_id=post.id, created_at=post.created_at)
+        for user_id in user_ids
+    ]
+    TimelineEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def should_fan_out(author_id):
+    """Return the author's friend IDs to push to, or None to fan out on read."""
+    ids = friend_ids(author_id)
+    if len(ids) > settings.TIMELINE_FANOUT_LIMIT:
+        return None
+    return ids
+
+
+def fan_out(post, recipients=None):
+    """Push a freshly created post into the relevant timelines.
+
+    ``recipients`` is the result of ``should_fan_out`` when the caller has
+    already computed it (to set ``post.fanned_out`` before saving).
+    """
+    user_ids = {post.author_id}
+    if post.visibility == 'public' and post.fanned_out:
+        if recipients is None:
+            recipients = friend_ids(post.author_id)
+        user_ids |= recipients
+    _insert(post, user_ids)
+
+
+def backfill(user_id, author_id):
+    """Copy an author's recent public posts into a new friend's timeline."""
+    posts = Post.objects.filter(
+        author_id=author_id,
+        visibility='public'
+    ).order_by('-created_at').values_list('id', 'created_at')[:settings.TIMELINE_BACKFILL_SIZE]
+    entries = [
+        TimelineEntry(user_id=user_id, post_id=post_id, created_at=created_at)
+        for post_id, created_at in posts
+    ]
+    TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+def remove_author(user_id, author_id):
+    TimelineEntry.objects.filter(user_id=user_id, post__author_id=author_id).delete()
+
+
+def read(user, position, limit):
+    """Return up to ``limit`` ``(created_at, post_id)`` keys after ``position``."""
+    entries = keyset_filter(
+        TimelineEntry.objects.filter(user=user),
+        position,
+        pk_field='post_id'
+    ).order_by('-created_at', '-post_id').values_list('created_at', 'post_id')
+    keys = set(entries[:limit])
+
+    friends = friend_ids(user.id)
+    if friends:
+        pulled = keyset_filter(
+            Post.objects.filter(
+                author_id__in=friends,
+                fanned_out=False,
+                visibility='public'
+            ),
+            position
+        ).order_by('-created_at', '-id').values_list('created_at', 'id')
+        keys.update(pulled[:limit])
+
+    return sorted(keys, reverse=True)[:limit]
+
@@ -1,22 +1,30 @@
 from django.urls import path
 from .views import (
     PostListCreateView,
+    TimelineView,
+    PostSearchView,
     PostDetailView,
     PostLikeToggleView,
     CommentListCreateView,
     CommentDetailView,
+    CommentRepliesView,
     CommentLikeToggleView,
+    LikeBatchView,
     PostLikesListView,
     CommentLikesListView
 )
 
 urlpatterns = [
     path('', PostListCreateView.as_view(), name='post-list-create'),
+    path('timeline/', TimelineView.as_view(), name='timeline'),
+    path('search/', PostSearchView.as_view(), name='post-search'),
     path('<int:pk>/', PostDetailView.as_view(), name='post-detail'),
     path('<int:pk>/like/', PostLikeToggleView.as_view(), name='post-like'),
     path('<int:post_id>/comments/', CommentListCreateView.as_view(), name='comment-list-create'),
     path('comments/<int:pk>/', CommentDetailView.as_view(), name='comment-detail'),
+    path('comments/<int:pk>/replies/', CommentRepliesView.as_view(), name='comment-replies'),
     path('comments/<int:pk>/like/', CommentLikeToggleView.as_view(), name='comment-like'),
+    path('likes/batch/', LikeBatchView.as_view(), name='like-batch'),
     path('posts/<int:post_id>/likes/', PostLikesListView.as_view(), name='post-likes-list'),
     path('comments/<int:comment_id>/likes/', CommentLikesListView.as_view(), name='comment-likes-list'),
 ]
@@ -0,0 +1,95 @@
+from . import counters, like_buffer
+from .models import PostLike, CommentLike
+
+
+class ViewerState:
+    """Per-request cache of what the current user has liked.
+
+    Posts are registered up front (see ``PostListSerializer``) and the first
+    lookup resolves every pending post in one query, so rendering a page of
+    posts, their comments and replies costs one query for post likes and one
+    for comment likes instead of one ``EXISTS`` per object.
+    """
+
+    def __init__(self, user):
+        self.user = user if user is not None and user.is_authenticated else None
+        self.post_ids = set()
+        self.liked_post_ids = set()
+        self.liked_comment_ids = set()
+        # Changes to counts not in the post rows yet: buffered likes and
+        # counter shards
+        self.like_deltas = {}
+        self.comment_deltas = {}
+        self._posts_resolved = set()
+        self._comments_resolved = set()
+
+    def add_posts(self, post_ids):
+        self.post_ids.update(post_ids)
+
+    def _resolve_posts(self):
+        pending = self.post_ids - self._posts_resolved
+        if not pending:
+            return
+        if self.user is not None:
+            self.liked_post_ids.update(
+                PostLike.objects.filter(
+                    user=self.user,
+                    post_id__in=pending
+                ).values_list('post_id', flat=True)
+            )
+        # Buffered likes on hot posts are not in post_likes yet
+        liked, deltas = like_buffer.overlay(self.user and self.user.id, pending)
+        for liked_post_id, is_liked in liked.items():
+            if is_liked:
+                self.liked_post_ids.add(liked_post_id)
+            else:
+                self.liked_post_ids.discard(liked_post_id)
+        self.like_deltas.update(deltas)
+        for post_id, totals in counters.shard_totals(pending).items():
+            self.like_deltas[post_id] = self.like_deltas.get(post_id, 0) + (totals['likes_count'] or 0)
+            self.comment_deltas[post_id] = totals['comments_count'] or 0
+        self._posts_resolved |= pending
+
+    def is_post_liked(self, post_id):
+        if self.user is None:
+            return False
+        self.post_ids.add(post_id)
+        self._resolve_posts()
+        return post_id in self.liked_post_ids
+
+    def likes_count(self, post):
+        self.post_ids.add(post.id)
+        self._resolve_posts()
+        return max(0, post.likes_count + self.like_deltas.get(post.id, 0))
+
+    def comments_count(self, post):
+        self.post_ids.add(post.id)
+        self._resolve_posts()
+        return max(0, post.comments_count + self.comment_deltas.get(post.id, 0))
+
+    def is_comment_liked(self, comment):
+        if self.user is None:
+            return False
+        # Comment likes are resolved per post, which covers every comment
+        # and reply on the page no matter how deep it is nested.
+        self.post_ids.add(comment.post_id)
+        pending = self.post_ids - self._comments_resolved
+        if pending:
+            self.liked_comment_ids.update(
+                CommentLike.objects.filter(
+                    user=self.user,
+                    comment__post_id__in=pending
+                ).values_list('comment_id', flat=True)
+            )
+            self._comments_resolved |= pending
+        return comment.id in self.liked_comment_ids
+
+
+def get_viewer_state(context):
+    """Return the ViewerState shared by every serializer using ``context``."""
+    state = context.get('viewer_state')
+    if state is None:
+        request = context.get('request')
+        state = ViewerState(request.user if request else None)
+        context['viewer_state'] = state
+    return state
@@ -1,30 +1,72 @@
-from rest_framework import generics, status, permissions
+from rest_framework import generics, status, permissions, serializers
+from rest_framework.exceptions import NotFound, PermissionDenied
+from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.pagination import PageNumberPagination
-from django.db.models import Q, Prefetch
-from .models import Post, PostLike, Comment, CommentLike
+from django.db import transaction
+from django.contrib.auth import get_user_model
+from django.db.models import Q, Count, Max, Sum
+from accounts import friend_cache
+from accounts.serializers import VERSION_FIELDS, user_versions
+from buddyscript_backend.http_cache import ConditionalGetMixin, make_etag
+from buddyscript_backend.images import discard_variants, schedule_variants
+from buddyscript_backend.pagination import KeysetPagination
+from events.broker import notify, user_summary
+from jobs.queue import enqueue
+from . import counters, like_buffer, likes, tasks, threads, timeline
+from .prefetch import post_prefetches, comment_prefetches, reply_prefetches, preview_limits
+from .search import index_post, query_terms, search as search_posts
+from .models import Post, PostLike, Comment, CommentLike, PostSearchTerm
 from .serializers import (
     PostSerializer,
     PostCreateSerializer,
     CommentSerializer,
     PostLikeSerializer,
-    CommentLikeSerializer
+    CommentLikeSerializer,
+    LikeBatchSerializer
 )
 
-class CommentPagination(PageNumberPagination):
+User = get_user_model()
+
+
+class CommentPagination(KeysetPagination):
     page_size = 5
     page_size_query_param = 'limit'
     max_page_size = 20
 
-class LikePagination(PageNumberPagination):
+class ReplyPagination(CommentPagination):
+    cursor_only = True
+
+class ThreadPagination(CursorPagination):
+    # Comment paths are unique and sort in thread order
+    ordering = 'path'
+    page_size = 20
+    page_size_query_param = 'limit'
+    max_page_size = 50
+
+class LikePagination(KeysetPagination):
     page_size = 10
     page_size_query_param = 'limit'
     max_page_size = 50
 
 
+def hydrate_posts(user, post_ids, queryset):
+    """Load the posts for ``post_ids`` in one query, keeping their order.
+
+    Visibility is re-checked so a post made private after it was indexed or
+    pushed to a timeline is not shown to other users.
+    """
+    posts = queryset.filter(
+        Q(visibility='public') | Q(author=user),
+        id__in=post_ids
+    ).in_bulk()
+    return [posts[post_id] for post_id in post_ids if post_id in posts]
+
+
 class PostListCreateView(generics.ListCreateAPIView):
     permission_classes = (permissions.IsAuthenticated,)
+    trust_token_claims = True
+    pagination_class = KeysetPagination
 
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -37,36 +79,154 @@ class PostListCreateView(generics.ListCreateAPIView):
         queryset = Post.objects.filter(
             Q(visibility='public') | Q(author=user, visibility='private')
         ).select_related('author').prefetch_related(
-            'likes__user',
-            Prefetch('comments', queryset=Comment.objects.filter(parent=None))
+            *post_prefetches(self.request, preview_limits(self.request))
         )
         return queryset
 
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        recipients = timeline.should_fan_out(self.request.user.id)
+        with transaction.atomic():
+            post = serializer.save(
+                author=self.request.user,
+                fanned_out=recipients is not None
+            )
+            # The author sees the post at once; friends' timelines are
+            # filled by a background job
+            counters.post_created(post)
+            timeline.fan_out(post, set())
+            if recipients and post.visibility == 'public':
+                enqueue(tasks.fan_out_post, post.id)
+            index_post(post)
+            if post.image:
+                schedule_variants(post, 'image', 'image_variants')
+
+
+class KeyedPostListView(generics.ListAPIView):
+    """Base for post lists that page over ``(created_at, post_id)`` keys read
+    from an index table and then hydrate the page in one query."""
+    serializer_class = PostSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+    trust_token_claims = True
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        return Post.objects.select_related('author').prefetch_related(
+            *post_prefetches(self.request, preview_limits(self.request))
+        )
 
+    def fetch_keys(self, position, limit):
+        raise NotImplementedError
 
-class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
+    def list(self, request, *args, **kwargs):
+        keys = self.paginator.paginate_keys(self.fetch_keys, request)
+        posts = hydrate_posts(
+            request.user,
+            [post_id for _, post_id in keys],
+            self.get_queryset()
+        )
+        serializer = self.get_serializer(posts, many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+class TimelineView(KeyedPostListView):
+    """Home timeline: the user's own posts and their friends' posts"""
+
+    def fetch_keys(self, position, limit):
+        return timeline.read(self.request.user, position, limit)
+
+
+class PostSearchView(KeyedPostListView):
+    """Search post content, newest first"""
+
+    def fetch_keys(self, position, limit):
+        terms = query_terms(self.request.query_params.get('q', ''))
+        return search_posts(self.request.user, terms, position, limit)
+
+
+def viewer_etag(request, *parts):
+    """ETag over ``parts`` plus the viewer-specific state in the response
+    (is_liked, friendship_status) and the requested page."""
+    user_id = request.user.id
+    return make_etag(
+        *parts,
+        request.get_full_path(),
+        user_id,
+        friend_cache.fingerprint(user_id)
+    )
+
+
+class PostDetailView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = PostSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    trust_token_claims = True
+
+    def get_etag(self, request, pk):
+        user = request.user
+        post = Post.objects.filter(
+            Q(visibility='public') | Q(author=user, visibility='private'),
+            pk=pk
+        ).annotate(
+            last_like=Max('likes__id'), like_rows=Count('likes__id')
+        ).values_list(
+            'author_id', 'updated_at', 'likes_count', 'comments_count', 'last_like', 'like_rows'
+        ).first()
+        if post is None:
+            return None
+        # The response embeds every comment and liker of the post, and the
+        # users behind them
+        comments = Comment.objects.filter(post_id=pk).aggregate(
+            Max('id'), Max('updated_at'), Count('id'), Sum('likes_count')
+        )
+        comment_likes = CommentLike.objects.filter(comment__post_id=pk).aggregate(
+            Max('id'), Count('id')
+        )
+        users = User.objects.filter(
+            Q(id=post[0]) |
+            Q(id__in=PostLike.objects.filter(post_id=pk).values('user_id')) |
+            Q(id__in=Comment.objects.filter(post_id=pk).values('author_id')) |
+            Q(id__in=CommentLike.objects.filter(comment__post_id=pk).values('user_id'))
+        ).only(*VERSION_FIELDS)
+        # Counts not in the post row yet: buffered likes and counter shards
+        buffered = like_buffer.overlay(user.id, [pk])
+        shards = counters.shard_totals([pk])
+        return viewer_etag(
+            request, 'post', pk, *post,
+            *comments.values(), *comment_likes.values(),
+            buffered, shards, user_versions(users)
+        )
 
     def get_queryset(self):
         user = self.request.user
         return Post.objects.filter(
             Q(visibility='public') | Q(author=user, visibility='private')
-        ).select_related('author').prefetch_related('likes__user', 'comments')
+        ).select_related('author').prefetch_related(*post_prefetches(self.request))
 
     def perform_update(self, serializer):
         # Only allow author to update
         if serializer.instance.author != self.request.user:
-            raise permissions.PermissionDenied("You can only edit your own posts.")
-        serializer.save()
+            raise PermissionDenied("You can only edit your own posts.")
+        new_image = 'image' in serializer.validated_data
+        with transaction.atomic():
+            if new_image:
+                discard_variants(serializer.instance.image_variants)
+                post = serializer.save(image_variants=None)
+            else:
+                post = serializer.save()
+            index_post(post)
+            if new_image and post.image:
+                schedule_variants(post, 'image', 'image_variants')
 
     def perform_destroy(self, instance):
         # Only allow author to delete
         if instance.author != self.request.user:
-            raise permissions.PermissionDenied("You can only delete your own posts.")
-        instance.delete()
+            raise PermissionDenied("You can only delete your own posts.")
+        # Hide the post now; its comments, likes and timeline entries can be
+        # numerous, so the cascading delete runs as a background job
+        with transaction.atomic():
+            Post.objects.filter(pk=instance.pk).update(is_deleted=True)
+            counters.post_deleted(instance)
+            PostSearchTerm.objects.filter(post=instance).delete()
+            enqueue(tasks.purge_post, instance.pk)
 
 
 class PostLikeToggleView(APIView):
@@ -88,64 +248,141 @@ class PostLikeToggleView(APIView):
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        like, created = PostLike.objects.get_or_create(
-            user=request.user,
-            post=post
-        )
-
-        if not created:
-            like.delete()
-            return Response({
-                'liked': False,
-                'likes_count': post.likes_count
+        if like_buffer.buffers(post.pk):
+            # Written by the like buffer's next flush
+            liked, likes_count = like_buffer.toggle(request.user.id, post)
+        else:
+            with transaction.atomic():
+                like, liked = PostLike.objects.get_or_create(
+                    user=request.user,
+                    post=post
+                )
+                if not liked:
+                    like.delete()
+                counters.post_liked(post.pk, 1 if liked else -1)
+            post.refresh_from_db(fields=['likes_count'])
+            likes_count = counters.post_counts(post)['likes_count']
+
+        if liked and post.author_id != request.user.id:
+            notify(post.author_id, 'post_liked', {
+                'post_id': post.id,
+                'user': user_summary(request.user),
+                'likes_count': likes_count,
             })
-
         return Response({
-            'liked': True,
-            'likes_count': post.likes_count
+            'liked': liked,
+            'likes_count': likes_count
         })
 
 
 class CommentListCreateView(generics.ListCreateAPIView):
     serializer_class = CommentSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    trust_token_claims = True
     pagination_class = CommentPagination
 
     def get_queryset(self):
         post_id = self.kwargs.get('post_id')
         return Comment.objects.filter(
             post_id=post_id,
+            post__is_deleted=False,
             parent=None
-        ).select_related('author').prefetch_related('likes__user', 'replies')
+        ).select_related('author').prefetch_related(*comment_prefetches(self.request))
 
     def perform_create(self, serializer):
         post_id = self.kwargs.get('post_id')
         try:
             post = Post.objects.get(pk=post_id)
         except Post.DoesNotExist:
-            raise serializers.ValidationError("Post not found")
+            raise NotFound("Post not found")
 
         # Check if post is accessible
         if post.visibility == 'private' and post.author != self.request.user:
-            raise permissions.PermissionDenied("You cannot comment on this post.")
-
-        serializer.save(author=self.request.user, post=post)
+            raise PermissionDenied("You cannot comment on this post.")
+
+        parent = serializer.validated_data.get('parent')
+        if parent is not None:
+            if parent.post_id != post.id:
+                raise serializers.ValidationError("Parent comment must belong to the same post.")
+            if not threads.can_reply_to(parent):
+                raise serializers.ValidationError("This thread is too deep to reply to.")
+
+        with transaction.atomic():
+            comment = serializer.save(author=self.request.user, post=post)
+            counters.comment_created(comment)
+
+        # Tell the post's author and, for a reply, the parent comment's author
+        recipients = {post.author_id}
+        if comment.parent_id:
+            recipients.add(comment.parent.author_id)
+        recipients.discard(self.request.user.id)
+        for user_id in recipients:
+            notify(user_id, 'comment_created', {
+                'post_id': post.id,
+                'comment_id': comment.id,
+                'parent_id': comment.parent_id,
+                'user': user_summary(self.request.user),
+            })
 
 
 class CommentDetailView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = CommentSerializer
     permission_classes = (permissions.IsAuthenticated,)
-    queryset = Comment.objects.all()
+
+    def get_queryset(self):
+        return Comment.objects.filter(post__is_deleted=False).select_related(
+            'author'
+        ).prefetch_related(*comment_prefetches(self.request))
 
     def perform_update(self, serializer):
         if serializer.instance.author != self.request.user:
-            raise permissions.PermissionDenied("You can only edit your own comments.")
+            raise PermissionDenied("You can only edit your own comments.")
         serializer.save()
 
     def perform_destroy(self, instance):
         if instance.author != self.request.user:
-            raise permissions.PermissionDenied("You can only delete your own comments.")
-        instance.delete()
+            raise PermissionDenied("You can only delete your own comments.")
+        with transaction.atomic():
+            counters.comment_deleted(instance)
+            threads.delete_subtree(instance)
+
+
+class CommentRepliesView(generics.ListAPIView):
+    """Direct replies of a comment, newest first, one cursor page at a time.
+
+    Comment lists embed only the newest few replies of each comment; this
+    loads the rest. With ``?thread=`` it returns every comment under this
+    one at any depth instead, in thread order (each comment followed by its
+    replies, oldest first), paged as one range read over comment paths.
+    """
+    serializer_class = CommentSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+    trust_token_claims = True
+
+    @property
+    def pagination_class(self):
+        return ThreadPagination if self.threaded() else ReplyPagination
+
+    def threaded(self):
+        return 'thread' in self.request.query_params
+
+    def get_queryset(self):
+        user = self.request.user
+        visible = Q(post__visibility='public') | Q(post__author_id=user.id)
+        if self.threaded():
+            comment = Comment.objects.filter(
+                visible, pk=self.kwargs.get('pk'), post__is_deleted=False
+            ).first()
+            if comment is None:
+                raise NotFound('Comment not found')
+            queryset = threads.subtree(comment, include_self=False)
+        else:
+            queryset = Comment.objects.filter(
+                visible,
+                parent_id=self.kwargs.get('pk'),
+                post__is_deleted=False
+            )
+        return queryset.select_related('author').prefetch_related(*reply_prefetches(self.request))
 
 
 class CommentLikeToggleView(APIView):
@@ -153,45 +390,91 @@ class CommentLikeToggleView(APIView):
 
     def post(self, request, pk):
         try:
-            comment = Comment.objects.get(pk=pk)
+            comment = Comment.objects.get(pk=pk, post__is_deleted=False)
         except Comment.DoesNotExist:
             return Response(
                 {'error': 'Comment not found'},
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        like, created = CommentLike.objects.get_or_create(
-            user=request.user,
-            comment=comment
-        )
-
-        if not created:
-            like.delete()
-            return Response({
-                'liked': False,
-                'likes_count': comment.likes_count
+        with transaction.atomic():
+            like, created = CommentLike.objects.get_or_create(
+                user=request.user,
+                comment=comment
+            )
+            if not created:
+                like.delete()
+            counters.comment_liked(comment.pk, 1 if created else -1)
+
+        comment.refresh_from_db(fields=['likes_count'])
+        if created and comment.author_id != request.user.id:
+            notify(comment.author_id, 'comment_liked', {
+                'post_id': comment.post_id,
+                'comment_id': comment.id,
+                'user': user_summary(request.user),
+                'likes_count': comment.likes_count,
             })
-
         return Response({
-            'liked': True,
+            'liked': created,
             'likes_count': comment.likes_count
         })
 
-class PostLikesListView(generics.ListAPIView):
+class LikeBatchView(APIView):
+    """Apply many like/unlike operations at once (offline replay, rapid taps).
+
+    Each operation sets a state rather than toggling, so replaying a batch
+    is harmless; the response holds the final state of every target.
+    """
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def post(self, request):
+        serializer = LikeBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(likes.apply_batch(request.user, serializer.validated_data['operations']))
+
+
+class LikersConditionalGetMixin(ConditionalGetMixin):
+    """ETag over the requested page itself: the likes on it, how the list
+    goes on, and the version of every liker shown."""
+
+    def get_etag(self, request, **kwargs):
+        likes = self.paginate_queryset(self.get_queryset())
+        paginator = self.paginator
+        if paginator.keyset:
+            rest = paginator.next_position
+        else:
+            rest = paginator.page.paginator.count
+        return viewer_etag(
+            request, self.etag_prefix, [like.id for like in likes], rest,
+            user_versions(like.user for like in likes)
+        )
+
+
+class PostLikesListView(LikersConditionalGetMixin, generics.ListAPIView):
     serializer_class = PostLikeSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    trust_token_claims = True
     pagination_class = LikePagination
+    etag_prefix = 'post-likes'
 
     def get_queryset(self):
         post_id = self.kwargs.get('post_id')
-        return PostLike.objects.filter(post_id=post_id).select_related('user')
+        return PostLike.objects.filter(
+            post_id=post_id,
+            post__is_deleted=False
+        ).select_related('user')
 
 
-class CommentLikesListView(generics.ListAPIView):
+class CommentLikesListView(LikersConditionalGetMixin, generics.ListAPIView):
     serializer_class = CommentLikeSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    trust_token_claims = True
     pagination_class = LikePagination
+    etag_prefix = 'comment-likes'
 
     def get_queryset(self):
         comment_id = self.kwargs.get('comment_id')
-        return CommentLike.objects.filter(comment_id=comment_id).select_related('user')
+        return CommentLike.objects.filter(
+            comment_id=comment_id,
+            comment__post__is_deleted=False
+        ).select_related('user')